@@ -0,0 +1,372 @@
+#!/usr/bin/env python3
+"""End-to-end benchmark for SetupWizard.run on Linux
+
+Runs the whole wizard against stub node/npm/claude executables with
+configurable latency, an in-memory winreg (or real rc files in a scratch
+home with --backend posix), a scripted input() and a local stand-in registry.
+Reports module import time against a budget, wall time, time per step,
+subprocess spawns and bytes written to the console and the log, and appends
+the result to benchmarks/results.jsonl so runs can be compared across commits.
+
+    python benchmarks/bench_wizard.py --runs 5
+    python benchmarks/bench_wizard.py --scenario update --npm-latency 0.8 --compare
+"""
+import argparse
+import builtins
+import http.server
+import io
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import types
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+REPO = Path(__file__).resolve().parent.parent
+RESULTS = Path(__file__).resolve().parent / 'results.jsonl'
+
+STUB_VERSION = '1.0.0'
+
+class FakeWinreg(types.ModuleType):
+    """In-memory stand-in for the parts of winreg the wizard uses"""
+
+    HKEY_CURRENT_USER = 'HKCU'
+    HKEY_LOCAL_MACHINE = 'HKLM'
+    KEY_READ = 0x20019
+    KEY_WRITE = 0x20006
+    REG_SZ = 1
+    REG_EXPAND_SZ = 2
+
+    def __init__(self):
+        super().__init__('winreg')
+        self.values: Dict[tuple, Any] = {}
+        self.writes = 0
+
+    def OpenKey(self, root, sub_key, reserved=0, access=0):
+        return (root, sub_key)
+
+    def CloseKey(self, key):
+        pass
+
+    def QueryValueEx(self, key, name):
+        if (key, name) not in self.values:
+            raise FileNotFoundError(name)
+        return self.values[(key, name)], self.REG_EXPAND_SZ
+
+    def SetValueEx(self, key, name, reserved, kind, value):
+        self.writes += 1
+        self.values[(key, name)] = value
+
+
+class CountingStream(io.TextIOBase):
+    """Console replacement counting what the wizard writes"""
+
+    def __init__(self, echo=None):
+        self.echo = echo
+        self.bytes = 0
+        self.writes = 0
+
+    def write(self, data):
+        self.bytes += len(data.encode('utf-8'))
+        self.writes += 1
+        if self.echo is not None:
+            self.echo.write(data)
+        return len(data)
+
+    def flush(self):
+        if self.echo is not None:
+            self.echo.flush()
+
+
+def write_stubs(bin_dir: Path, prefix: Path, args: argparse.Namespace):
+    """Create node/npm/claude shell stubs with the configured latencies"""
+    posix = args.backend == 'posix'
+    shims = prefix / 'bin' if posix else prefix  # Where npm links global executables
+    # The Windows flow resolves claude.cmd through PATHEXT but probes spawn a bare `claude` via /bin/sh
+    names = ['claude'] if posix else ['claude.cmd', 'claude']
+    modules = 'lib/node_modules' if posix else 'node_modules'
+
+    def claude(version: str) -> str:
+        return f'#!/bin/sh\nsleep {args.claude_latency}\necho "{version} (Claude Code)"\n'
+
+    stubs = {
+        'node': f'#!/bin/sh\nsleep {args.node_latency}\necho v20.11.0\n',
+        'npm': (
+            '#!/bin/sh\n'
+            f'sleep {args.npm_latency}\n'
+            'case "$1" in\n'
+            '  --version) echo 10.2.4 ;;\n'
+            f'  config) echo "{prefix}" ;;\n'
+            '  install)\n'
+            # Honour --prefix so staged updates land in their own prefix
+            f'    dest="{prefix}"; prev=""\n'
+            '    for arg in "$@"; do [ "$prev" = "--prefix" ] && dest="$arg"; prev="$arg"; done\n'
+            f'    i=0; while [ $i -lt {args.install_lines} ]; do\n'
+            '      echo "npm http fetch GET 200 https://registry.example/pkg-$i"\n'
+            f'      sleep {args.install_latency / max(args.install_lines, 1):.4f}; i=$((i+1))\n'
+            '    done\n'
+            f'    bin="$dest{"/bin" if posix else ""}"; pkg="$dest/{modules}/@anthropic-ai/claude-code"\n'
+            '    mkdir -p "$bin" "$pkg"\n'
+            f'    echo \'{{"version": "{args.latest}"}}\' > "$pkg/package.json"\n'
+            + ''.join(f"    cat > \"$bin/{name}\" <<'EOF'\n{claude(args.latest)}EOF\n"
+                      f'    chmod +x "$bin/{name}"\n' for name in names) +
+            '    echo "added 1 package" ;;\n'
+            'esac\n'
+        ),
+    }
+    bin_dir.mkdir(parents=True, exist_ok=True)
+    for name, body in stubs.items():
+        path = bin_dir / name
+        path.write_text(body)
+        path.chmod(0o755)
+    if args.scenario != 'fresh':
+        shims.mkdir(parents=True, exist_ok=True)
+        for name in names:
+            (shims / name).write_text(claude(STUB_VERSION))
+            (shims / name).chmod(0o755)
+
+
+def start_registry(latest: str) -> http.server.ThreadingHTTPServer:
+    """Local stand-in for the npm registry's package document endpoint"""
+    body = json.dumps({'name': '@anthropic-ai/claude-code', 'dist-tags': {'latest': latest},
+                       'versions': {latest: {'version': latest}}}).encode('utf-8')
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('ETag', f'"{latest}"')
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def run_once(args: argparse.Namespace, workdir: Path, registry_url: str) -> Dict[str, Any]:
+    """Run the wizard end to end in an isolated home and collect measurements"""
+    home = workdir / 'home'
+    (home / 'Desktop').mkdir(parents=True, exist_ok=True)
+    prefix = workdir / 'npm-prefix'
+    write_stubs(workdir / 'bin', prefix, args)
+    os.environ.update({
+        'HOME': str(home),
+        'PATH': os.pathsep.join([str(workdir / 'bin'), str(prefix), str(prefix / 'bin'), '/usr/bin', '/bin']),
+        'npm_config_prefix': str(prefix),
+        'npm_config_registry': registry_url,
+    })
+
+    sys.modules['winreg'] = FakeWinreg()
+    for name in [name for name in sys.modules if name == 'claude_setup_wizard']:
+        del sys.modules[name]  # CACHE_DIR and friends are computed at import time
+    sys.path.insert(0, str(REPO))
+    import claude_setup_wizard as wizard_module
+
+    spawns: List[str] = []
+    real_popen = subprocess.Popen
+
+    class CountingPopen(real_popen):
+        def __init__(self, cmd, *popen_args, **popen_kwargs):
+            spawns.append(cmd if isinstance(cmd, str) else ' '.join(map(str, cmd)))
+            super().__init__(cmd, *popen_args, **popen_kwargs)
+
+    answers = iter(['y' if args.scenario == 'update' else 'n'] + [''] * 10)
+    console = CountingStream(sys.__stdout__ if args.show else None)
+
+    class BenchWindowsBackend(wizard_module.WindowsBackend):
+        def is_admin(self) -> bool:
+            return True
+
+        def needs_interpreter(self, executable: Path) -> bool:
+            return False  # The .cmd launchers here are sh scripts (see write_shim)
+
+        def write_shim(self, shim: Path, target: Path):
+            # .cmd/.ps1 bodies cannot run here; switch every launcher to an sh exec of the target
+            tmp = shim.with_name(f".{shim.name}.tmp")
+            tmp.write_text(f'#!/bin/sh\nexec "{target}" "$@"\n')
+            tmp.chmod(0o755)
+            os.replace(tmp, shim)
+
+    backend = BenchWindowsBackend() if args.backend == 'windows' else wizard_module.PosixBackend()
+
+    subprocess.Popen = CountingPopen
+    real_input, builtins.input = builtins.input, lambda prompt='': (console.write(prompt), next(answers))[1]
+    real_stdout, sys.stdout = sys.stdout, console
+    pacing = (wizard_module.Pacing(answers={'update': args.scenario == 'update'}) if args.paced
+              else wizard_module.Pacing.unattended({'update': args.scenario == 'update'}))
+    start = time.perf_counter()
+    exit_code = 0
+    try:
+        wizard = wizard_module.SetupWizard(pacing=pacing, use_cache=not args.no_cache, backend=backend,
+                                           verify_spawn=not args.no_verify_spawn)
+        try:
+            wizard.run()
+        except SystemExit as e:
+            exit_code = e.code or 0
+        wall = time.perf_counter() - start
+        wizard.run_log.close()
+    finally:
+        subprocess.Popen = real_popen
+        builtins.input = real_input
+        sys.stdout = real_stdout
+        sys.path.remove(str(REPO))
+
+    steps = {span['name']: round(span['dur'], 4) for span in wizard.tracer.spans if span['cat'] == 'step'}
+    log_bytes = wizard.log_file.stat().st_size if wizard.log_file and wizard.log_file.exists() else 0
+    return {'wall': round(wall, 4), 'exit_code': exit_code, 'steps': steps, 'spawns': len(spawns),
+            'spawned': spawns, 'console_bytes': console.bytes, 'console_writes': console.writes,
+            'log_bytes': log_bytes, 'path_writes': sum(span['name'] == 'write user PATH' for span in wizard.tracer.spans), 'errors': list(wizard.errors)}
+
+
+def import_time_ms(samples: int = 5) -> float:
+    """Median cumulative `-X importtime` of the wizard module, each in a fresh interpreter"""
+    import py_compile
+    py_compile.compile(str(REPO / 'claude_setup_wizard.py'))  # Time the import, not compiling (the .exe ships bytecode)
+    code = f"import sys; sys.path.insert(0, {str(REPO)!r}); import claude_setup_wizard"
+    times = []
+    for _ in range(samples):
+        result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], capture_output=True, text=True)
+        for line in result.stderr.splitlines():
+            parts = [part.strip() for part in line.split('|')]
+            if len(parts) == 3 and parts[2] == 'claude_setup_wizard':
+                times.append(int(parts[1]) / 1000)
+    return round(statistics.median(times), 2) if times else float('nan')
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=str(REPO), capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def summarize(runs: List[Dict[str, Any]], import_ms: float) -> Dict[str, Any]:
+    """Medians over all runs"""
+    steps = sorted({name for run in runs for name in run['steps']})
+    return {
+        'import_ms': import_ms,
+        'wall': round(statistics.median(run['wall'] for run in runs), 4),
+        'steps': {name: round(statistics.median(run['steps'].get(name, 0) for run in runs), 4) for name in steps},
+        'spawns': statistics.median(run['spawns'] for run in runs),
+        'console_bytes': statistics.median(run['console_bytes'] for run in runs),
+        'log_bytes': statistics.median(run['log_bytes'] for run in runs),
+    }
+
+
+def previous_result(config: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Latest stored result recorded with the same configuration"""
+    try:
+        lines = RESULTS.read_text(encoding='utf-8').splitlines()
+    except OSError:
+        return None
+    for line in reversed(lines):
+        try:
+            record = json.loads(line)
+        except ValueError:
+            continue
+        if record.get('config') == config:
+            return record
+    return None
+
+
+def report(summary: Dict[str, Any], previous: Optional[Dict[str, Any]], budget: Optional[float]):
+    def delta(key: str, value: float, old: Optional[Dict[str, Any]]) -> str:
+        if not old or key not in old:
+            return ''
+        base = old[key]
+        return f"  ({value - base:+.3f}, was {base:.3f})" if base else ''
+
+    old = previous['summary'] if previous else None
+    verdict = ''
+    if budget is not None:
+        verdict = f" ({'within' if summary['import_ms'] <= budget else 'OVER'} the {budget:.0f}ms budget)"
+    print(f"\nimport time    {summary['import_ms']:.1f}ms{verdict}{delta('import_ms', summary['import_ms'], old)}")
+    print(f"wall time      {summary['wall']:.3f}s{delta('wall', summary['wall'], old)}")
+    print(f"spawns         {summary['spawns']}{delta('spawns', summary['spawns'], old)}")
+    print(f"console bytes  {summary['console_bytes']}{delta('console_bytes', summary['console_bytes'], old)}")
+    print(f"log bytes      {summary['log_bytes']}{delta('log_bytes', summary['log_bytes'], old)}")
+    print('steps:')
+    for name, seconds in summary['steps'].items():
+        print(f"  {name:<32} {seconds:.3f}s{delta(name, seconds, old['steps'] if old else None)}")
+    if previous:
+        print(f"\ncompared with {previous.get('commit')} recorded {previous.get('recorded')}")
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--backend', choices=('windows', 'posix'), default='windows',
+                        help='Windows flow against the in-memory winreg, or the rc-file POSIX backend')
+    parser.add_argument('--scenario', choices=('fresh', 'current', 'update'), default='fresh',
+                        help='fresh install, rerun with the latest already installed, or accepted update')
+    parser.add_argument('--node-latency', type=float, default=0.2, help='seconds per node spawn')
+    parser.add_argument('--npm-latency', type=float, default=0.8, help='seconds per npm spawn (cold start)')
+    parser.add_argument('--claude-latency', type=float, default=0.4, help='seconds per claude spawn')
+    parser.add_argument('--install-latency', type=float, default=2.0, help='seconds npm install streams output')
+    parser.add_argument('--install-lines', type=int, default=20, help='lines npm install prints')
+    parser.add_argument('--paced', action='store_true', help='keep the interactive pauses')
+    parser.add_argument('--no-cache', action='store_true', help='run the wizard with --no-cache')
+    parser.add_argument('--no-verify-spawn', action='store_true', help='run the wizard with --no-verify-spawn')
+    parser.add_argument('--warm', action='store_true', help='reuse one home across runs (warm caches)')
+    parser.add_argument('--show', action='store_true', help='echo the wizard console output')
+    parser.add_argument('--compare', action='store_true', help='show deltas against the last stored result')
+    parser.add_argument('--import-budget', type=float, metavar='MS',
+                        help='exit with 1 when importing the wizard takes longer than this (import time '
+                             'varies by machine and load, so there is no default)')
+    parser.add_argument('--no-save', action='store_true', help='do not append to results.jsonl')
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    if os.name == 'nt':
+        print('The benchmark uses POSIX shell stubs; run it on Linux or macOS.')
+        return 2
+    config = {key: getattr(args, key) for key in ('backend', 'scenario', 'node_latency', 'npm_latency', 'claude_latency',
+                                                  'install_latency', 'install_lines', 'paced', 'no_cache', 'warm',
+                                                  'no_verify_spawn')}
+    args.latest = STUB_VERSION if args.scenario == 'current' else '9.9.9'
+    registry = start_registry(args.latest)
+    url = f"http://127.0.0.1:{registry.server_address[1]}/"
+    saved_env = dict(os.environ)
+    runs = []
+    try:
+        shared = tempfile.TemporaryDirectory(prefix='claude-bench-')
+        for index in range(args.runs):
+            with tempfile.TemporaryDirectory(prefix='claude-bench-') as fresh:
+                workdir = Path(shared.name if args.warm else fresh)
+                run = run_once(args, workdir, url)
+            os.environ.clear()
+            os.environ.update(saved_env)
+            runs.append(run)
+            print(f"run {index + 1}/{args.runs}: {run['wall']:.3f}s, {run['spawns']} spawns, "
+                  f"exit {run['exit_code']}" + (f", errors: {run['errors']}" if run['errors'] else ''))
+        shared.cleanup()
+    finally:
+        registry.shutdown()
+
+    summary = summarize(runs, import_time_ms())
+    previous = previous_result(config) if args.compare else None
+    report(summary, previous, args.import_budget)
+    if not args.no_save:
+        record = {'commit': git_commit(), 'recorded': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                  'python': platform.python_version(), 'config': config, 'summary': summary,
+                  'runs': [{key: value for key, value in run.items() if key != 'spawned'} for run in runs]}
+        with open(RESULTS, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(record) + '\n')
+    return 1 if args.import_budget is not None and summary['import_ms'] > args.import_budget else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -2,253 +2,2749 @@
 """Claude Code Setup Wizard - Professional installer for Windows"""
 import os
 import sys
-import subprocess
-import winreg
+import abc
+import argparse
+import atexit
 import time
-import shutil
-import ctypes
+import re
+import threading
+import urllib.parse
+from collections import deque
 from pathlib import Path
-from datetime import datetime
-from typing import Tuple, Optional, List
+from typing import TYPE_CHECKING, Tuple, Optional, List, Any, Callable, Dict, Union
+
+if TYPE_CHECKING:
+    import queue
+    from http.server import ThreadingHTTPServer
 
 # Version info
 SCRIPT_VERSION = "2.0.3"
 SCRIPT_NAME = "Claude Code Setup Wizard"
 
-class Colors:
-    """Enhanced color palette with bright/bold styling"""
-    # Brand colors (bright + bold)
-    PRIMARY = '\033[1;38;5;105m'       # Bright Purple
-    SECONDARY = '\033[1;38;5;81m'      # Bright Light Blue
+# npm package installed by the wizard
+PACKAGE_NAME = '@anthropic-ai/claude-code'
+
+# Seconds registry metadata is trusted before it is revalidated
+REGISTRY_TTL = 3600
+
+# Per-user cache for probe results and downloaded metadata
+CACHE_DIR = Path.home() / '.claude_setup_cache'
+
+# One log file per run
+LOG_DIR = Path.home() / '.claude_setup_logs'
+
+# Seconds without any npm output before an install is considered hung
+NPM_IDLE_TIMEOUT = 120.0
+
+# Installed versions kept in the snapshot store for rollback
+KEEP_VERSIONS = 3
+
+# Seconds between update agent checks, and before the first retry after a failed one
+AGENT_INTERVAL = 6 * 3600
+AGENT_RETRY = 60
+
+# Profiles or prefixes provisioned at the same time by --profiles / --prefixes
+PROVISION_JOBS = 4
+# Folders a wildcard such as C:\Users\* matches that are not user profiles
+SYSTEM_PROFILES = ('All Users', 'Default', 'Default User', 'defaultuser0', 'Public', 'lost+found')
+
+class Colors:
+    """Enhanced color palette with bright/bold styling"""
+    # Brand colors (bright + bold)
+    PRIMARY = '\033[1;38;5;105m'       # Bright Purple
+    SECONDARY = '\033[1;38;5;81m'      # Bright Light Blue
+
+    # Status colors (bright + bold)
+    SUCCESS = '\033[1;38;5;82m'        # Bright Green
+    ERROR = '\033[1;38;5;196m'         # Bright Red
+    WARNING = '\033[1;38;5;226m'       # Bright Yellow
+    INFO = '\033[1;38;5;39m'           # Bright Blue
+
+    # UI colors (bright + bold)
+    WHITE = '\033[1;97m'               # Bright White
+    GRAY = '\033[1;38;5;245m'          # Bright Gray
+    DIM = '\033[2;38;5;240m'           # Dim Gray
+    CYAN = '\033[1;38;5;51m'           # Bright Cyan
+    MAGENTA = '\033[1;38;5;171m'       # Soft Magenta
+    PINK = '\033[1;38;5;213m'          # Bright Pink
+
+    # Effects
+    RESET = '\033[0m'
+    BOLD = '\033[1m'
+    ITALIC = '\033[3m'
+    UNDERLINE = '\033[4m'
+
+class Icons:
+    """Enhanced CMD-compatible icons"""
+    # Status icons (keeping ones that work, replacing problematic ones)
+    CHECK = '√'           # Works well in CMD
+    CROSS = 'x'           # Simple and clear
+    WARNING = '!'         # Clear and visible
+    INFO = 'i'            # Simple replacement for ℹ
+    ARROW = '>'           # Simple and clear
+    BULLET = '•'          # Works well
+    STAR = '*'            # Universal
+    GEAR = '~'            # Simple replacement for ⚙
+
+    # Claude-style loading animation (star sequence)
+    LOADING = ['·', '✢', '✶', '✶', '✶', '*', '*', '✢', '·', '✻', '*']
+
+class Renderer:
+    """Builds console frames in memory and writes each one in a single call"""
+
+    ANSI = re.compile(r'\033\[[0-9;?]*[A-Za-z]')
+    WIDTH = 60
+    BANNER_ROWS = 5  # Blank line, three box lines, blank line
+
+    def __init__(self, stream=None):
+        self.stream = stream or sys.stdout
+        # Optional hook that may take over output: router(item) -> True if consumed.
+        # item is text, a deferred callable, or None for an in-place redraw.
+        self.router: Optional[Callable[[Any], bool]] = None
+        self.lock = threading.RLock()
+        self._live: Optional[str] = None
+
+    @classmethod
+    def visible_len(cls, text: str) -> int:
+        """Printed width of a string, ignoring ANSI escape sequences"""
+        return len(cls.ANSI.sub('', text))
+
+    @classmethod
+    def fit(cls, text: str, width: int) -> str:
+        """Pad or truncate to an exact printed width"""
+        length = cls.visible_len(text)
+        if length > width:
+            text = cls.ANSI.sub('', text)[:width - 3] + '...'
+            length = width
+        return text + ' ' * (width - length)
+
+    @classmethod
+    def box(cls, rows: List[str], color: str, title: Optional[str] = None, center: bool = True,
+            width: int = WIDTH) -> List[str]:
+        """Lines of a bordered box, padded by printed width rather than len()"""
+        inner = width - 2
+        lines = [f"  {color}┌{'─' * inner}┐{Colors.RESET}"]
+        if title is not None:
+            title = title.center(inner - 2) if center else cls.fit(title, inner - 2)
+            lines.append(f"  {color}│{Colors.RESET} {Colors.BOLD}{title}{Colors.RESET} {color}│{Colors.RESET}")
+            if rows:
+                lines.append(f"  {color}├{'─' * inner}┤{Colors.RESET}")
+        for row in rows:
+            lines.append(f"  {color}│{Colors.RESET} {cls.fit(row, inner - 2)}{Colors.RESET} {color}│{Colors.RESET}")
+        lines.append(f"  {color}└{'─' * inner}┘{Colors.RESET}")
+        return lines
+
+    def emit(self, lines: List[str], end: str = '\n'):
+        """Write a whole frame with one console write"""
+        self.write('\n'.join(lines) + end)
+
+    def clear(self, keep_rows: int = 0) -> str:
+        """ANSI sequence clearing the screen below the first keep_rows rows"""
+        if keep_rows:
+            return f"\033[{keep_rows + 1};1H\033[J"
+        return '\033[H\033[2J\033[3J'
+
+    def live(self, text: str):
+        """Redraw the in-place line (spinner, progress) only when it changed"""
+        with self.lock:
+            if self._routed(None) or text == self._live:
+                return
+            self._live = text
+            self._write(f"\r{text}\033[K")
+
+    def end_live(self, text: str):
+        """Replace the in-place line with its final text and move on"""
+        with self.lock:
+            if self._routed(text + '\n'):
+                return
+            self._live = None
+            self._write(f"\r{text}\033[K\n")
+
+    def defer(self, action: Callable[[], None]):
+        """Run an action (such as a readability pause) in output order"""
+        with self.lock:
+            if not self._routed(action):
+                action()
+
+    def write(self, data: str):
+        """Write raw text, ending any in-place line first"""
+        with self.lock:
+            if self._routed(data):
+                return
+            if self._live is not None:
+                data = '\n' + data  # Leave the in-place line where it is
+                self._live = None
+            self._write(data)
+
+    def replay(self, items: List[Any]):
+        """Write previously routed output directly, running deferred actions in order"""
+        with self.lock:
+            for item in items:
+                if callable(item):
+                    item()
+                elif item is not None:
+                    router, self.router = self.router, None
+                    try:
+                        self.write(item)
+                    finally:
+                        self.router = router
+
+    def _routed(self, item: Any) -> bool:
+        return self.router is not None and self.router(item)
+
+    def _write(self, data: str):
+        try:
+            self.stream.write(data)
+            self.stream.flush()
+        except (OSError, ValueError):
+            pass
+
+class Pacing:
+    """Pacing policy for pauses, screen clears and prompts shared by every step"""
+
+    def __init__(self, delays: bool = True, clear: bool = True, interactive: bool = True,
+                 answers: Optional[Dict[str, bool]] = None):
+        self.delays = delays
+        self.clear = clear
+        self.interactive = interactive
+        self.answers = answers or {}
+
+    @classmethod
+    def unattended(cls, answers: Optional[Dict[str, bool]] = None) -> 'Pacing':
+        """No delays, no screen clears, prompts answered from flags"""
+        return cls(delays=False, clear=False, interactive=False, answers=answers)
+
+    @classmethod
+    def from_args(cls, args: argparse.Namespace) -> 'Pacing':
+        """Build the policy selected on the command line"""
+        if args.fast or args.agent or args.profiles or args.prefixes:
+            return cls.unattended({'update': bool(args.update)})
+        return cls()
+
+    def pause(self, seconds: float):
+        """Sleep for readability unless running unattended"""
+        if self.delays and seconds > 0:
+            time.sleep(seconds)
+
+    def confirm(self, question: str, key: str, default: bool = False,
+                renderer: Optional[Renderer] = None) -> bool:
+        """Ask a yes/no question, or answer it from flags when unattended"""
+        if not self.interactive:
+            return self.answers.get(key, default)
+        prompt = f"\n  {Colors.INFO}{Icons.INFO}{Colors.RESET} {question} (y/n): "
+        if renderer is not None:
+            renderer.write(prompt)
+        else:
+            print(prompt, end='', flush=True)
+        return input().lower() == 'y'
+
+    def wait_for_exit(self, prompt: str = "\n  Press Enter to exit..."):
+        """Keep the console window open until the user dismisses it"""
+        if self.interactive:
+            input(prompt)
+
+class RunLog:
+    """Buffered run log writing text or JSONL records through a single open handle"""
+
+    FORMATS = ('text', 'jsonl')
+
+    def __init__(self, path: Optional[Path], fmt: str = 'text', flush_interval: float = 1.0,
+                 max_buffered: int = 64):
+        self.path = path
+        self.fmt = fmt
+        self.flush_interval = flush_interval
+        self.max_buffered = max_buffered
+        self._origin = time.monotonic()
+        self._spans = threading.local()  # Steps may run concurrently, one per thread
+        self._buffer: List[str] = []
+        self._handle = None
+        self._lock = threading.Lock()
+        self._stamp_second = -1
+        self._stamp = ''
+        self._closed = threading.Event()
+        if path is not None:
+            atexit.register(self.close)
+            threading.Thread(target=self._flush_loop, name='log-flush', daemon=True).start()
+
+    @property
+    def step(self) -> Optional[str]:
+        """Step running on the calling thread"""
+        return getattr(self._spans, 'step', None)
+
+    @property
+    def _step_started(self) -> float:
+        return getattr(self._spans, 'started', self._origin)
+
+    def set_step(self, name: Optional[str], outcome: Optional[str] = None):
+        """Close the calling thread's step span (noting a failed/resumed outcome) and start a new one"""
+        now = time.monotonic()
+        if self.step is not None:
+            note = f", {outcome}" if outcome else ''
+            self.write(f"Step finished: {self.step} ({now - self._step_started:.3f}s{note})", 'STEP',
+                       duration=now - self._step_started)
+        self._spans.step = name
+        self._spans.started = now
+        if name is not None:
+            self.write(f"Step started: {name}", 'STEP')
+
+    def write(self, message: str, level: str = 'INFO', duration: Optional[float] = None):
+        """Queue one record; flushed when the buffer fills or the interval elapses"""
+        if self.path is None or self._closed.is_set():
+            return
+        now = time.monotonic()
+        with self._lock:
+            if self.fmt == 'jsonl':
+                import json
+                record = {'t': round(now - self._origin, 6), 'mono': now, 'step': self.step,
+                          'level': level, 'message': message,
+                          'elapsed': round(now - self._step_started, 6)}
+                if duration is not None:
+                    record['duration'] = round(duration, 6)
+                self._buffer.append(json.dumps(record, ensure_ascii=False) + '\n')
+            else:
+                self._buffer.append(f"[{self._timestamp()}] [{level}] {message}\n")
+            if len(self._buffer) >= self.max_buffered:
+                self._flush_locked()
+
+    def _timestamp(self) -> str:
+        """Wall-clock stamp for text records, formatted at most once per second"""
+        second = int(time.time())
+        if second != self._stamp_second:
+            from datetime import datetime
+            self._stamp_second = second
+            self._stamp = datetime.fromtimestamp(second).strftime('%Y-%m-%d %H:%M:%S')
+        return self._stamp
+
+    def flush(self):
+        """Write buffered records to disk"""
+        with self._lock:
+            self._flush_locked()
+
+    def _flush_locked(self):
+        if not self._buffer:
+            return
+        try:
+            if self._handle is None:
+                self._handle = open(self.path, 'a', encoding='utf-8')
+            self._handle.write(''.join(self._buffer))
+            self._handle.flush()
+        except OSError:
+            pass  # Logging must never break the install
+        self._buffer.clear()
+
+    def _flush_loop(self):
+        while not self._closed.wait(self.flush_interval):
+            self.flush()
+
+    def close(self):
+        """Flush everything and release the handle (safe to call repeatedly)"""
+        if self.path is None or self._closed.is_set():
+            return
+        self.set_step(None)
+        with self._lock:
+            self._closed.set()
+            self._flush_locked()
+            if self._handle is not None:
+                self._handle.close()
+                self._handle = None
+
+class LogReport:
+    """Step and command timings across run logs, with an index so every log is parsed only once"""
+
+    INDEX = '.report_index.json'
+    TEXT = re.compile(r'\[([^\]]+)\] \[(\w+)\] (.*)')
+    STEP = re.compile(r'Step (started|finished): (.+?)(?: \((\d+(?:\.\d+)?)s(?:, (\w+))?\))?$')
+    COMMAND = re.compile(r'Command finished: (.+) \((\d+(?:\.\d+)?)s, exit (-?\d+)\)$')
+    RUN = re.compile(r'Run finished in (\d+(?:\.\d+)?)s')
+
+    def __init__(self, log_dir: Path):
+        import json
+        self.log_dir = log_dir
+        self.index_file = log_dir / self.INDEX
+        self.index: Dict[str, Dict[str, Any]] = {}
+        self.parsed = 0  # Logs read by the last update()
+        try:
+            self.index = json.loads(self.index_file.read_text(encoding='utf-8'))
+        except (OSError, ValueError):
+            pass
+
+    def update(self):
+        """Parse new and changed logs and forget deleted ones"""
+        import json
+        seen = set()
+        changed = False
+        try:
+            entries = list(os.scandir(self.log_dir))
+        except OSError:
+            entries = []
+        for entry in entries:
+            if not entry.name.startswith('claude_setup_') or not entry.name.endswith(('.log', '.jsonl')):
+                continue
+            seen.add(entry.name)
+            st = entry.stat()
+            cached = self.index.get(entry.name)
+            if cached and cached['size'] == st.st_size and cached['mtime'] == st.st_mtime_ns:
+                continue
+            try:
+                run = self.parse(Path(entry.path))
+            except OSError:
+                continue
+            run.update(size=st.st_size, mtime=st.st_mtime_ns)
+            self.index[entry.name] = run
+            self.parsed += 1
+            changed = True
+        for name in set(self.index) - seen:
+            del self.index[name]
+            changed = True
+        if changed:
+            try:
+                tmp = self.index_file.with_suffix('.tmp')
+                tmp.write_text(json.dumps(self.index), encoding='utf-8')
+                os.replace(tmp, self.index_file)
+            except OSError:
+                pass
+
+    @classmethod
+    def parse(cls, path: Path) -> Dict[str, Any]:
+        """Steps (duration, outcome), commands (label, duration, exit code) and length of one run"""
+        from datetime import datetime
+        import json
+        steps: Dict[str, List[Any]] = {}
+        commands: List[List[Any]] = []
+        duration = None
+        first = last = None
+        jsonl = path.suffix == '.jsonl'
+        with open(path, encoding='utf-8', errors='replace') as f:
+            for line in f:
+                if jsonl:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue
+                    level, message, last = record.get('level'), record.get('message', ''), record.get('t')
+                else:
+                    match = cls.TEXT.match(line)
+                    if match is None:
+                        continue  # Continuation of a multi-line message
+                    last, level, message = match.groups()
+                    first = first or last
+                if level == 'STEP':
+                    match = cls.STEP.match(message)
+                    if match and match.group(1) == 'started':
+                        steps.setdefault(match.group(2), [None, 'interrupted'])
+                    elif match and match.group(3):
+                        steps[match.group(2)] = [float(match.group(3)), match.group(4) or 'ok']
+                elif level == 'CMD':
+                    match = cls.COMMAND.match(message)
+                    if match:
+                        commands.append([match.group(1), float(match.group(2)), int(match.group(3))])
+                elif message.startswith('Run finished'):
+                    match = cls.RUN.match(message)
+                    duration = float(match.group(1)) if match else duration
+        if duration is None and last is not None:
+            if jsonl:
+                duration = float(last)
+            else:
+                try:
+                    stamps = [datetime.strptime(stamp, '%Y-%m-%d %H:%M:%S') for stamp in (first, last)]
+                    duration = (stamps[1] - stamps[0]).total_seconds()
+                except ValueError:
+                    pass
+        return {'steps': steps, 'commands': commands, 'duration': duration}
+
+    @staticmethod
+    def percentile(values: List[float], q: float) -> float:
+        """Nearest-rank percentile of sorted values"""
+        return values[max(int(-(-q * len(values) // 1)) - 1, 0)]
+
+    @classmethod
+    def stats(cls, samples: Dict[str, List[Tuple[Optional[float], bool]]]) -> List[Dict[str, Any]]:
+        """n, p50/p95/max and failure rate per name, slowest p95 first"""
+        rows = []
+        for name, values in samples.items():
+            durations = sorted(duration for duration, _ in values if duration is not None)
+            failures = sum(1 for _, failed in values if failed)
+            rows.append({'name': name, 'n': len(values), 'failures': failures,
+                         'failure_rate': round(failures / len(values), 4),
+                         'p50': cls.percentile(durations, 0.5) if durations else None,
+                         'p95': cls.percentile(durations, 0.95) if durations else None,
+                         'max': durations[-1] if durations else None})
+        return sorted(rows, key=lambda row: -(row['p95'] or 0))
+
+    def summary(self, slowest: int = 5) -> Dict[str, Any]:
+        """Aggregates over every indexed run that got as far as a step"""
+        runs = {name: run for name, run in self.index.items() if run['steps']}
+        steps: Dict[str, List[Tuple[Optional[float], bool]]] = {}
+        commands: Dict[str, List[Tuple[Optional[float], bool]]] = {}
+        for run in runs.values():
+            for step, (duration, outcome) in run['steps'].items():
+                if outcome != 'resumed':  # Checkpointed steps did no work
+                    steps.setdefault(step, []).append((duration, outcome in ('failed', 'interrupted')))
+            for label, duration, code in run['commands']:
+                commands.setdefault(label, []).append((duration, code != 0))
+        ranked = sorted(runs.items(), key=lambda item: -(item[1]['duration'] or 0))[:slowest]
+        return {
+            'log_dir': str(self.log_dir), 'runs': len(runs), 'parsed': self.parsed,
+            'steps': self.stats(steps), 'commands': self.stats(commands),
+            'slowest_runs': [{'log': name, 'duration': run['duration'],
+                              'slowest_step': max(((duration or 0, step) for step, (duration, _) in
+                                                   run['steps'].items()), default=(0, None))[1],
+                              'failed_steps': [step for step, (_, outcome) in run['steps'].items()
+                                               if outcome in ('failed', 'interrupted')]}
+                             for name, run in ranked],
+        }
+
+class Tracer:
+    """Collects step, probe and subprocess spans for a Chrome trace-event export"""
+
+    def __init__(self):
+        self.spans: List[Dict[str, Any]] = []
+        self._origin = time.perf_counter()
+        self._lock = threading.Lock()
+        self._steps = threading.local()
+
+    def now(self) -> float:
+        return time.perf_counter()
+
+    def record(self, name: str, cat: str, start: float, end: float, **args):
+        """Add a finished span (perf_counter timestamps)"""
+        thread = threading.current_thread()
+        with self._lock:
+            self.spans.append({'name': name, 'cat': cat, 'start': start - self._origin,
+                               'dur': max(end - start, 0.0), 'tid': thread.ident, 'thread': thread.name,
+                               'args': args})
+
+    def span(self, name: str, cat: str, **args):
+        """Context manager timing a block; yields a dict for extra args"""
+        tracer = self
+
+        class _Span:
+            def __enter__(self):
+                self.start = tracer.now()
+                return args
+
+            def __exit__(self, exc_type, exc, tb):
+                if exc_type is not None:
+                    args['error'] = exc_type.__name__
+                tracer.record(name, cat, self.start, tracer.now(), **args)
+
+        return _Span()
+
+    def begin_step(self, name: Optional[str]):
+        """Close the calling thread's step span and open the next"""
+        current = getattr(self._steps, 'current', None)
+        if current is not None:
+            self.record(current[0], 'step', current[1], self.now())
+        self._steps.current = (name, self.now()) if name is not None else None
+
+    def export(self, path: Path):
+        """Write a Chrome trace-event file (chrome://tracing, Perfetto)"""
+        import json
+        pid = os.getpid()
+        with self._lock:
+            spans = list(self.spans)
+        events: List[Dict[str, Any]] = []
+        for tid, thread in sorted({(span['tid'], span['thread']) for span in spans}, key=str):
+            events.append({'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid, 'args': {'name': thread}})
+        for span in spans:
+            events.append({'name': span['name'], 'cat': span['cat'], 'ph': 'X', 'pid': pid, 'tid': span['tid'],
+                           'ts': round(span['start'] * 1e6, 1), 'dur': round(span['dur'] * 1e6, 1),
+                           'args': span['args']})
+        path.write_text(json.dumps({'traceEvents': events, 'displayTimeUnit': 'ms'}, indent=1), encoding='utf-8')
+
+    def summary(self) -> List[Tuple[str, str, int, float, float]]:
+        """(category, name, count, total seconds, max seconds), slowest first"""
+        groups: Dict[Tuple[str, str], List[float]] = {}
+        with self._lock:
+            for span in self.spans:
+                groups.setdefault((span['cat'], span['name']), []).append(span['dur'])
+        rows = [(cat, name, len(durations), sum(durations), max(durations))
+                for (cat, name), durations in groups.items()]
+        return sorted(rows, key=lambda row: row[3], reverse=True)
+
+class OutputCapture:
+    """Bounded tail of a child's output; every line also goes to spill (the run log) as it arrives"""
+
+    def __init__(self, max_lines: int = 200, spill: Optional[Callable[[str], None]] = None,
+                 until: Optional[Callable[[str], bool]] = None):
+        self.lines: deque = deque(maxlen=max_lines)
+        self.total = 0
+        self.spill = spill
+        self.until = until  # Stop reading at the first line this accepts
+        self.match: Optional[str] = None
+
+    def __call__(self, line: str) -> bool:
+        self.total += 1
+        self.lines.append(line)
+        if self.spill:
+            self.spill(line)
+        if self.until and self.match is None and self.until(line):
+            self.match = line
+            return True
+        return False
+
+    def text(self) -> str:
+        return '\n'.join(self.lines).strip()
+
+class ProcessRunner:
+    """Non-blocking child process runner that streams merged stdout/stderr line by line
+
+    cmd is an argument list spawned without a shell (or, on Windows, a complete
+    command line such as an explicit cmd.exe call). Without merge_stderr, stderr
+    is read on its own pipe and handed line by line to on_stderr.
+    """
+
+    _active: set = set()
+    _active_lock = threading.Lock()
+
+    def __init__(self, cmd: Union[List[str], str], idle_timeout: float = NPM_IDLE_TIMEOUT, poll_interval: float = 0.15,
+                 cwd: Optional[str] = None, merge_stderr: bool = True, tracer: Optional[Tracer] = None,
+                 on_stderr: Optional[Callable[[str], None]] = None):
+        import subprocess
+        self.cmd = cmd
+        self.display = cmd if isinstance(cmd, str) else subprocess.list2cmdline(cmd)
+        self.cwd = cwd
+        self.merge_stderr = merge_stderr
+        self.on_stderr = on_stderr
+        self.tracer = tracer
+        self.started: Optional[float] = None
+        self.ended: Optional[float] = None
+        self.first_output: Optional[float] = None
+        self.idle_timeout = idle_timeout
+        self.poll_interval = poll_interval
+        self.timed_out = False
+        self.cancelled = False
+        self.stopped_early = False
+        self.process: Optional[subprocess.Popen] = None
+
+    @classmethod
+    def cancel_all(cls):
+        """Stop every running child, e.g. when Ctrl+C reaches the main thread"""
+        with cls._active_lock:
+            runners = list(cls._active)
+        for runner in runners:
+            runner.cancelled = True
+            runner.stop()
+
+    def run(self, on_line: Callable[[str], Optional[bool]], on_idle: Optional[Callable[[float], None]] = None) -> int:
+        """Run to completion, calling on_line per output line and on_idle(seconds) while quiet
+
+        on_line may return True once it has what it needs: the child then gets a moment
+        to exit on its own, is stopped otherwise, and the run counts as successful.
+        """
+        import queue
+        import subprocess
+        popen_args = {'creationflags': subprocess.CREATE_NEW_PROCESS_GROUP} if os.name == 'nt' else {'start_new_session': True}
+        self.started = time.perf_counter()
+        if self.merge_stderr:
+            stderr = subprocess.STDOUT
+        else:
+            stderr = subprocess.PIPE if self.on_stderr else subprocess.DEVNULL
+        self.process = subprocess.Popen(self.cmd, stdout=subprocess.PIPE, stderr=stderr,
+                                        stdin=subprocess.DEVNULL, text=True, encoding='utf-8', errors='replace',
+                                        bufsize=1, cwd=self.cwd, **popen_args)
+        lines: queue.Queue = queue.Queue()
+        reader = threading.Thread(target=self._pump, args=(self.process.stdout, lines), daemon=True)
+        reader.start()
+        errors = None
+        if self.process.stderr is not None:
+            errors = threading.Thread(target=self._forward, args=(self.process.stderr, self.on_stderr), daemon=True)
+            errors.start()
+        last_output = time.monotonic()
+        with self._active_lock:
+            self._active.add(self)
+        try:
+            while True:
+                try:
+                    line = lines.get(timeout=self.poll_interval)
+                except queue.Empty:
+                    quiet = time.monotonic() - last_output
+                    if quiet > self.idle_timeout:
+                        self.timed_out = True
+                        self.stop()
+                        break
+                    if on_idle:
+                        on_idle(quiet)
+                    continue
+                if line is None:
+                    break  # EOF, child closed its output
+                if self.first_output is None:
+                    self.first_output = time.perf_counter()
+                last_output = time.monotonic()
+                if on_line(line.rstrip('\r\n')):
+                    self.stopped_early = True
+                    break
+            if self.stopped_early:
+                try:
+                    code = self.process.wait(timeout=0.5)
+                except subprocess.TimeoutExpired:
+                    self.stop()
+                    code = 0
+            else:
+                code = self.process.wait()
+            if errors is not None:
+                errors.join(timeout=1)  # Let the last stderr lines reach the log
+            if self.cancelled:
+                raise KeyboardInterrupt
+            return code
+        except KeyboardInterrupt:
+            self.stop()
+            raise
+        finally:
+            self.ended = time.perf_counter()
+            with self._active_lock:
+                self._active.discard(self)
+            self._trace()
+
+    @property
+    def elapsed(self) -> float:
+        return (self.ended or time.perf_counter()) - (self.started or time.perf_counter())
+
+    def _trace(self):
+        if self.tracer is None or self.started is None:
+            return
+        ttfb = None if self.first_output is None else round((self.first_output - self.started) * 1000, 1)
+        self.tracer.record(self.display, 'spawn', self.started, time.perf_counter(), cmd=self.display,
+                           exit_code=self.process.returncode if self.process else None, ttfb_ms=ttfb,
+                           timed_out=self.timed_out, cancelled=self.cancelled, stopped_early=self.stopped_early)
+
+    @staticmethod
+    def _pump(stream, lines: 'queue.Queue'):
+        """Reader thread: forward lines until EOF"""
+        try:
+            for line in stream:
+                lines.put(line)
+        except (OSError, ValueError):
+            pass
+        finally:
+            lines.put(None)
+
+    @staticmethod
+    def _forward(stream, on_line: Callable[[str], None]):
+        """Reader thread for a separate stderr pipe"""
+        try:
+            for line in stream:
+                on_line(line.rstrip('\r\n'))
+        except (OSError, ValueError):
+            pass
+
+    def stop(self):
+        """Terminate the child together with everything it spawned"""
+        import signal
+        import subprocess
+        proc = self.process
+        if proc is None or proc.poll() is not None:
+            return
+        try:
+            if os.name == 'nt':
+                subprocess.run(['taskkill', '/F', '/T', '/PID', str(proc.pid)],
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            else:
+                os.killpg(proc.pid, signal.SIGTERM)
+            proc.wait(timeout=5)
+        except Exception:
+            proc.kill()
+
+class NpmConfigResolver:
+    """Reads npm configuration without spawning npm, following npm's precedence rules
+
+    Highest wins: npm_config_* environment, project .npmrc, user .npmrc,
+    global npmrc, builtin npmrc next to the npm install, then npm's defaults.
+    get() returns None whenever the answer cannot be determined with
+    certainty, so callers can fall back to asking npm itself.
+    """
+
+    PATH_KEYS = ('prefix', 'userconfig', 'globalconfig', 'cache')
+    AMBIGUOUS = object()
+
+    class Unknown(dict):
+        """A layer whose contents cannot be known: it may set any key"""
+
+        def __contains__(self, key) -> bool:
+            return True
+
+        def __getitem__(self, key):
+            return NpmConfigResolver.AMBIGUOUS
+    _ENV_REF = re.compile(r'(\\*)\$\{([^${}?]+)(\?)?\}')
+
+    def __init__(self, env: Optional[Dict[str, str]] = None, cwd: Optional[str] = None,
+                 home: Optional[str] = None, node_path: Optional[str] = None,
+                 npm_dir: Optional[str] = None, windows: Optional[bool] = None):
+        self.env = dict(os.environ if env is None else env)
+        self.cwd = cwd or os.getcwd()
+        self.home = home or str(Path.home())
+        self.windows = (os.name == 'nt') if windows is None else windows
+        self.node_path = node_path if node_path is not None else self._which('node')
+        self.npm_dir = npm_dir if npm_dir is not None else self._find_npm_dir()
+        self.sources: Dict[str, Optional[str]] = {}
+        self._layers: Optional[List[Tuple[str, Dict[str, Any]]]] = None
+
+    @staticmethod
+    def _which(name: str) -> Optional[str]:
+        import shutil
+        exe = shutil.which(name)
+        return os.path.realpath(exe) if exe else None
+
+    def _find_npm_dir(self) -> Optional[str]:
+        """Directory of the npm package that the `npm` on PATH runs"""
+        import shutil
+        npm = shutil.which('npm')
+        if npm and not npm.lower().endswith(('.cmd', '.bat', '.ps1')):
+            # POSIX: npm is a symlink to <npm_dir>/bin/npm-cli.js
+            return str(Path(os.path.realpath(npm)).parent.parent)
+        if self.node_path:
+            node_dir = Path(self.node_path).parent
+            if self.windows:
+                return str(node_dir / 'node_modules' / 'npm')
+            return str(node_dir.parent / 'lib' / 'node_modules' / 'npm')
+        return None
+
+    def get(self, key: str) -> Optional[str]:
+        """Effective value of a config key, or None if unknown or ambiguous"""
+        for name, data in self.layers():
+            if key in data:
+                value = data[key]
+                self.sources[key] = name
+                return None if value is self.AMBIGUOUS else value
+        return None
+
+    def layers(self) -> List[Tuple[str, Dict[str, Any]]]:
+        """Config layers in precedence order, highest first"""
+        if self._layers is not None:
+            return self._layers
+        layers: List[Tuple[str, Dict[str, Any]]] = []
+        default = self._defaults()
+        builtin = self._read_file(os.path.join(self.npm_dir, 'npmrc')) if self.npm_dir else {}
+        env = self._env_layer()
+        self._layers = layers = [('env', env)]
+        # npm skips the project file when it is the user config itself
+        early_user_file = self._lookup('userconfig', [env], os.path.join(self.home, '.npmrc'))
+        project_file, in_workspace = self._project_npmrc()
+        project: Dict[str, Any] = {}
+        if in_workspace:
+            # npm may pick the workspace root's .npmrc instead: let npm decide
+            project = self.Unknown()
+        elif project_file and not self._same_file(project_file, early_user_file):
+            project = self._read_file(project_file)
+        layers.append(('project', project))
+        user_file = self._lookup('userconfig', [env, project], os.path.join(self.home, '.npmrc'))
+        user = self._read_file(user_file)
+        layers.append(('user', user))
+        # npm defaults globalconfig to <prefix>/etc/npmrc using the prefix known so far
+        prefix = self._lookup('prefix', [env, project, user, builtin], default.get('prefix'))
+        global_file = self._lookup('globalconfig', [env, project, user, builtin],
+                                   os.path.join(prefix, 'etc', 'npmrc') if isinstance(prefix, str) else None)
+        if global_file is self.AMBIGUOUS or prefix is self.AMBIGUOUS:
+            glob: Dict[str, Any] = self.Unknown()
+        else:
+            glob = self._read_file(global_file)
+        layers.extend([('global', glob), ('builtin', builtin), ('default', default)])
+        return layers
+
+    def _lookup(self, key: str, layers: List[Dict[str, Any]], fallback: Any) -> Any:
+        for data in layers:
+            if key in data:
+                return data[key]
+        return fallback
+
+    def _defaults(self) -> Dict[str, Any]:
+        defaults: Dict[str, Any] = {'registry': 'https://registry.npmjs.org/'}
+        if self.env.get('PREFIX'):
+            defaults['prefix'] = self.env['PREFIX']
+        elif self.node_path:
+            node_dir = os.path.dirname(self.node_path)
+            if self.windows:
+                defaults['prefix'] = node_dir
+            else:
+                prefix = os.path.dirname(node_dir)
+                if self.env.get('DESTDIR'):
+                    prefix = os.path.join(self.env['DESTDIR'], prefix.lstrip('/'))
+                defaults['prefix'] = prefix
+        return defaults
+
+    def _env_layer(self) -> Dict[str, Any]:
+        data: Dict[str, Any] = {}
+        for env_key, value in self.env.items():
+            if not env_key.lower().startswith('npm_config_') or value == '':
+                continue
+            key = env_key[11:]
+            if not key.startswith('//'):
+                key = key[:1] + key[1:].replace('_', '-')
+                key = key.lower()
+            value = self._parse_value(key, value)
+            if key in data and data[key] != value:
+                # npm_config_x and NPM_CONFIG_X disagree: npm's pick depends on env order
+                value = self.AMBIGUOUS
+            data[key] = value
+        return data
+
+    def _project_npmrc(self) -> Tuple[Optional[str], bool]:
+        """.npmrc of npm's local prefix, and whether a workspace root may override it"""
+        current = Path(self.cwd).resolve()
+        local = current
+        for folder in [current] + list(current.parents):
+            if (folder / 'package.json').exists() or (folder / 'node_modules').is_dir():
+                local = folder
+                break
+        in_workspace = any(self._declares_workspaces(folder / 'package.json') for folder in local.parents)
+        npmrc = local / '.npmrc'
+        return (str(npmrc) if npmrc.is_file() else None), in_workspace
+
+    @staticmethod
+    def _declares_workspaces(package_json: Path) -> bool:
+        import json
+        try:
+            return 'workspaces' in json.loads(package_json.read_text(encoding='utf-8'))
+        except (OSError, ValueError):
+            return False
+
+    @staticmethod
+    def _same_file(a: Optional[str], b: Any) -> bool:
+        if not a or not isinstance(b, str):
+            return False
+        return os.path.normcase(os.path.abspath(a)) == os.path.normcase(os.path.abspath(b))
+
+    def _read_file(self, path: Any) -> Dict[str, Any]:
+        """Parse an npmrc file; unreadable-but-present files (or unknown paths) make every key ambiguous"""
+        if path is self.AMBIGUOUS:
+            return self.Unknown()
+        if not isinstance(path, str):
+            return {}
+        try:
+            text = Path(path).read_text(encoding='utf-8')
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError):
+            return self.Unknown()
+        data: Dict[str, Any] = {}
+        section = ''
+        for raw in text.splitlines():
+            line = raw.strip()
+            if not line or line[0] in ';#':
+                continue
+            if line.startswith('[') and line.endswith(']'):
+                section = line[1:-1].strip()
+                continue
+            key, sep, value = line.partition('=')
+            key, value = key.strip(), value.strip()
+            if not sep or section or not key:
+                continue
+            if key.endswith('[]'):
+                continue  # List values never affect the keys we resolve
+            if len(value) >= 2 and value[0] == value[-1] and value[0] in '"\'':
+                value = value[1:-1]
+            key = self._expand(key)
+            if key is self.AMBIGUOUS:
+                continue
+            data[key] = self._parse_value(key, value)
+        return data
+
+    def _expand(self, text: str) -> Any:
+        """npm's ${VAR} substitution; undefined variables cannot be resolved reliably"""
+        unresolved = []
+
+        def replace(match):
+            slashes, name, optional = match.group(1), match.group(2), match.group(3)
+            if len(slashes) % 2:
+                return slashes[1:] + '${' + name + (optional or '') + '}'
+            if name in self.env:
+                return slashes + self.env[name]
+            if optional:
+                return slashes
+            unresolved.append(name)
+            return match.group(0)
+
+        expanded = self._ENV_REF.sub(replace, text)
+        return self.AMBIGUOUS if unresolved else expanded
+
+    def _parse_value(self, key: str, value: str) -> Any:
+        value = self._expand(value)
+        if value is self.AMBIGUOUS or key not in self.PATH_KEYS:
+            return value
+        home_prefix = ('~/', '~\\') if self.windows else ('~/',)
+        if value.startswith(home_prefix):
+            return os.path.join(self.home, value[2:])
+        return os.path.normpath(os.path.join(self.cwd, value))
+
+class RegistryClient:
+    """Fetches abbreviated npm package metadata with a TTL cache and conditional requests"""
+
+    ACCEPT = 'application/vnd.npm.install-v1+json; q=1.0, application/json; q=0.8, */*'
+
+    def __init__(self, registry: str, cache_dir: Optional[Path] = None, ttl: float = REGISTRY_TTL,
+                 timeout: float = 10.0, log: Optional[Callable[[str, str], None]] = None):
+        self.registry = registry.rstrip('/') + '/'
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.timeout = timeout
+        self.log = log or (lambda message, level='INFO': None)
+
+    def _cache_file(self, package: str) -> Optional[Path]:
+        if self.cache_dir is None:
+            return None
+        return self.cache_dir / (package.replace('/', '__').replace('@', '') + '.json')
+
+    def _load(self, package: str) -> Optional[Dict[str, Any]]:
+        import json
+        path = self._cache_file(package)
+        try:
+            entry = json.loads(path.read_text(encoding='utf-8')) if path else None
+        except (OSError, ValueError):
+            return None
+        # Entries from another registry are not valid here
+        return entry if entry and entry.get('registry') == self.registry else None
+
+    def _store(self, package: str, entry: Dict[str, Any]):
+        import json
+        path = self._cache_file(package)
+        if path is None:
+            return
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = path.with_suffix('.tmp')
+            tmp.write_text(json.dumps(entry), encoding='utf-8')
+            os.replace(tmp, path)
+        except OSError:
+            pass
+
+    def metadata(self, package: str) -> Optional[Dict[str, Any]]:
+        """Package document, from cache while fresh, otherwise revalidated with the registry"""
+        import json
+        entry = self._load(package)
+        if entry and time.time() - entry.get('fetched', 0) < self.ttl:
+            return entry['data']
+
+        import urllib.error
+        import urllib.request
+        url = self.registry + package.replace('/', '%2f')
+        request = urllib.request.Request(url, headers={'Accept': self.ACCEPT})
+        if entry and entry.get('etag'):
+            request.add_header('If-None-Match', entry['etag'])
+        if entry and entry.get('last_modified'):
+            request.add_header('If-Modified-Since', entry['last_modified'])
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                data = json.loads(response.read().decode('utf-8'))
+                entry = {'registry': self.registry, 'etag': response.headers.get('ETag'),
+                         'last_modified': response.headers.get('Last-Modified'), 'data': data}
+                self.log(f"Registry metadata fetched: {url}", 'INFO')
+        except urllib.error.HTTPError as e:
+            if e.code != 304 or not entry:
+                self.log(f"Registry request failed: {url} - HTTP {e.code}", 'WARNING')
+                return entry['data'] if entry else None
+            self.log(f"Registry metadata not modified: {url}", 'INFO')
+        except (OSError, ValueError) as e:
+            # Offline or a broken response: stale metadata beats none
+            self.log(f"Registry request failed: {url} - {e}", 'WARNING')
+            return entry['data'] if entry else None
+        entry['fetched'] = time.time()
+        self._store(package, entry)
+        return entry['data']
+
+    def latest_version(self, package: str) -> Optional[str]:
+        """Version behind the `latest` dist-tag"""
+        data = self.metadata(package)
+        try:
+            return data['dist-tags']['latest'] if data else None
+        except (KeyError, TypeError):
+            return None
+
+class PackageStore:
+    """Content-addressed tarball cache for offline and bulk installs
+
+    Tarballs live under objects/ keyed by their npm integrity hash. Trimmed
+    packuments and an index of cached root versions sit next to them. Installs
+    run npm against a loopback registry served straight from the store.
+    """
+
+    # Unpacked packages take several times their tarball size
+    UNPACK_FACTOR = 4
+
+    def __init__(self, root: Path):
+        import json
+        self.root = root
+        self.objects = root / 'objects'
+        self.packuments = root / 'packuments'
+        self.index_file = root / 'index.json'
+        self.index: Dict[str, Dict[str, Any]] = {'packages': {}, 'roots': {}}
+        try:
+            self.index.update(json.loads(self.index_file.read_text(encoding='utf-8')))
+        except (OSError, ValueError):
+            pass
+
+    @staticmethod
+    def _digest(integrity: str) -> Tuple[str, str]:
+        """(algorithm, hex digest) of the strongest hash in an SRI string"""
+        import base64
+        hashes = dict(part.split('-', 1) for part in integrity.split() if '-' in part)
+        for algorithm in ('sha512', 'sha384', 'sha256', 'sha1'):
+            if algorithm in hashes:
+                return algorithm, base64.b64decode(hashes[algorithm]).hex()
+        raise ValueError(f"Unsupported integrity: {integrity}")
+
+    def object_path(self, integrity: str) -> Path:
+        algorithm, digest = self._digest(integrity)
+        return self.objects / algorithm / digest[:2] / f"{digest}.tgz"
+
+    def _hash_file(self, path: Path, algorithm: str) -> str:
+        import hashlib
+        digest = hashlib.new(algorithm)
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def has(self, integrity: str) -> bool:
+        return self.object_path(integrity).exists()
+
+    def add_tarball(self, url: str, integrity: str, timeout: float = 60.0) -> int:
+        """Download a tarball into the store unless present, verifying its hash"""
+        import hashlib
+        import tempfile
+        import urllib.request
+        target = self.object_path(integrity)
+        if target.exists():
+            return target.stat().st_size
+        algorithm, expected = self._digest(integrity)
+        target.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=str(target.parent), suffix='.part')
+        try:
+            digest = hashlib.new(algorithm)
+            with os.fdopen(fd, 'wb') as out, urllib.request.urlopen(url, timeout=timeout) as response:
+                for chunk in iter(lambda: response.read(1 << 16), b''):
+                    digest.update(chunk)
+                    out.write(chunk)
+            if digest.hexdigest() != expected:
+                raise ValueError(f"Integrity mismatch for {url}")
+            os.replace(tmp, target)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+        return target.stat().st_size
+
+    def add_packument(self, name: str, data: Dict[str, Any], versions: List[str]):
+        """Merge the given versions of a package document into the stored packument"""
+        import json
+        path = self.packuments / (urllib.parse.quote(name, safe='') + '.json')
+        try:
+            stored = json.loads(path.read_text(encoding='utf-8'))
+        except (OSError, ValueError):
+            stored = {'name': name, 'dist-tags': {}, 'versions': {}}
+        for version in versions:
+            if version in data.get('versions', {}):
+                stored['versions'][version] = data['versions'][version]
+                stored['dist-tags']['latest'] = version
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(json.dumps(stored), encoding='utf-8')
+
+    def record_root(self, version: str, packages: List[Dict[str, Any]]):
+        """Register a fully cached root version and its resolved tree"""
+        for package in packages:
+            key = f"{package['name']}@{package['version']}"
+            self.index['packages'][key] = {'integrity': package['integrity'], 'size': package['size']}
+        self.index['roots'][version] = {'added': time.time(),
+                                        'packages': sorted(f"{p['name']}@{p['version']}" for p in packages)}
+        self.save()
+
+    def save(self):
+        import json
+        self.root.mkdir(parents=True, exist_ok=True)
+        tmp = self.index_file.with_suffix('.tmp')
+        tmp.write_text(json.dumps(self.index, indent=1), encoding='utf-8')
+        os.replace(tmp, self.index_file)
+
+    def versions(self) -> List[str]:
+        """Cached root versions, oldest first"""
+        roots = self.index['roots']
+        return sorted(roots, key=lambda version: roots[version]['added'])
+
+    def required_bytes(self, version: str) -> int:
+        """Free space needed to extract a cached version"""
+        packages = self.index['packages']
+        size = sum(packages.get(key, {}).get('size', 0) for key in self.index['roots'][version]['packages'])
+        return size * self.UNPACK_FACTOR
+
+    def verify(self) -> List[str]:
+        """Re-hash every indexed tarball; returns the keys that are missing or corrupt"""
+        bad = []
+        for key, entry in sorted(self.index['packages'].items()):
+            path = self.object_path(entry['integrity'])
+            algorithm, expected = self._digest(entry['integrity'])
+            if not path.exists() or self._hash_file(path, algorithm) != expected:
+                bad.append(key)
+        return bad
+
+    def prune(self, keep: int) -> Tuple[List[str], int]:
+        """Keep the newest root versions; drop everything only older ones referenced"""
+        import json
+        versions = self.versions()
+        removed = versions[:max(len(versions) - keep, 0)]
+        for version in removed:
+            del self.index['roots'][version]
+        referenced = {key for root in self.index['roots'].values() for key in root['packages']}
+        freed = 0
+        for key in [key for key in self.index['packages'] if key not in referenced]:
+            entry = self.index['packages'].pop(key)
+            path = self.object_path(entry['integrity'])
+            if path.exists():
+                freed += path.stat().st_size
+                path.unlink()
+            name, version = key.rsplit('@', 1)
+            packument = self.packuments / (urllib.parse.quote(name, safe='') + '.json')
+            try:
+                data = json.loads(packument.read_text(encoding='utf-8'))
+                data['versions'].pop(version, None)
+                if data['versions']:
+                    data['dist-tags']['latest'] = list(data['versions'])[-1]
+                    packument.write_text(json.dumps(data), encoding='utf-8')
+                else:
+                    packument.unlink()
+            except (OSError, ValueError):
+                pass
+        self.save()
+        return removed, freed
+
+    def serve(self) -> 'ThreadingHTTPServer':
+        """Start a loopback npm registry backed by the store (call shutdown() when done)"""
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        import json
+        store = self
+        objects = store.objects.resolve()  # The cache folder may be reached through a symlink
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                path = urllib.parse.unquote(self.path.split('?', 1)[0]).lstrip('/')
+                base = f"http://{self.headers.get('Host')}/"
+                if path.startswith('-/'):
+                    target = store.objects / path[2:]
+                    if target.is_file() and objects in target.resolve().parents:
+                        return self._send(target.read_bytes(), 'application/octet-stream')
+                    return self._send(b'{}', 'application/json', 404)
+                packument = store.packuments / (urllib.parse.quote(path, safe='') + '.json')
+                try:
+                    data = json.loads(packument.read_text(encoding='utf-8'))
+                except (OSError, ValueError):
+                    return self._send(b'{"error":"Not found"}', 'application/json', 404)
+                for manifest in data['versions'].values():
+                    dist = manifest.get('dist', {})
+                    relative = store.object_path(dist['integrity']).relative_to(store.objects).as_posix()
+                    dist['tarball'] = base + '-/' + relative
+                return self._send(json.dumps(data).encode('utf-8'), 'application/json')
+
+            def _send(self, body: bytes, content_type: str, status: int = 200):
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        threading.Thread(target=server.serve_forever, name='package-store', daemon=True).start()
+        return server
+
+class VersionStore:
+    """Side-by-side Claude Code installs, each in its own npm prefix under root/<version>
+
+    Updates are installed into a staging prefix while the live version keeps
+    running, then committed with a directory rename. The launchers in npm's
+    global bin directory are pointed at the new version by an atomic file
+    replace. Previous installs are kept as snapshots for instant rollback;
+    every file is hardlinked from a pool keyed by content hash, so versions
+    that share files cost their bytes once.
+    """
+
+    STAGING = '.staging'
+    OBJECTS = '.objects'
+
+    def __init__(self, root: Path):
+        import json
+        self.root = root
+        self.objects = root / self.OBJECTS
+        self.state_file = root / 'state.json'
+        # versions: version -> launcher target inside the store and when it was added
+        self.state: Dict[str, Any] = {'current': None, 'history': [], 'versions': {}}
+        try:
+            self.state.update(json.loads(self.state_file.read_text(encoding='utf-8')))
+        except (OSError, ValueError):
+            pass
+
+    def path(self, version: str) -> Path:
+        return self.root / version
+
+    def staging_path(self) -> Path:
+        """Fresh, empty staging prefix"""
+        import shutil
+        staging = self.root / self.STAGING
+        if staging.exists():
+            shutil.rmtree(staging, ignore_errors=True)
+        staging.mkdir(parents=True, exist_ok=True)
+        return staging
+
+    def versions(self) -> List[str]:
+        try:
+            return sorted(entry.name for entry in self.root.iterdir()
+                          if entry.is_dir() and not entry.name.startswith('.'))
+        except OSError:
+            return []
+
+    def target(self, version: str) -> Optional[Path]:
+        """Launcher target of a stored version, if it is still intact"""
+        entry = self.state['versions'].get(version)
+        target = Path(entry['target']) if entry else None
+        return target if target and target.exists() else None
+
+    @staticmethod
+    def package_version(package_dir: Path) -> Optional[str]:
+        """Version from an installed package's package.json"""
+        import json
+        try:
+            return json.loads((package_dir / 'package.json').read_text(encoding='utf-8')).get('version')
+        except (OSError, ValueError):
+            return None
+
+    def commit(self, staging: Path, version: str) -> Path:
+        """Move a checked staging prefix to its version directory"""
+        import shutil
+        final = self.path(version)
+        if final.exists():
+            shutil.rmtree(final)  # Leftover of an earlier attempt; never the live target
+        os.replace(staging, final)
+        return final
+
+    def add(self, version: str, target: Path):
+        self.state['versions'][version] = {'target': str(target), 'added': time.time()}
+        self.save()
+
+    def _intern(self, path: Path, link: bool) -> Path:
+        """Pool object holding path's content, created on first sight (hardlinked when link is set)"""
+        import hashlib
+        import shutil
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                digest.update(chunk)
+        executable = os.access(str(path), os.X_OK)
+        hexdigest = digest.hexdigest()
+        obj = self.objects / hexdigest[:2] / (hexdigest + ('x' if executable else ''))
+        if not obj.exists():
+            obj.parent.mkdir(parents=True, exist_ok=True)
+            tmp = obj.with_name(obj.name + '.tmp')
+            try:
+                if not link:
+                    raise OSError
+                os.link(path, tmp)
+            except OSError:
+                shutil.copy2(path, tmp)
+            os.replace(tmp, obj)
+        return obj
+
+    @staticmethod
+    def _place(obj: Path, dest: Path):
+        """Hardlink a pool object into a tree, copying where links are not supported"""
+        import shutil
+        if dest.exists() and os.path.samefile(obj, dest):
+            return  # Already the pooled file (a rename between two links of one file is a no-op)
+        tmp = dest.with_name(dest.name + '.link-tmp')
+        try:
+            os.link(obj, tmp)
+        except OSError:
+            shutil.copy2(obj, tmp)
+        os.replace(tmp, dest)
+
+    def dedupe(self, tree: Path):
+        """Replace every file in a committed version with a link into the pool"""
+        for directory, _, files in os.walk(tree):
+            for name in files:
+                path = Path(directory, name)
+                if not path.is_symlink() and path.stat().st_nlink == 1:
+                    self._place(self._intern(path, link=True), path)
+
+    def snapshot(self, package_dir: Path, layout: Path, version: str, target: Path) -> Path:
+        """Copy an installed package tree (e.g. the global npm install) into the store once
+
+        layout is the package directory relative to a prefix; returns the launcher
+        target inside the snapshot.
+        """
+        import shutil
+        work = self.root / f".{version}.snapshot"
+        if work.exists():
+            shutil.rmtree(work)
+        destination = work / layout
+        for directory, dirs, files in os.walk(package_dir):
+            relative = Path(directory).relative_to(package_dir)
+            (destination / relative).mkdir(parents=True, exist_ok=True)
+            for name in dirs + files:
+                source = Path(directory, name)
+                if source.is_symlink():
+                    os.symlink(os.readlink(source), destination / relative / name)
+                    if name in dirs:
+                        dirs.remove(name)  # Do not descend into linked directories
+                elif name in files:
+                    self._place(self._intern(source, link=False), destination / relative / name)
+        final = self.commit(work, version)
+        snapshot_target = final / layout / target.relative_to(package_dir)
+        self.add(version, snapshot_target)
+        return snapshot_target
+
+    def size(self) -> int:
+        """Bytes held by the pool (every stored file, counted once)"""
+        total = 0
+        for directory, _, files in os.walk(self.objects):
+            total += sum(os.path.getsize(os.path.join(directory, name)) for name in files)
+        return total
+
+    def prune(self, keep: int, max_bytes: Optional[int] = None, protect: Tuple[str, ...] = ()) -> List[str]:
+        """Drop the oldest versions beyond keep (or beyond max_bytes), never the protected ones"""
+        import shutil
+        entries = self.state['versions']
+        candidates = sorted((v for v in entries if v not in protect), key=lambda v: entries[v]['added'])
+        removed = []
+        while candidates and (len(entries) > keep or (max_bytes is not None and self.size() > max_bytes)):
+            version = candidates.pop(0)
+            shutil.rmtree(self.path(version), ignore_errors=True)
+            entries.pop(version, None)
+            removed.append(version)
+            self.collect()
+        if removed:
+            self.save()
+        return removed
+
+    def collect(self):
+        """Delete pool objects no version links to any more"""
+        for directory, _, files in os.walk(self.objects):
+            for name in files:
+                path = os.path.join(directory, name)
+                if os.stat(path).st_nlink == 1:
+                    os.remove(path)
+
+    def record_switch(self, version: str, target: Path, previous: Optional[Path], previous_version: Optional[str]):
+        """Remember what the launchers pointed at before"""
+        self.state['history'].append({'version': previous_version, 'target': str(previous) if previous else None,
+                                      'replaced_by': version, 'switched': time.time()})
+        self.state['current'] = {'version': version, 'target': str(target)}
+        self.save()
+
+    def previous_version(self, current: Optional[str]) -> Optional[str]:
+        """Most recent version switched away from that is still stored, else the newest other stored one"""
+        for entry in reversed(self.state['history']):
+            if entry['version'] and entry['version'] != current and self.target(entry['version']):
+                return entry['version']
+        entries = self.state['versions']
+        stored = sorted((v for v in entries if v != current and self.target(v)), key=lambda v: entries[v]['added'])
+        return stored[-1] if stored else None
+
+    def save(self):
+        import json
+        try:
+            self.root.mkdir(parents=True, exist_ok=True)
+            tmp = self.state_file.with_suffix('.tmp')
+            tmp.write_text(json.dumps(self.state, indent=1), encoding='utf-8')
+            os.replace(tmp, self.state_file)
+        except OSError:
+            pass
+
+class AgentSchedule:
+    """When the update agent checks next: a jittered interval, backing off exponentially after failures
+
+    Kept on disk so scheduled one-shot runs (--agent-once from cron or Task
+    Scheduler) honour the same schedule as a long-running agent.
+    """
+
+    def __init__(self, path: Path, interval: float = AGENT_INTERVAL, retry: float = AGENT_RETRY):
+        import json
+        self.path = path
+        self.interval = interval
+        self.retry = min(retry, interval)
+        self.state: Dict[str, Any] = {'next_check': 0, 'failures': 0, 'last_check': None, 'last_result': None}
+        try:
+            self.state.update(json.loads(path.read_text(encoding='utf-8')))
+        except (OSError, ValueError):
+            pass
+
+    def delay(self) -> float:
+        """Seconds until the next check is due"""
+        return max(self.state['next_check'] - time.time(), 0.0)
+
+    def record(self, ok: bool, result: str) -> float:
+        """Schedule the next check after one; returns its delay"""
+        import json
+        import random
+        if ok:
+            self.state['failures'] = 0
+            delay = self.interval * random.uniform(0.9, 1.1)  # Spread a fleet's checks apart
+        else:
+            self.state['failures'] += 1
+            backoff = min(self.retry * 2 ** (self.state['failures'] - 1), self.interval)
+            delay = backoff * random.uniform(0.5, 1.0)
+        now = time.time()
+        self.state.update(next_check=now + delay, last_check=now, last_result=result)
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = self.path.with_suffix('.tmp')
+            tmp.write_text(json.dumps(self.state, indent=1), encoding='utf-8')
+            os.replace(tmp, self.path)
+        except OSError:
+            pass
+        return delay
+
+class ProbeCache:
+    """Version probe results keyed by resolved executable path, size and mtime"""
+
+    def __init__(self, path: Optional[Path] = None, enabled: bool = True):
+        import json
+        self.path = path
+        self.enabled = enabled
+        self._entries: Dict[str, List[Any]] = {}
+        self._lock = threading.Lock()
+        if enabled and path is not None:
+            try:
+                self._entries = json.loads(path.read_text(encoding='utf-8'))
+            except (OSError, ValueError):
+                self._entries = {}
+
+    def key(self, cmd: str) -> Optional[str]:
+        """Fingerprint of the executable a command resolves to, or None if bypassed/missing"""
+        import shutil
+        if not self.enabled:
+            return None
+        exe = shutil.which(cmd)
+        if not exe:
+            return None
+        try:
+            resolved = os.path.realpath(exe)
+            st = os.stat(resolved)
+        except OSError:
+            return None
+        return f"{os.path.normcase(resolved)}|{st.st_size}|{st.st_mtime_ns}"
+
+    def get(self, key: Optional[str]) -> Optional[Tuple[bool, str]]:
+        """Cached (ok, version) for a fingerprint"""
+        if key is None:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+        return (bool(entry[0]), str(entry[1])) if entry else None
+
+    def put(self, key: Optional[str], result: Tuple[bool, str]):
+        """Remember a successful probe and persist the cache"""
+        if key is None or not result[0]:
+            return
+        with self._lock:
+            self._entries[key] = list(result)
+            self._save()
+
+    def _save(self):
+        """Atomically rewrite the on-disk cache (caller holds the lock)"""
+        import json
+        if self.path is None:
+            return
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = self.path.with_suffix('.tmp')
+            tmp.write_text(json.dumps(self._entries, indent=1), encoding='utf-8')
+            os.replace(tmp, self.path)
+        except OSError:
+            pass  # The cache is an optimisation only
+
+class Journal:
+    """Checkpoints of completed install steps, so an interrupted run resumes where it stopped
+
+    Each entry keeps the step's result, the probe values and wizard state it left
+    behind, and the size and mtime of the files it relied on. An entry is trusted
+    again only while those files are unchanged.
+    """
+
+    def __init__(self, path: Path, key: Dict[str, Any], resume: bool = True):
+        import json
+        self.path = path
+        self.key = key  # Options that change what the steps do; another key starts over
+        self.steps: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        if resume:
+            try:
+                data = json.loads(path.read_text(encoding='utf-8'))
+                if data.get('key') == key:
+                    self.steps = data.get('steps', {})
+            except (OSError, ValueError):
+                pass
+
+    @staticmethod
+    def fingerprint(path: str) -> Optional[List[int]]:
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        return [st.st_size, st.st_mtime_ns]
+
+    def record(self, name: str, result: Any, title: Optional[str], probes: Dict[str, Any],
+               state: Dict[str, Any], files: List[Path]):
+        """Checkpoint a completed step"""
+        entry = {'result': result, 'title': title, 'probes': probes, 'state': state,
+                 'files': {str(path): self.fingerprint(str(path)) for path in files if path}, 'time': time.time()}
+        with self._lock:
+            self.steps[name] = entry
+            self._save()
+
+    def valid(self, name: str) -> Optional[Dict[str, Any]]:
+        """Checkpoint of a step whose files are all still as they were"""
+        entry = self.steps.get(name)
+        if entry is None:
+            return None
+        for path, fingerprint in entry['files'].items():
+            if fingerprint is None or self.fingerprint(path) != fingerprint:
+                return None
+        return entry
+
+    def clear(self):
+        """Forget every checkpoint (the install completed)"""
+        with self._lock:
+            self.steps = {}
+            try:
+                self.path.unlink()
+            except OSError:
+                pass
+
+    def _save(self):
+        """Atomically rewrite the journal (caller holds the lock)"""
+        import json
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = self.path.with_suffix('.tmp')
+            tmp.write_text(json.dumps({'key': self.key, 'steps': self.steps}, indent=1), encoding='utf-8')
+            os.replace(tmp, self.path)
+        except OSError:
+            pass  # Resuming is an optimisation only
+
+class Step:
+    """One node of the install graph"""
+
+    def __init__(self, name: str, func: Callable[[], Any], deps: Tuple[str, ...] = (),
+                 required: bool = False, on_failure: Optional[Callable[[], None]] = None):
+        self.name = name
+        self.func = func
+        self.deps = deps
+        self.required = required
+        self.on_failure = on_failure
+        self.number = 0
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+        self.started = False
+        self.finished = False
+        self.live = False
+        self.abandoned = False
+        self.resumed = False  # Completed by an earlier run (journal checkpoint)
+        self.failed = False  # Reported an error, even if the run goes on
+        self.title: Optional[str] = None
+        self.output: List[Any] = []
+
+class StepScheduler:
+    """Runs a dependency graph of steps, overlapping the ones that are ready
+
+    Output from steps running ahead of their turn is held back and replayed in
+    declaration order, so the console reads exactly like a sequential run.
+    """
+
+    _local = threading.local()
+
+    def __init__(self, renderer: Renderer, on_finish: Optional[Callable[[Step], None]] = None):
+        import queue
+        self.renderer = renderer
+        self.on_finish = on_finish
+        self.steps: List[Step] = []
+        self._head = 0
+        self._done: queue.Queue = queue.Queue()
+
+    @classmethod
+    def current(cls) -> Optional[Step]:
+        """Step running on the calling thread"""
+        return getattr(cls._local, 'step', None)
+
+    def add(self, name: str, func: Callable[[], Any], deps: Tuple[str, ...] = (),
+            required: bool = False, on_failure: Optional[Callable[[], None]] = None) -> Step:
+        """Declare a step; numbering follows declaration order"""
+        step = Step(name, func, deps, required, on_failure)
+        step.number = len(self.steps) + 1
+        self.steps.append(step)
+        return step
+
+    def run(self) -> Optional[Step]:
+        """Run every step, returning the required step that failed (if any)"""
+        import queue
+        by_name = {step.name: step for step in self.steps}
+        failed: Optional[Step] = None
+        running = 0
+        self.renderer.router = self._route
+        try:
+            while True:
+                if failed is None:
+                    for step in self.steps:
+                        if not step.started and all(by_name[dep].finished for dep in step.deps):
+                            self._start(step)
+                            running += 1
+                if not running:
+                    break
+                step = self._wait()
+                running -= 1
+                broken = step.error is not None or (step.required and step.result is False)
+                # A sequential run would have stopped at the earliest declared failure
+                if broken and (failed is None or step.number < failed.number):
+                    failed = step
+                    self._abandon_after(failed)
+                self._promote()
+        except KeyboardInterrupt:
+            ProcessRunner.cancel_all()
+            # Give cancelled steps a moment to report before the caller does
+            deadline = time.monotonic() + 2
+            while running and time.monotonic() < deadline:
+                try:
+                    self._done.get(timeout=0.1)
+                    running -= 1
+                except queue.Empty:
+                    pass
+            raise
+        finally:
+            self.renderer.router = None
+        if failed is not None and failed.error is not None:
+            raise failed.error
+        return failed
+
+    def _start(self, step: Step):
+        step.started = True
+        # Daemon threads: a step blocked in input() must not keep the process alive after Ctrl+C
+        threading.Thread(target=self._execute, args=(step,), name=f'step-{step.name}', daemon=True).start()
+        self._promote()
+
+    def _execute(self, step: Step):
+        self._local.step = step
+        try:
+            step.result = step.func()
+        except BaseException as e:
+            step.error = e
+        finally:
+            if self.on_finish:
+                self.on_finish(step)
+            self._local.step = None
+            self._done.put(step)
+
+    def _wait(self) -> Step:
+        # Poll so Ctrl+C is delivered promptly on every platform
+        import queue
+        while True:
+            try:
+                step = self._done.get(timeout=0.2)
+            except queue.Empty:
+                continue
+            step.finished = True
+            return step
+
+    def _route(self, item: Any) -> bool:
+        """Renderer hook: hold back output of steps that are not on screen yet"""
+        step = self.current()
+        if step is None or step.live:
+            return False
+        if not step.abandoned and item is not None:
+            step.output.append(item)
+        return True
+
+    def _promote(self):
+        """Replay finished steps in order and put the next one live"""
+        with self.renderer.lock:
+            while self._head < len(self.steps):
+                step = self.steps[self._head]
+                if not step.started or step.abandoned:
+                    break
+                if not step.live:
+                    output, step.output = step.output, []
+                    self.renderer.replay(output)
+                    step.live = True
+                if not step.finished:
+                    break
+                self._head += 1
+
+    def _abandon_after(self, failed: Step):
+        """Discard held-back output of steps declared after a failure"""
+        with self.renderer.lock:
+            for step in self.steps[failed.number:]:
+                step.abandoned = True
+                step.output = []
+
+class ProbeEngine:
+    """Runs independent environment probes concurrently and caches their results"""
+
+    def __init__(self, max_workers: int = 6, tracer: Optional[Tracer] = None):
+        from concurrent.futures import ThreadPoolExecutor
+        self.tracer = tracer
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='probe')
+        self._probes: Dict[str, Tuple[Callable, tuple]] = {}
+        self._futures = {}
+        self._lock = threading.Lock()
+
+    def register(self, name: str, func: Callable, *args):
+        """Declare a probe without starting it"""
+        with self._lock:
+            self._probes[name] = (func, args)
+
+    def start(self, *names: str):
+        """Start the named probes (all registered probes by default) at once"""
+        with self._lock:
+            for name in names or list(self._probes):
+                if name not in self._futures:
+                    func, args = self._probes[name]
+                    self._futures[name] = self._pool.submit(self._run, name, func, args)
+
+    def get(self, name: str, default: Any = None, raise_errors: bool = False) -> Any:
+        """Wait for a probe and return its result, starting it if needed"""
+        self.start(name)
+        try:
+            return self._futures[name].result()
+        except Exception:
+            if raise_errors:
+                raise
+            return default
+
+    def _run(self, name: str, func: Callable, args: tuple) -> Any:
+        if self.tracer is None:
+            return func(*args)
+        with self.tracer.span(f"probe {name}", 'probe'):
+            return func(*args)
+
+    def seed(self, name: str, value: Any):
+        """Use a known result (e.g. from a checkpoint) instead of probing"""
+        from concurrent.futures import Future
+        future = Future()
+        future.set_result(value)
+        with self._lock:
+            self._futures[name] = future
+
+    def invalidate(self, name: str):
+        """Drop a cached result so the next get() probes again"""
+        with self._lock:
+            self._futures.pop(name, None)
+
+    def shutdown(self):
+        """Stop accepting probes and release worker threads"""
+        self._pool.shutdown(wait=False)
+
+class PathIndex:
+    """Parsed PATH value: normalized entries for set membership, duplicates and dead entries"""
+
+    def __init__(self, value: str, separator: str = os.pathsep, windows: Optional[bool] = None,
+                 environ: Optional[Dict[str, str]] = None):
+        self.windows = (os.name == 'nt') if windows is None else windows
+        self.separator = separator
+        environ = os.environ if environ is None else environ
+        # Windows variable names are case-insensitive
+        self.environ = {k.upper(): v for k, v in environ.items()} if self.windows else dict(environ)
+        self.entries = [entry for entry in (part.strip() for part in value.split(separator)) if entry]
+        self.keys: Dict[str, str] = {}  # normalized -> first spelling
+        self.duplicates: List[str] = []
+        for entry in self.entries:
+            key = self.normalize(entry)
+            if key in self.keys:
+                self.duplicates.append(entry)
+            else:
+                self.keys[key] = entry
+
+    def expand(self, entry: str) -> str:
+        """Entry with quotes removed and variables expanded (unknown variables are kept)"""
+        value = entry.strip().strip('"')
+        if self.windows:
+            return re.sub(r'%([^%]+)%', lambda m: self.environ.get(m.group(1).upper(), m.group(0)), value)
+        if value.startswith('~'):
+            value = self.environ.get('HOME', '~') + value[1:]
+        return re.sub(r'\$\{(\w+)\}|\$(\w+)',
+                      lambda m: self.environ.get(m.group(1) or m.group(2), m.group(0)), value)
+
+    def normalize(self, entry: str) -> str:
+        """Comparison key: expanded, without trailing separators, case-folded on Windows"""
+        if self.windows:
+            import ntpath
+            return ntpath.normcase(ntpath.normpath(self.expand(entry)))
+        import posixpath
+        return posixpath.normpath(self.expand(entry))
+
+    def __contains__(self, entry: str) -> bool:
+        return self.normalize(entry) in self.keys
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def missing(self) -> List[str]:
+        """Unique entries whose directory does not exist (entries with unknown variables are skipped)"""
+        dead = []
+        for entry in self.keys.values():
+            path = self.expand(entry)
+            if not re.search(r'%[^%]+%|\$', path) and not os.path.isdir(path):
+                dead.append(entry)
+        return dead
+
+    def compacted(self) -> List[str]:
+        """Entries in order, first spelling of each kept, duplicates and dead entries dropped"""
+        dead = set(self.missing())
+        return [entry for entry in self.keys.values() if entry not in dead]
+
+    def join(self, entries: List[str]) -> str:
+        return self.separator.join(entries)
+
+class PlatformBackend(abc.ABC):
+    """OS-specific operations: privileges, console, user PATH storage and shortcuts"""
+
+    name = 'generic'
+    requires_admin = False  # Whether a global npm install needs an elevated session
+    path_separator = os.pathsep
+
+    def __init__(self, home: Optional[Path] = None):
+        self.home = home or Path.home()  # Profile whose PATH and desktop are managed
+
+    @staticmethod
+    def detect() -> 'PlatformBackend':
+        """Backend for the running OS"""
+        return WindowsBackend() if os.name == 'nt' else PosixBackend()
+
+    def for_profile(self, home: Path) -> 'PlatformBackend':
+        """The same backend managing another user profile's PATH and desktop"""
+        import copy
+        backend = copy.copy(self)
+        backend.home = Path(home)
+        return backend
+
+    def user_prefix(self) -> Path:
+        """npm prefix for a provisioned profile whose own .npmrc does not set one"""
+        return self.home / '.npm-global'
+
+    def mount(self):
+        """Make the profile's persistent settings reachable (paired with unmount)"""
+
+    def unmount(self):
+        """Release what mount() acquired"""
+
+    def own(self, path: Path):
+        """Hand a file or tree written for another profile over to that profile's owner"""
+
+    def describe_os(self) -> Tuple[bool, str]:
+        """(supported, status message) for the running OS"""
+        import platform
+        return True, f"{platform.system()} {platform.release()} detected"
+
+    def is_admin(self) -> bool:
+        return False
+
+    def enable_console(self):
+        """Prepare the console for ANSI output"""
+
+    def bin_dir(self, prefix: str) -> Path:
+        """Directory npm links global executables into"""
+        return Path(prefix)
+
+    def shim_names(self, command: str) -> List[str]:
+        """File names npm may give the executable shim of a command"""
+        return [command]
+
+    def launchers(self, bin_dir: Path, command: str) -> List[Path]:
+        """Every launcher npm created for a command (one per shell on Windows)"""
+        return [bin_dir / command] if os.path.lexists(bin_dir / command) else []
+
+    def package_dir(self, prefix: Path, package: str) -> Path:
+        """Where `npm install -g --prefix` puts a package"""
+        return prefix / 'lib' / 'node_modules' / package
+
+    def write_shim(self, shim: Path, target: Path):
+        """Point a launcher at target in one rename, so no one ever starts a half-written file"""
+        tmp = shim.with_name(f".{shim.name}.{os.getpid()}.tmp")
+        if os.path.lexists(tmp):
+            os.unlink(tmp)
+        os.symlink(target, tmp)
+        os.replace(tmp, shim)
+
+    def path_index(self, value: str) -> PathIndex:
+        return PathIndex(value, self.path_separator, windows=False)
+
+    @abc.abstractmethod
+    def read_user_path(self) -> str:
+        """User PATH as stored persistently (not the inherited environment)"""
+
+    @abc.abstractmethod
+    def write_user_path(self, value: str):
+        """Store the user PATH persistently"""
+
+    def session_path(self, user_path: str) -> str:
+        """PATH a new terminal starts with once user_path is stored"""
+        return self.path_separator.join(part for part in (user_path, os.environ.get('PATH', '')) if part)
+
+    def executable_names(self, command: str) -> List[str]:
+        return [command]
+
+    def is_executable(self, path: Path) -> bool:
+        return path.is_file() and os.access(str(path), os.X_OK)
+
+    def which(self, command: str, path: str) -> Optional[Path]:
+        """shutil.which against an explicit PATH (no current directory, no inherited environment)"""
+        index = self.path_index(path)
+        for directory in index.entries:
+            for name in self.executable_names(command):
+                candidate = Path(index.expand(directory)) / name
+                if self.is_executable(candidate):
+                    return candidate
+        return None
+
+    def needs_interpreter(self, executable: Path) -> bool:
+        """Files the OS cannot start on its own (Windows batch files)"""
+        return False
+
+    def batch_target(self, executable: Path) -> Optional[Path]:
+        """Node script or binary a batch launcher starts when that is all it does (npm's cmd-shim)"""
+        return None
+
+    def shim_target(self, shim: Path) -> Optional[Path]:
+        """Script or binary an npm bin shim launches (the shim itself for a plain executable)"""
+        if shim.is_symlink():
+            return shim.resolve()
+        try:
+            with open(shim, 'rb') as f:
+                head = f.read(8192)
+        except OSError:
+            return None
+        if b'\0' in head:
+            return shim  # Native binary
+        # cmd-shim output: "%dp0%\node_modules\...\cli.js" (.cmd) or "$basedir/node_modules/.../cli.js" (sh)
+        text = head.decode('utf-8', 'replace')
+        match = re.search(r'(?:%~?dp0%?\\|\$basedir/)(node_modules[^"\s]+)', text)
+        if match:
+            return shim.parent.joinpath(*re.split(r'[\\/]', match.group(1)))
+        # Launchers written by write_shim quote an absolute script or binary path
+        match = re.search(r'"([^"%$]+\.(?:js|mjs|cjs|exe))"', text)
+        if match:
+            return Path(match.group(1))
+        return shim
+
+    def broadcast_settings_change(self):
+        """Tell running programs the persistent environment changed"""
+
+    def create_shortcut(self, target: Path) -> Optional[Path]:
+        """Desktop launcher for target, or None without a desktop folder"""
+        return None
+
+    def try_lock(self, handle) -> bool:
+        """Exclusive, non-blocking lock on an open file; the OS drops it when the process exits"""
+        return True
+
+class WindowsBackend(PlatformBackend):
+    """HKCU\\Environment PATH, a batch file launcher and Win32 console/privilege calls"""
+
+    name = 'windows'
+    requires_admin = True
+    path_separator = ';'
+    hive: Optional[str] = None  # HKEY_USERS subkey of another profile; None for HKCU
+    loaded = False  # Whether mount() loaded the hive from NTUSER.DAT itself
+
+    def user_prefix(self) -> Path:
+        return self.home / 'AppData' / 'Roaming' / 'npm'
+
+    def mount(self):
+        """Use the hive of a signed-in profile, or load the profile's NTUSER.DAT"""
+        import subprocess
+        if self.home == Path.home():
+            return
+        import winreg
+        index = 0
+        while True:
+            try:
+                sid = winreg.EnumKey(winreg.HKEY_USERS, index)
+            except OSError:
+                break
+            index += 1
+            try:
+                key = winreg.OpenKey(winreg.HKEY_USERS, f"{sid}\\Volatile Environment")
+                try:
+                    profile, _ = winreg.QueryValueEx(key, 'USERPROFILE')
+                finally:
+                    winreg.CloseKey(key)
+            except OSError:
+                continue
+            if os.path.normcase(profile) == os.path.normcase(str(self.home)):
+                self.hive = sid
+                return
+        hive = f"ClaudeSetup_{self.home.name}"
+        # reg.exe enables the restore privilege that loading a hive needs
+        result = subprocess.run(['reg', 'load', f"HKU\\{hive}", str(self.home / 'NTUSER.DAT')],
+                                capture_output=True, text=True)
+        if result.returncode != 0:
+            raise OSError(f"cannot load the registry of {self.home}: {(result.stderr or result.stdout).strip()}")
+        self.hive, self.loaded = hive, True
+
+    def unmount(self):
+        import subprocess
+        if self.loaded:
+            subprocess.run(['reg', 'unload', f"HKU\\{self.hive}"], stdout=subprocess.DEVNULL,
+                           stderr=subprocess.DEVNULL)
+        self.hive, self.loaded = None, False
+
+    def _environment(self, access: int = 0):
+        """Open the Environment key of the managed profile"""
+        import winreg
+        if self.hive:
+            return winreg.OpenKey(winreg.HKEY_USERS, f"{self.hive}\\Environment", 0, access or winreg.KEY_READ)
+        return winreg.OpenKey(winreg.HKEY_CURRENT_USER, r"Environment", 0, access or winreg.KEY_READ)
+
+    def describe_os(self) -> Tuple[bool, str]:
+        import platform
+        release, version = platform.release(), platform.version()
+        if release in ['10', '11']:
+            return True, f"Windows {release} detected (Build {version})"
+        return False, f"Windows {release} may not be fully supported"
+
+    def is_admin(self) -> bool:
+        try:
+            import ctypes
+            return ctypes.windll.shell32.IsUserAnAdmin() != 0
+        except:
+            return False
+
+    def try_lock(self, handle) -> bool:
+        import msvcrt
+        try:
+            handle.seek(0)
+            msvcrt.locking(handle.fileno(), msvcrt.LK_NBLCK, 1)
+            return True
+        except OSError:
+            return False
+
+    def enable_console(self):
+        """Enable ANSI color support in Windows CMD"""
+        try:
+            import ctypes
+            kernel32 = ctypes.windll.kernel32
+            # Enable Virtual Terminal Processing
+            STD_OUTPUT_HANDLE = -11
+            ENABLE_VIRTUAL_TERMINAL_PROCESSING = 0x0004
+            handle = kernel32.GetStdHandle(STD_OUTPUT_HANDLE)
+            mode = ctypes.c_ulong()
+            kernel32.GetConsoleMode(handle, ctypes.byref(mode))
+            mode.value |= ENABLE_VIRTUAL_TERMINAL_PROCESSING
+            kernel32.SetConsoleMode(handle, mode)
+        except:
+            pass  # Fallback gracefully if it fails
+
+    def shim_names(self, command: str) -> List[str]:
+        return [f"{command}.cmd", f"{command}.exe"]
+
+    def launchers(self, bin_dir: Path, command: str) -> List[Path]:
+        names = [f"{command}.cmd", f"{command}.ps1", command, f"{command}.exe"]
+        return [bin_dir / name for name in names if (bin_dir / name).exists()]
+
+    def package_dir(self, prefix: Path, package: str) -> Path:
+        return prefix / 'node_modules' / package
+
+    def write_shim(self, shim: Path, target: Path):
+        # Same shapes as npm's cmd-shim; the .cmd leaves batch parsing before it runs
+        # node, so a console already inside the old file is not affected by the swap
+        native = target.suffix.lower() == '.exe'
+        program = f'"{target}"' if native else f'node "{target}"'
+        suffix = shim.suffix.lower()
+        if suffix == '.cmd':
+            body = ('@ECHO off\r\nSETLOCAL\r\n'
+                    f'endLocal & goto #_undefined_# 2>NUL || title %COMSPEC% & {program} %*\r\n')
+        elif suffix == '.ps1':
+            body = f'#!/usr/bin/env pwsh\n& {program} $args\nexit $LASTEXITCODE\n'
+        elif suffix == '.exe':
+            raise OSError(f"Cannot retarget a native launcher in place: {shim}")
+        else:
+            posix = target.as_posix()
+            body = f'#!/bin/sh\nexec {"" if native else "node "}"{posix}" "$@"\n'
+        tmp = shim.with_name(f".{shim.name}.{os.getpid()}.tmp")
+        with open(tmp, 'w', newline='') as f:
+            f.write(body)
+        os.replace(tmp, shim)
+
+    def path_index(self, value: str) -> PathIndex:
+        return PathIndex(value, self.path_separator, windows=True)
+
+    def read_user_path(self) -> str:
+        import winreg
+        key = self._environment()
+        try:
+            current_path, _ = winreg.QueryValueEx(key, "PATH")
+        except OSError:
+            current_path = ""
+        winreg.CloseKey(key)
+        return current_path
+
+    def write_user_path(self, value: str):
+        import winreg
+        key = self._environment(winreg.KEY_WRITE)
+        winreg.SetValueEx(key, "PATH", 0, winreg.REG_EXPAND_SZ, value)
+        winreg.CloseKey(key)
+
+    def session_path(self, user_path: str) -> str:
+        # New consoles get the machine PATH followed by the user PATH
+        import winreg
+        try:
+            key = winreg.OpenKey(winreg.HKEY_LOCAL_MACHINE,
+                                 r"SYSTEM\CurrentControlSet\Control\Session Manager\Environment")
+            try:
+                machine_path, _ = winreg.QueryValueEx(key, "Path")
+            finally:
+                winreg.CloseKey(key)
+        except OSError:
+            machine_path = ""
+        return ';'.join(part for part in (machine_path, user_path) if part)
+
+    def executable_names(self, command: str) -> List[str]:
+        pathext = os.environ.get('PATHEXT') or '.COM;.EXE;.BAT;.CMD'
+        return [command + ext.lower() for ext in pathext.split(';') if ext]
+
+    def is_executable(self, path: Path) -> bool:
+        return path.is_file()
+
+    def needs_interpreter(self, executable: Path) -> bool:
+        return executable.suffix.lower() in ('.cmd', '.bat')
+
+    def batch_target(self, executable: Path) -> Optional[Path]:
+        try:
+            text = executable.read_text(encoding='utf-8', errors='replace')
+        except OSError:
+            return None
+        # "%dp0%\node_modules\...\cli.js" from cmd-shim, or an absolute path from write_shim.
+        # npm's own npm.cmd also runs npm-prefix.js to pick a newer global npm: not a plain shim.
+        targets = {executable.parent.joinpath(*re.split(r'[\\/]', match))
+                   for match in re.findall(r'%~?dp0%?\\(node_modules[^"\s]+\.(?:[cm]?js|exe))\b', text)}
+        targets |= {Path(match) for match in re.findall(r'"([A-Za-z]:\\[^"%$]+\.(?:[cm]?js|exe))"', text)}
+        if len(targets) != 1:
+            return None
+        target = targets.pop()
+        return target if target.is_file() else None
+
+    def broadcast_settings_change(self):
+        try:
+            import win32api
+            import win32con
+            win32api.SendMessage(win32con.HWND_BROADCAST, win32con.WM_SETTINGCHANGE, 0, 'Environment')
+        except:
+            pass
 
-    # Status colors (bright + bold)
-    SUCCESS = '\033[1;38;5;82m'        # Bright Green
-    ERROR = '\033[1;38;5;196m'         # Bright Red
-    WARNING = '\033[1;38;5;226m'       # Bright Yellow
-    INFO = '\033[1;38;5;39m'           # Bright Blue
+    def create_shortcut(self, target: Path) -> Optional[Path]:
+        desktop = self.home / "Desktop"
+        if not desktop.exists():
+            return None
+        shortcut = desktop / "Claude Code.bat"
+        with open(shortcut, 'w') as f:
+            f.write(f'@echo off\n')
+            f.write(f'title Claude Code\n')
+            f.write(f'echo Starting Claude Code...\n')
+            f.write(f'"{target}"\n')
+            f.write(f'pause\n')
+        return shortcut
 
-    # UI colors (bright + bold)
-    WHITE = '\033[1;97m'               # Bright White
-    GRAY = '\033[1;38;5;245m'          # Bright Gray
-    DIM = '\033[2;38;5;240m'           # Dim Gray
-    CYAN = '\033[1;38;5;51m'           # Bright Cyan
-    MAGENTA = '\033[1;38;5;171m'       # Soft Magenta
-    PINK = '\033[1;38;5;213m'          # Bright Pink
+class PosixBackend(PlatformBackend):
+    """PATH kept in a marked block of the user's shell rc files; .desktop/.command launchers"""
 
-    # Effects
-    RESET = '\033[0m'
-    BOLD = '\033[1m'
-    ITALIC = '\033[3m'
-    UNDERLINE = '\033[4m'
+    name = 'posix'
+    BLOCK_START = '# >>> claude setup >>>'
+    BLOCK_END = '# <<< claude setup <<<'
+    EXPORT = re.compile(r'^export PATH="(.*):\$PATH"$')
 
-class Icons:
-    """Enhanced CMD-compatible icons"""
-    # Status icons (keeping ones that work, replacing problematic ones)
-    CHECK = '√'           # Works well in CMD
-    CROSS = 'x'           # Simple and clear
-    WARNING = '!'         # Clear and visible
-    INFO = 'i'            # Simple replacement for ℹ
-    ARROW = '>'           # Simple and clear
-    BULLET = '•'          # Works well
-    STAR = '*'            # Universal
-    GEAR = '~'            # Simple replacement for ⚙
+    def is_admin(self) -> bool:
+        return os.geteuid() == 0
 
-    # Claude-style loading animation (star sequence)
-    LOADING = ['·', '✢', '✶', '✶', '✶', '*', '*', '✢', '·', '✻', '*']
+    def try_lock(self, handle) -> bool:
+        import fcntl
+        try:
+            fcntl.flock(handle.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return True
+        except OSError:
+            return False
+
+    def bin_dir(self, prefix: str) -> Path:
+        return Path(prefix) / 'bin'
+
+    def rc_files(self) -> List[Path]:
+        """~/.profile plus the rc file of every shell that is in use"""
+        home = self.home
+        shell = os.path.basename(os.environ.get('SHELL', '')) if home == Path.home() else ''
+        files = [home / '.profile']
+        for name, rc in (('bash', '.bashrc'), ('zsh', '.zshrc')):
+            if shell == name or (home / rc).exists():
+                files.append(home / rc)
+        return files
+
+    def _split(self, text: str) -> Tuple[List[str], Optional[List[str]]]:
+        """(lines outside the managed block, PATH entries inside it or None)"""
+        kept: List[str] = []
+        entries: Optional[List[str]] = None
+        inside = False
+        for line in text.splitlines():
+            if line.strip() == self.BLOCK_START:
+                inside, entries = True, entries or []
+            elif line.strip() == self.BLOCK_END:
+                inside = False
+            elif inside:
+                match = self.EXPORT.match(line.strip())
+                if match:
+                    value = re.sub(r'\\(.)', r'\1', match.group(1))
+                    entries += [entry for entry in value.split(os.pathsep) if entry]
+            else:
+                kept.append(line)
+        return kept, entries
+
+    def read_user_path(self) -> str:
+        for rc in self.rc_files():
+            try:
+                _, entries = self._split(rc.read_text(encoding='utf-8'))
+            except OSError:
+                continue
+            if entries is not None:
+                return os.pathsep.join(entries)
+        return ""
+
+    def write_user_path(self, value: str):
+        import shutil
+        entries = [entry for entry in value.split(os.pathsep) if entry]
+        # $VAR references stay live, like %VAR% in a REG_EXPAND_SZ value
+        quoted = re.sub(r'([\\"`])', r'\\\1', os.pathsep.join(entries))
+        block = [self.BLOCK_START, f'export PATH="{quoted}:$PATH"', self.BLOCK_END] if entries else []
+        for rc in self.rc_files():
+            try:
+                kept, _ = self._split(rc.read_text(encoding='utf-8'))
+            except FileNotFoundError:
+                kept = []
+            while kept and not kept[-1].strip():
+                kept.pop()
+            lines = kept + ([''] if kept and block else []) + block
+            tmp = rc.with_name(rc.name + '.claude-setup.tmp')
+            tmp.write_text('\n'.join(lines) + '\n' if lines else '', encoding='utf-8')
+            if rc.exists():
+                shutil.copymode(rc, tmp)
+            os.replace(tmp, rc)
+            self.own(rc)
+
+    def create_shortcut(self, target: Path) -> Optional[Path]:
+        desktop = self.home / "Desktop"
+        if not desktop.exists():
+            return None
+        if sys.platform == 'darwin':
+            shortcut = desktop / "Claude Code.command"
+            shortcut.write_text(f'#!/bin/sh\nexec "{target}"\n', encoding='utf-8')
+        else:
+            shortcut = desktop / "Claude Code.desktop"
+            shortcut.write_text("[Desktop Entry]\nType=Application\nName=Claude Code\n"
+                                f'Exec="{target}"\nTerminal=true\n', encoding='utf-8')
+        shortcut.chmod(0o755)
+        self.own(shortcut)
+        return shortcut
+
+    def own(self, path: Path):
+        # Only root writes into other users' homes
+        if os.geteuid() != 0 or not os.path.lexists(path):
+            return
+        try:
+            owner = self.home.stat()
+        except OSError:
+            return
+        if owner.st_uid == 0:
+            return
+        if path.is_dir() and not path.is_symlink():
+            for root, dirs, files in os.walk(path):
+                for name in dirs + files:
+                    os.lchown(os.path.join(root, name), owner.st_uid, owner.st_gid)
+        os.lchown(path, owner.st_uid, owner.st_gid)
+
+class CommandIndex:
+    """Executables resolved once from PATH (and PATHEXT), as argument lists that need no shell
+
+    A batch file that only starts a node script (npm's cmd-shim) is run as
+    `node script.js` directly, one that only starts a binary as that binary;
+    any other batch file gets an explicit cmd.exe.
+    Everything else is spawned as it is.
+    """
+
+    def __init__(self, backend: PlatformBackend, path: Optional[str] = None):
+        self.backend = backend
+        self.path = os.environ.get('PATH', '') if path is None else path
+        self._resolved: Dict[str, Path] = {}
+        self._targets: Dict[Path, Optional[Path]] = {}
+        self._lock = threading.Lock()
+
+    def resolve(self, command: str) -> Optional[Path]:
+        """Executable a bare command name starts (misses are looked up again, e.g. after an install)"""
+        with self._lock:
+            if command in self._resolved:
+                return self._resolved[command]
+        executable = self.backend.which(command, self.path)
+        if executable is not None:
+            with self._lock:
+                self._resolved[command] = executable
+        return executable
+
+    def target(self, executable: Path) -> Optional[Path]:
+        with self._lock:
+            if executable in self._targets:
+                return self._targets[executable]
+        target = self.backend.batch_target(executable)
+        with self._lock:
+            self._targets[executable] = target
+        return target
+
+    def command_line(self, cmd: List[str]) -> Union[List[str], str]:
+        """What to spawn for [command or path, *args]"""
+        head, args = cmd[0], [str(arg) for arg in cmd[1:]]
+        executable = Path(head) if os.path.dirname(head) else self.resolve(head)
+        if executable is None:
+            return [head] + args  # Let the spawn report it missing
+        if not self.backend.needs_interpreter(executable):
+            return [str(executable)] + args
+        target = self.target(executable)
+        if target is not None and target.suffix.lower() == '.exe':
+            return [str(target)] + args
+        if target is not None:
+            bundled = executable.parent / 'node.exe'
+            node = bundled if bundled.is_file() else self.resolve('node')
+            if node is not None:
+                return [str(node), str(target)] + args
+        comspec = os.environ.get('COMSPEC', 'cmd.exe')
+        line = ' '.join(self.cmd_quote(arg) for arg in [str(executable)] + args)
+        return f'"{comspec}" /d /s /c "{line}"'
+
+    @staticmethod
+    def cmd_quote(arg: str) -> str:
+        """Argument on a cmd.exe line: metacharacters such as ^ < > | & are literal only inside quotes"""
+        return f'"{arg}"' if not arg or re.search(r'[\s&|<>^()%!,;="]', arg) else arg
+
+class ProvisionTarget:
+    """One user profile or bare npm prefix of a multi-target run, and how provisioning it went"""
+
+    def __init__(self, name: str, prefix: Path, backend: Optional[PlatformBackend] = None):
+        self.name = name
+        self.prefix = prefix
+        self.backend = backend  # Backend bound to the profile (PATH, desktop); None for a bare prefix
+        self.previous: Optional[str] = None  # Version found before the run
+        self.version: Optional[str] = None
+        self.status = 'pending'  # current, kept, installed, updated or failed
+        self.detail = ''
+        self.seconds = 0.0
+        self.path_changed = False
 
 class SetupWizard:
     """Main setup wizard class"""
 
-    def __init__(self):
-        self.enable_ansi_colors()  # Enable colors in Windows CMD
+    def __init__(self, pacing: Optional[Pacing] = None, idle_timeout: float = NPM_IDLE_TIMEOUT,
+                 use_cache: bool = True, log_format: str = 'text', from_cache: Optional[str] = None,
+                 trace_path: Optional[Path] = None, backend: Optional[PlatformBackend] = None,
+                 compact_path: bool = False, verify_spawn: bool = True, staged: bool = True,
+                 keep_versions: int = KEEP_VERSIONS, max_versions_bytes: Optional[int] = None,
+                 resume: bool = True, manifest: Optional[Dict[str, str]] = None):
+        self.pacing = pacing or Pacing()
+        self.backend = backend or PlatformBackend.detect()
+        self.commands = CommandIndex(self.backend)
+        self.tracer = Tracer()
+        self.trace_path = trace_path
+        self.renderer = Renderer()
+        self.idle_timeout = idle_timeout
+        self.use_cache = use_cache
+        self.probe_cache = ProbeCache(CACHE_DIR / 'probes.json', enabled=use_cache)
+        self.package_store = PackageStore(CACHE_DIR / 'packages')
+        self.version_store = VersionStore(CACHE_DIR / 'versions')
+        self.staged = staged  # Update next to the live version and switch launchers afterwards
+        self.keep_versions = keep_versions  # Snapshots kept for rollback, by count and total size
+        self.max_versions_bytes = max_versions_bytes
+        self.manifest = manifest  # Package -> version spec installed together with --manifest
+        self.package_results: List[List[Any]] = []  # [package, version, status] rows for the summary
+        self.journal = Journal(CACHE_DIR / 'journal.json', resume=resume, key={
+            'script': SCRIPT_VERSION, 'backend': self.backend.name, 'from_cache': from_cache,
+            'staged': staged, 'compact_path': compact_path, 'manifest': manifest,
+            'update': self.pacing.answers.get('update')})
+        self.from_cache = from_cache  # Version to install from the package store ('' = newest)
+        self.compact_path = compact_path  # Drop duplicate and dead entries when writing PATH
+        self.verify_spawn = verify_spawn  # Run the installed claude once to confirm it starts
+        self.backend.enable_console()  # Enable colors in Windows CMD
         self.errors = []
         self.warnings = []
         self.npm_prefix = None
         self.claude_path = None
+        self.user_path = None  # User PATH as configure_path left it
         self.start_time = time.time()
         self.total_steps = 7
         self.current_step = 0
-        self.log_file = self.setup_log()
+        self.log_file = self.setup_log(log_format)
+        self.run_log = RunLog(self.log_file, log_format)
+        self.probes = self.setup_probes()
 
-    def enable_ansi_colors(self):
-        """Enable ANSI color support in Windows CMD"""
-        if os.name == 'nt':
-            try:
-                import ctypes
-                kernel32 = ctypes.windll.kernel32
-                # Enable Virtual Terminal Processing
-                STD_OUTPUT_HANDLE = -11
-                ENABLE_VIRTUAL_TERMINAL_PROCESSING = 0x0004
-                handle = kernel32.GetStdHandle(STD_OUTPUT_HANDLE)
-                mode = ctypes.c_ulong()
-                kernel32.GetConsoleMode(handle, ctypes.byref(mode))
-                mode.value |= ENABLE_VIRTUAL_TERMINAL_PROCESSING
-                kernel32.SetConsoleMode(handle, mode)
-            except:
-                pass  # Fallback gracefully if it fails
+    @classmethod
+    def from_args(cls, args: argparse.Namespace) -> 'SetupWizard':
+        """Wizard configured from parsed command line options"""
+        return cls(pacing=Pacing.from_args(args), idle_timeout=args.idle_timeout, use_cache=args.use_cache,
+                   log_format=args.log_format, from_cache=args.from_cache,
+                   trace_path=Path(args.trace) if args.trace else None, compact_path=args.compact_path,
+                   verify_spawn=args.verify_spawn, staged=args.staged, keep_versions=args.keep_versions,
+                   max_versions_bytes=int(args.max_versions_size * 1024 ** 2) if args.max_versions_size else None,
+                   resume=not args.restart, manifest=args.manifest)
 
-    def setup_log(self):
+    def setup_log(self, log_format: str = 'text') -> Optional[Path]:
         """Initialize logging"""
+        from datetime import datetime
         try:
-            log_dir = Path.home() / '.claude_setup_logs'
-            log_dir.mkdir(exist_ok=True)
+            LOG_DIR.mkdir(exist_ok=True)
             timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-            return log_dir / f'claude_setup_{timestamp}.log'
+            extension = 'jsonl' if log_format == 'jsonl' else 'log'
+            return LOG_DIR / f'claude_setup_{timestamp}.{extension}'
         except:
             return None
 
+    def setup_probes(self) -> ProbeEngine:
+        """Declare the independent environment probes used by the first steps"""
+        import shutil
+        probes = ProbeEngine(tracer=self.tracer)
+        probes.register('os', self.backend.describe_os)
+        probes.register('admin', self.check_admin)
+        probes.register('disk', shutil.disk_usage, Path.home())
+        probes.register('node', self.check_command, 'node')
+        probes.register('npm', self.check_command, 'npm')
+        probes.register('claude', self.check_command, 'claude')
+        probes.register('latest', self.target_version)
+        # Inputs of configure_path that do not depend on the install itself
+        probes.register('npm_prefix', self.resolve_npm_prefix)
+        probes.register('user_path', self.read_user_path)
+        return probes
+
     def log(self, message: str, level: str = 'INFO'):
         """Write to log file"""
-        if self.log_file:
-            try:
-                timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-                with open(self.log_file, 'a', encoding='utf-8') as f:
-                    f.write(f"[{timestamp}] [{level}] {message}\n")
-            except:
-                pass
+        self.run_log.write(message, level)
 
     def clear_screen(self):
         """Clear terminal screen"""
-        os.system('cls' if os.name == 'nt' else 'clear')
+        if not self.pacing.clear:
+            return
+        self.renderer.emit([self.renderer.clear()], end='')
 
     def get_terminal_width(self) -> int:
         """Get terminal width for responsive design"""
+        import shutil
         try:
             return min(shutil.get_terminal_size().columns, 80)
         except:
             return 60
 
+    def banner_lines(self) -> List[str]:
+        """Lines of the stylized banner"""
+        title = (f"     {Colors.BOLD}{Colors.WHITE}CLAUDE CODE{Colors.RESET}  {Colors.GRAY}•{Colors.RESET}  "
+                 f"{Colors.SECONDARY}INSTALLATION WIZARD{Colors.RESET}  {Colors.GRAY}•{Colors.RESET}  "
+                 f"{Colors.DIM}v{SCRIPT_VERSION}{Colors.RESET}")
+        return [''] + Renderer.box([title], Colors.PRIMARY) + ['']
+
     def print_banner(self):
         """Display stylized banner"""
-        self.clear_screen()
-        print(f"\n{Colors.PRIMARY}  ┌──────────────────────────────────────────────────────────┐{Colors.RESET}")
-        print(f"{Colors.PRIMARY}  │{Colors.RESET}      {Colors.BOLD}{Colors.WHITE}CLAUDE CODE{Colors.RESET}  {Colors.GRAY}•{Colors.RESET}  {Colors.SECONDARY}INSTALLATION WIZARD{Colors.RESET}  {Colors.GRAY}•{Colors.RESET}  {Colors.DIM}v{SCRIPT_VERSION}{Colors.RESET}      {Colors.PRIMARY}│{Colors.RESET}")
-        print(f"{Colors.PRIMARY}  └──────────────────────────────────────────────────────────┘{Colors.RESET}\n")
+        clear = self.renderer.clear() if self.pacing.clear else ''
+        lines = self.banner_lines()
+        self.renderer.emit([clear + lines[0]] + lines[1:])
 
     def print_box(self, title: str, content: List[str] = None, color: str = None, style: str = 'single'):
         """Print a styled box with optional content"""
         if color is None:
             color = Colors.PRIMARY
-        width = 60
-
-        # Top border
-        print(f"  {color}┌{'─' * (width - 2)}┐{Colors.RESET}")
-        # Title
-        title_padded = title.center(width - 4)
-        print(f"  {color}│{Colors.RESET} {Colors.BOLD}{title_padded}{Colors.RESET} {color}│{Colors.RESET}")
-        # Content
-        if content:
-            print(f"  {color}├{'─' * (width - 2)}┤{Colors.RESET}")
-            for line in content:
-                if len(line) > width - 5:
-                    line = line[:width - 8] + '...'
-                padding = width - len(line) - 5
-                print(f"  {color}│{Colors.RESET} {line}{' ' * padding} {color} │{Colors.RESET}")
-        # Bottom border
-        print(f"  {color}└{'─' * (width - 2)}┘{Colors.RESET}\n")
+        self.renderer.emit(Renderer.box(content or [], color, title=title) + [''])
 
     def print_status(self, text: str, status: str = 'info', indent: int = 2):
         """Print status message with icon"""
-        indent_str = ' ' * indent
-
-        if status == 'success':
-            print(f"{indent_str}{Colors.SUCCESS}{Icons.CHECK} {text}{Colors.RESET}")
-            self.log(text, 'SUCCESS')
-        elif status == 'error':
-            print(f"{indent_str}{Colors.ERROR}{Icons.CROSS} {text}{Colors.RESET}")
-            self.log(text, 'ERROR')
+        styles = {
+            'success': (Colors.SUCCESS, Icons.CHECK, 'SUCCESS'),
+            'error': (Colors.ERROR, Icons.CROSS, 'ERROR'),
+            'warning': (Colors.WARNING, Icons.WARNING, 'WARNING'),
+            'info': (Colors.INFO, Icons.INFO, 'INFO'),
+            'loading': (Colors.CYAN, Icons.GEAR, 'INFO'),
+        }
+        if status not in styles:
+            return
+        color, icon, level = styles[status]
+        self.renderer.emit([f"{' ' * indent}{color}{icon} {text}{Colors.RESET}"])
+        self.log(text, level)
+        if status == 'error':
             self.errors.append(text)
+            step = StepScheduler.current()
+            if step:
+                step.failed = True
         elif status == 'warning':
-            print(f"{indent_str}{Colors.WARNING}{Icons.WARNING} {text}{Colors.RESET}")
-            self.log(text, 'WARNING')
             self.warnings.append(text)
-        elif status == 'info':
-            print(f"{indent_str}{Colors.INFO}{Icons.INFO} {text}{Colors.RESET}")
-            self.log(text, 'INFO')
-        elif status == 'loading':
-            print(f"{indent_str}{Colors.CYAN}{Icons.GEAR} {text}{Colors.RESET}")
-            self.log(text, 'INFO')
 
     def print_step(self, title: str, clear: bool = True):
         """Print step header with progress bar"""
-        # Clear screen and show banner for clean single-step display
-        if clear and self.current_step > 0:
-            time.sleep(1.5)  # Pause before clearing for readability
-            self.clear_screen()
-            self.print_banner()
-
-        self.current_step += 1
-        width = 60
-        progress = self.current_step / self.total_steps
+        step = StepScheduler.current()
+        number = step.number if step else self.current_step + 1
+        if step:
+            step.title = title
+        self.current_step = max(self.current_step, number)
+
+        frame = ['']
+        # Clear the area under the banner for a clean single-step display
+        if clear and self.pacing.clear and number > 1:
+            self.renderer.defer(lambda: self.pacing.pause(1.5))  # Pause before clearing for readability
+            frame = [self.renderer.clear(keep_rows=Renderer.BANNER_ROWS)]
+
+        self.begin_step(title)
+        progress = number / self.total_steps
         filled = int(progress * 20)
         bar = '█' * filled + '░' * (20 - filled)
-        percentage = int(progress * 100)
-        percent_str = f"{percentage}%"
+        percent_str = f"{int(progress * 100)}%"
 
-        # Calculate proper spacing for alignment
-        step_text = f"STEP {self.current_step}/{self.total_steps} - {title}"
-        step_padding = width - len(step_text) - 3  # 3 = 2 borders + 1 leading space
+        step_text = f"{Colors.WHITE}STEP {number}/{self.total_steps} - {title}{Colors.RESET}"
+        bar_text = f"{Colors.PRIMARY}[{bar}]{Colors.RESET} {Colors.WHITE}{percent_str}{Colors.RESET}"
+        self.renderer.emit(frame + Renderer.box([step_text, bar_text], Colors.SECONDARY) + [''])
 
-        bar_text = f"[{bar}] {percent_str}"
-        # Account for ANSI color codes not taking visual space
-        bar_padding = width - 26 - len(percent_str)  # 26 = 2 borders + 1 space + brackets + bar + space + percentage
+        self.pacing.pause(0.3)  # Brief pause after showing step header
 
-        print(f"\n  {Colors.SECONDARY}┌{'─' * (width - 2)}┐{Colors.RESET}")
-        print(f"  {Colors.SECONDARY}│{Colors.RESET} {Colors.WHITE}{step_text}{Colors.RESET}{' ' * step_padding}{Colors.SECONDARY}│{Colors.RESET}")
-        print(f"  {Colors.SECONDARY}│{Colors.RESET} {Colors.PRIMARY}[{bar}]{Colors.RESET} {Colors.WHITE}{percent_str}{Colors.RESET}{' ' * bar_padding}{Colors.SECONDARY}│{Colors.RESET}")
-        print(f"  {Colors.SECONDARY}└{'─' * (width - 2)}┘{Colors.RESET}\n")
+    def begin_step(self, title: Optional[str], outcome: Optional[str] = None):
+        """Close the calling thread's step span in the log and the trace, and open the next"""
+        self.run_log.set_step(title, outcome)
+        self.tracer.begin_step(title)
 
-        time.sleep(0.3)  # Brief pause after showing step header
+    def finish_trace(self):
+        """Write the --trace file and show the per-run timing table (once)"""
+        if self.trace_path is None:
+            return
+        path, self.trace_path = self.trace_path, None
+        rows = self.tracer.summary()
+        try:
+            self.tracer.export(path)
+            self.log(f"Trace written: {path}")
+        except OSError as e:
+            self.print_status(f"Could not write trace: {e}", 'warning')
+            return
+        table = [f"{'KIND':<8} {'NAME':<24} {'N':>3} {'TOTAL':>7} {'MAX':>7}"]
+        for cat, name, count, total, longest in rows[:12]:
+            table.append(f"{cat:<8} {Renderer.fit(name, 24)} {count:>3} {total:>6.2f}s {longest:>6.2f}s")
+        self.renderer.emit([''] + Renderer.box(table, Colors.SECONDARY, title=f"TIMINGS  ({path.name})") + [''])
+        for cat, name, count, total, longest in rows:
+            self.log(f"Timing {cat} {name}: n={count} total={total:.3f}s max={longest:.3f}s", 'TRACE')
 
-    def animated_loading(self, text: str, duration: float = 3.0):
-        """Show Claude-style animated loading indicator"""
+    def stream_command(self, cmd: List[str], text: str, cwd: Optional[str] = None) -> int:
+        """Run a long command with a spinner driven by its real output"""
         frames = Icons.LOADING
-        start = time.time()
-        idx = 0
+        state = {'frame': 0, 'detail': ''}
+        room = max(self.get_terminal_width() - len(text) - 12, 0)
 
-        while time.time() - start < duration:
-            print(f"\r  {Colors.SECONDARY}{frames[idx]}{Colors.RESET} {text}...", end='', flush=True)
-            time.sleep(0.15)  # Slower animation for readability
-            idx = (idx + 1) % len(frames)
+        def draw(suffix: str = ''):
+            frame = frames[state['frame'] % len(frames)]
+            detail = (state['detail'] + suffix)[:room]
+            self.renderer.live(f"  {Colors.SECONDARY}{frame}{Colors.RESET} {text}... {Colors.DIM}{detail}{Colors.RESET}")
 
-        print(f"\r  {Colors.SUCCESS}{Icons.CHECK}{Colors.RESET} {text}... Done!{' ' * 10}")
-        time.sleep(0.5)  # Pause after completion
+        # Only the last lines stay in memory; the log gets every line as it arrives
+        tail = OutputCapture(max_lines=8, spill=lambda line: self.log(line, 'NPM'))
+
+        def on_line(line: str):
+            tail(line)
+            if line.strip():
+                state['frame'] += 1
+                state['detail'] = line.strip()
+                draw()
+
+        def on_idle(quiet: float):
+            # Only say we are waiting once npm has been silent for a while
+            if quiet >= 5:
+                draw(f" (waiting {int(quiet)}s)")
+
+        draw()
+        runner = ProcessRunner(self.commands.command_line(cmd), idle_timeout=self.idle_timeout, cwd=cwd,
+                               tracer=self.tracer)
+        label, cmd = self.command_label(cmd), runner.display
+        try:
+            code = runner.run(on_line, on_idle)
+            self.log_command(label, runner, code)
+        except KeyboardInterrupt:
+            self.renderer.end_live(f"  {Colors.WARNING}{Icons.WARNING}{Colors.RESET} {text}... Cancelled")
+            self.log(f"Command cancelled: {cmd}", 'WARNING')
+            raise
+        except Exception as e:
+            self.renderer.end_live(f"  {Colors.ERROR}{Icons.CROSS}{Colors.RESET} {text}... Failed")
+            self.log(f"Command error: {cmd} - {e}", 'ERROR')
+            return 1
+
+        if runner.timed_out:
+            self.renderer.end_live(f"  {Colors.ERROR}{Icons.CROSS}{Colors.RESET} {text}... No output for {int(self.idle_timeout)}s")
+            self.log(f"Command timeout (idle {self.idle_timeout}s): {cmd}", 'ERROR')
+            self.show_output_tail(tail)
+            return 1
+        if code == 0:
+            self.renderer.end_live(f"  {Colors.SUCCESS}{Icons.CHECK}{Colors.RESET} {text}... Done!")
+        else:
+            self.renderer.end_live(f"  {Colors.ERROR}{Icons.CROSS}{Colors.RESET} {text}... Failed (exit code {code})")
+            self.log(f"Command failed with exit code {code}: {cmd}", 'ERROR')
+            self.show_output_tail(tail)
+        self.pacing.pause(0.5)  # Pause after completion
+        return code
+
+    def show_output_tail(self, tail: OutputCapture):
+        """Last lines of a failed command, with the full output flushed to the log"""
+        self.run_log.flush()
+        lines = [f"    {Colors.DIM}{line.strip()[:self.get_terminal_width() - 6]}{Colors.RESET}"
+                 for line in tail.lines if line.strip()]
+        if self.log_file:
+            lines.append(f"    {Colors.DIM}Full output ({tail.total} lines): {self.log_file}{Colors.RESET}")
+        self.renderer.emit(lines)
 
     def check_admin(self) -> bool:
         """Check if running as administrator"""
-        try:
-            return ctypes.windll.shell32.IsUserAnAdmin() != 0
-        except:
-            return False
+        return self.backend.is_admin()
 
-    def run_command(self, cmd: str, capture: bool = False) -> Tuple[Optional[str], int]:
-        """Execute command and return output"""
+    def run_command(self, cmd: List[str], capture: bool = False,
+                    until: Optional[Callable[[str], bool]] = None) -> Tuple[Optional[str], int]:
+        """Execute command and return output (the last lines only; all of it goes to the log)"""
         try:
-            if capture:
-                result = subprocess.run(cmd, shell=True, capture_output=True, text=True, encoding='utf-8', errors='replace', timeout=30)
-                return result.stdout.strip(), result.returncode
-            else:
-                result = subprocess.run(cmd, shell=True, timeout=30)
-                return None, result.returncode
-        except subprocess.TimeoutExpired:
-            self.log(f"Command timeout: {cmd}", 'ERROR')
-            return None, 1
+            output = OutputCapture(spill=lambda line: self.log(line, 'OUT'), until=until)
+
+            def echo(line: str) -> bool:
+                self.renderer.emit([line])
+                return output(line)
+
+            # Captured output is parsed from stdout alone; stderr still goes to the log
+            runner = ProcessRunner(self.commands.command_line(cmd), idle_timeout=30, merge_stderr=not capture,
+                                   tracer=self.tracer, on_stderr=lambda line: self.log(line, 'STDERR'))
+            label, cmd = self.command_label(cmd), runner.display
+            code = runner.run(output if capture else echo)
+            self.log_command(label, runner, code)
+            if runner.timed_out:
+                self.log(f"Command timeout: {cmd}", 'ERROR')
+                return None, 1
+            return (output.text() if capture else None), code
         except Exception as e:
             self.log(f"Command error: {cmd} - {e}", 'ERROR')
             return None, 1
 
+    @staticmethod
+    def command_label(cmd: List[str]) -> str:
+        """Stable name of a command for timing statistics, e.g. 'npm install' or 'claude --version'"""
+        return ' '.join([Path(cmd[0]).name.split('.')[0]] + [str(arg) for arg in cmd[1:2]])
+
+    def log_command(self, label: str, runner: ProcessRunner, code: int):
+        """Timing record read back by --report"""
+        self.run_log.write(f"Command finished: {label} ({runner.elapsed:.3f}s, exit {code})", 'CMD',
+                           duration=runner.elapsed)
+
     def check_command(self, cmd: str) -> Tuple[bool, str]:
-        """Check if command exists and get version"""
-        output, code = self.run_command(f"{cmd} --version", capture=True)
+        """Check if command exists and get version, reusing cached results for unchanged binaries"""
+        key = self.probe_cache.key(cmd)
+        cached = self.probe_cache.get(key)
+        if cached:
+            self.log(f"Probe cache hit: {cmd} -> {cached[1]}")
+            return cached
+        result = self.probe_version(cmd)
+        self.probe_cache.put(key, result)
+        return result
+
+    @staticmethod
+    def is_version_line(line: str) -> bool:
+        """Looks like v1.0.0 or 1.0.0, not an update notice box"""
+        line = line.strip()
+        return bool(line) and not line.startswith(('│', '└', '┌', '├')) and any(c.isdigit() for c in line)
+
+    def probe_version(self, cmd: str) -> Tuple[bool, str]:
+        """Run `cmd --version` and extract the version line, reading no further than it"""
+        output, code = self.run_command([cmd, '--version'], capture=True, until=self.is_version_line)
         if code == 0 and output:
             # Extract just the version number, filter out error messages
-            lines = output.split('\n')
-            for line in lines:
-                line = line.strip()
-                # Look for version patterns like v1.0.0 or just 1.0.0
-                if line and not line.startswith('│') and not line.startswith('└') and not line.startswith('┌') and not line.startswith('├'):
-                    if any(c.isdigit() for c in line):
-                        return True, line
+            for line in output.split('\n'):
+                if self.is_version_line(line):
+                    return True, line.strip()
             return True, output.split('\n')[0] or "Unknown"
         return False, "Unknown"
 
@@ -256,50 +2752,47 @@ class SetupWizard:
         """Check system requirements"""
         self.print_step("System Requirements Check")
         all_good = True
-        time.sleep(0.5)
+        self.pacing.pause(0.5)
 
-        # Check Windows version
+        # Check OS version
         try:
-            import platform
-            win_ver = platform.version()
-            win_rel = platform.release()
-            if win_rel in ['10', '11']:
-                self.print_status(f"Windows {win_rel} detected (Build {win_ver})", 'success')
-                time.sleep(0.3)
+            supported, description = self.probes.get('os')
+            if supported:
+                self.print_status(description, 'success')
+                self.pacing.pause(0.3)
             else:
-                self.print_status(f"Windows {win_rel} may not be fully supported", 'warning')
+                self.print_status(description, 'warning')
         except:
-            self.print_status("Could not detect Windows version", 'warning')
+            self.print_status("Could not detect OS version", 'warning')
 
         # Check admin rights
-        is_admin = self.check_admin()
+        is_admin = self.probes.get('admin', False)
         if is_admin:
             self.print_status("Administrator privileges confirmed", 'success')
+        elif not self.backend.requires_admin:
+            self.print_status("Running as a regular user (no elevation needed)", 'info')
         else:
             self.print_status("Administrator privileges required!", 'error')
             all_good = False
 
         # Check disk space
-        try:
-            home = Path.home()
-            stat = shutil.disk_usage(home)
+        stat = self.probes.get('disk')
+        if stat is not None:
             free_gb = stat.free / (1024 ** 3)
             if free_gb > 1:
                 self.print_status(f"Sufficient disk space ({free_gb:.1f} GB free)", 'success')
             else:
                 self.print_status(f"Low disk space ({free_gb:.1f} GB free)", 'warning')
-        except:
-            pass
 
         return all_good
 
     def check_nodejs(self) -> bool:
         """Check Node.js and npm installation"""
         self.print_step("Node.js & npm Verification")
-        time.sleep(0.5)
+        self.pacing.pause(0.5)
 
         # Check Node.js
-        node_ok, node_ver = self.check_command("node")
+        node_ok, node_ver = self.probes.get('node', (False, "Unknown"))
         if node_ok:
             # Parse version
             try:
@@ -309,26 +2802,26 @@ class SetupWizard:
                     major = int(match.group(1))
                     if major >= 16:
                         self.print_status(f"Node.js {node_ver} installed", 'success')
-                        time.sleep(0.3)
+                        self.pacing.pause(0.3)
                     else:
                         self.print_status(f"Node.js {node_ver} is outdated (v16+ required)", 'warning')
-                        time.sleep(0.3)
+                        self.pacing.pause(0.3)
                 else:
                     self.print_status(f"Node.js found: {node_ver}", 'success')
-                    time.sleep(0.3)
+                    self.pacing.pause(0.3)
             except:
                 self.print_status(f"Node.js found: {node_ver}", 'success')
-                time.sleep(0.3)
+                self.pacing.pause(0.3)
         else:
             self.print_status("Node.js not found!", 'error')
             self.print_status("Download from: https://nodejs.org", 'info')
             return False
 
         # Check npm
-        npm_ok, npm_ver = self.check_command("npm")
+        npm_ok, npm_ver = self.probes.get('npm', (False, "Unknown"))
         if npm_ok:
             self.print_status(f"npm {npm_ver} installed", 'success')
-            time.sleep(0.3)
+            self.pacing.pause(0.3)
         else:
             self.print_status("npm not found!", 'error')
             return False
@@ -337,35 +2830,43 @@ class SetupWizard:
 
     def install_claude(self) -> bool:
         """Install or update Claude Code"""
+        if self.manifest:
+            return self.install_manifest()
         self.print_step("Claude Code Installation")
-        time.sleep(0.5)
+        self.pacing.pause(0.5)
 
         # Check if already installed
-        claude_ok, claude_ver = self.check_command("claude")
-        time.sleep(0.5)
+        claude_ok, claude_ver = self.probes.get('claude', (False, "Unknown"))
+        self.pacing.pause(0.5)
 
         if claude_ok:
             self.print_status(f"Claude Code already installed: {claude_ver}", 'success')
-            time.sleep(0.3)
+            self.pacing.pause(0.3)
 
-            # Ask for update
-            print(f"\n  {Colors.INFO}{Icons.INFO}{Colors.RESET} Update to latest version? (y/n): ", end='')
-            choice = input().lower()
+            # Skip npm entirely when the registry has nothing newer
+            installed = self.parse_version(claude_ver)
+            latest = self.probes.get('latest')
+            if installed and latest == installed:
+                self.print_status(f"Already up to date (latest is {latest})", 'success')
+                return True
+            if latest:
+                self.print_status(f"Version {latest} is available", 'info')
 
-            if choice == 'y':
+            # Ask for update
+            if self.pacing.confirm("Update to latest version?", 'update', renderer=self.renderer):
                 self.print_status("Updating Claude Code...", 'loading')
-                self.animated_loading("Installing latest version", 3)
-                _, code = self.run_command("npm install -g @anthropic-ai/claude-code@latest --force")
+                code = self.apply_update(latest)
                 if code == 0:
+                    self.probes.invalidate('claude')
                     self.print_status("Claude Code updated successfully!", 'success')
                 else:
                     self.print_status("Update failed, keeping current version", 'warning')
         else:
             self.print_status("Installing Claude Code...", 'loading')
-            self.animated_loading("Downloading and installing", 3)
-            _, code = self.run_command("npm install -g @anthropic-ai/claude-code --force")
+            code = self.npm_install("Downloading and installing")
 
             if code == 0:
+                self.probes.invalidate('claude')
                 self.print_status("Claude Code installed successfully!", 'success')
             else:
                 self.print_status("Installation failed!", 'error')
@@ -373,38 +2874,733 @@ class SetupWizard:
 
         return True
 
+    def package_state(self, npm_prefix: Optional[str], package: str, spec: str) -> Tuple[Optional[str], Optional[str]]:
+        """(installed version, version the spec asks for) of a global package; None when a range decides"""
+        installed = None
+        if package == PACKAGE_NAME and self.live_launchers():
+            installed = self.live_version()  # After a staged switch the global tree is no longer the live one
+        elif npm_prefix:
+            installed = self.version_store.package_version(self.backend.package_dir(Path(npm_prefix), package))
+        if re.fullmatch(r'\d+\.\d+\.\d+(?:-[0-9A-Za-z.-]+)?', spec):
+            return installed, spec
+        if not re.fullmatch(r'[A-Za-z][\w.-]*', spec) or satisfies('0.0.0', spec) is not None:
+            return installed, None  # A range (x-ranges such as 'x' look like tags)
+        data = self.registry_client(package).metadata(package)
+        try:
+            return installed, data['dist-tags'][spec]
+        except (KeyError, TypeError):
+            return installed, None
+
+    def install_manifest(self) -> bool:
+        """Install every package of the --manifest with one npm run, probing versions in parallel"""
+        self.print_step("Package Installation")
+        self.pacing.pause(0.5)
+
+        npm_prefix = self.probes.get('npm_prefix')
+        packages = dict(self.manifest)
+        packages.setdefault(PACKAGE_NAME, 'latest')
+        probes = {package: f"package {package}" for package in packages}
+        for package, spec in packages.items():
+            self.probes.register(probes[package], self.package_state, npm_prefix, package, spec)
+        self.probes.start(*probes.values())
+        before = {package: self.probes.get(probes[package], (None, None)) for package in packages}
+
+        def met(installed: Optional[str], wanted: Optional[str], spec: str) -> Optional[bool]:
+            """Whether the installed version is what the manifest asks for; None when undecidable"""
+            if not installed:
+                return False
+            if wanted is not None:
+                return installed == wanted
+            return satisfies(installed, spec)
+
+        pending = []
+        update = None  # What an installed Claude Code would be updated to
+        for package, (installed, wanted) in before.items():
+            # Anything that cannot be decided here goes to npm
+            if met(installed, wanted, packages[package]):
+                self.print_status(f"{package} {installed} is current", 'success')
+            elif package == PACKAGE_NAME and installed:
+                # Updated like any other update: asked for, with a rollback point, staged
+                update = wanted or packages[package]
+                self.print_status(f"{package}: {installed} -> {update}", 'info')
+            else:
+                pending.append(package)
+                change = f"{installed} -> {wanted or packages[package]}" if installed else (wanted or packages[package])
+                self.print_status(f"{package}: {change}", 'info')
+        self.pacing.pause(0.3)
+
+        code = 0
+        if pending:
+            specs = [f"{package}@{packages[package]}" for package in pending]
+            code = self.stream_command(['npm', 'install', '-g'] + specs + ['--force'],
+                                       f"Installing {len(pending)} package(s)")
+            for package in pending:
+                self.probes.invalidate(probes[package])
+            self.probes.start(*(probes[package] for package in pending))
+            self.probes.invalidate('claude')
+
+        updated = None  # Whether the update was applied; None when it was declined or not needed
+        if update is not None:
+            if self.pacing.confirm(f"Update Claude Code to {update}?", 'update', renderer=self.renderer):
+                self.print_status("Updating Claude Code...", 'loading')
+                updated = self.apply_update(update) == 0
+                self.probes.invalidate(probes[PACKAGE_NAME])
+                self.probes.invalidate('claude')
+                if not updated:
+                    self.print_status("Update failed, keeping current version", 'warning')
+            else:
+                self.print_status("Keeping the installed Claude Code", 'info')
+
+        self.package_results = []
+        for package in packages:
+            installed, wanted = self.probes.get(probes[package], (None, None))
+            previous = before[package][0]
+            if package == PACKAGE_NAME and update is not None:
+                status = 'updated' if updated else 'kept'
+            elif package not in pending:
+                status = 'current'
+            elif code != 0 or not installed or met(installed, wanted, packages[package]) is False:
+                status = 'failed'
+            else:
+                status = 'updated' if previous else 'installed'
+            self.package_results.append([package, installed, status])
+            if status == 'failed':
+                self.print_status(f"{package} was not installed", 'error')
+            elif status != 'current':
+                self.print_status(f"{package} {installed} {status}", 'success')
+        return any(row[0] == PACKAGE_NAME and row[2] != 'failed' for row in self.package_results)
+
+    @staticmethod
+    def parse_version(text: str) -> Optional[str]:
+        """Semantic version inside a `--version` line such as '1.0.3 (Claude Code)'"""
+        match = re.search(r'(\d+\.\d+\.\d+(?:-[0-9A-Za-z.-]+)?)', text or '')
+        return match.group(1) if match else None
+
+    def registry_client(self, package: str = PACKAGE_NAME) -> RegistryClient:
+        """Metadata client for the registry npm would use for a package"""
+        resolver = NpmConfigResolver()
+        scope = package.split('/')[0] if package.startswith('@') else None
+        registry = (scope and resolver.get(f'{scope}:registry')) or resolver.get('registry') or 'https://registry.npmjs.org/'
+        return RegistryClient(registry, CACHE_DIR / 'registry', ttl=REGISTRY_TTL if self.use_cache else 0,
+                              log=self.log)
+
+    def latest_version(self) -> Optional[str]:
+        """Latest published Claude Code version from (cached) registry metadata"""
+        return self.registry_client().latest_version(PACKAGE_NAME)
+
+    def cached_version(self) -> Optional[str]:
+        """Version --from-cache installs: the one asked for, else the newest in the store"""
+        versions = self.package_store.versions()
+        if self.from_cache:
+            return self.from_cache if self.from_cache in versions else None
+        return versions[-1] if versions else None
+
+    def target_version(self) -> Optional[str]:
+        """Version an install or update would end up with"""
+        if self.from_cache is not None:
+            return self.cached_version()
+        return self.latest_version()
+
+    def npm_install(self, text: str, version: Optional[str] = None, prefix: Optional[Path] = None) -> int:
+        """Install Claude Code (a version, range or dist-tag) globally or into a prefix, from the registry or the store"""
+        if self.from_cache is not None:
+            return self.install_from_cache(text, prefix)
+        spec = f"{PACKAGE_NAME}@{version}" if version else PACKAGE_NAME
+        target = ['--prefix', str(prefix)] if prefix else []
+        return self.stream_command(['npm', 'install', '-g', spec] + target + ['--force'], text)
+
+    def apply_update(self, latest: Optional[str]) -> int:
+        """Update an existing install: staged next to it, or in place with a snapshot for rollback"""
+        if self.staged and self.live_launchers():
+            return 0 if self.staged_update(latest) else 1
+        previous, _ = self.live_target()
+        previous_version = self.live_version()
+        self.snapshot_live(previous_version)
+        code = self.npm_install(f"Installing {latest or 'latest'}", latest or 'latest')
+        target, version = self.live_target()
+        if code == 0 and target is not None:
+            # Same history as a staged switch, so a plain --rollback finds the version replaced here
+            self.version_store.record_switch(version or latest, target, previous, previous_version)
+        self.prune_versions()
+        return code
+
+    def live_launchers(self) -> List[Path]:
+        """claude launchers in npm's global bin directory"""
+        npm_prefix = self.probes.get('npm_prefix')
+        return self.backend.launchers(self.backend.bin_dir(npm_prefix), 'claude') if npm_prefix else []
+
+    def staged_update(self, version: Optional[str]) -> bool:
+        """Install next to the live version, check it, then switch the launchers over"""
+        import shutil
+        store = self.version_store
+        final = None  # Version directory staged by this call (the only one it may delete)
+        # Stored versions are staged prefixes or rollback snapshots: only their recorded target is known
+        target = store.target(version) if version else None
+        if target is not None:
+            self.print_status(f"Version {version} is already stored", 'info')
+        else:
+            staging = store.staging_path()
+            code = self.npm_install(f"Staging {version or 'latest'}", version or 'latest', prefix=staging)
+            staged_version = store.package_version(self.backend.package_dir(staging, PACKAGE_NAME))
+            if code != 0 or not staged_version:
+                shutil.rmtree(staging, ignore_errors=True)
+                return False
+            version = staged_version
+            target = store.target(version)
+            if target is not None:
+                shutil.rmtree(staging, ignore_errors=True)  # 'latest' resolved to a version already stored
+            else:
+                final = store.commit(staging, version)
+                shims = [self.backend.bin_dir(str(final)) / name for name in self.backend.shim_names('claude')]
+                shim = next((path for path in shims if path.exists()), None)
+                target = self.backend.shim_target(shim) if shim else None
+
+        # The stored copy must start and report the version it claims
+        output, code = self.run_command(self.launch_command(target) + ['--version'], capture=True,
+                                        until=self.is_version_line) if target else (None, 1)
+        launchers = self.live_launchers()
+        previous, _ = self.live_target()
+        if code != 0 or self.parse_version(output) != version:
+            self.print_status(f"Staged version check failed ({output or 'no output'})", 'error')
+            if final is not None and (previous is None or final not in previous.parents):
+                shutil.rmtree(final, ignore_errors=True)
+            return False
+        self.print_status(f"Staged Claude Code {version} verified", 'success')
+
+        previous_version = self.live_version()
+        self.snapshot_live(previous_version)
+        with self.tracer.span("switch launchers", 'install', version=version):
+            for launcher in launchers:
+                self.backend.write_shim(launcher, target)
+        store.record_switch(version, target, previous, previous_version)
+        if final is not None:
+            # The launchers already run the new version: sharing its files with the pool only saves space
+            try:
+                store.add(version, target)
+                store.dedupe(final)
+            except OSError as e:
+                self.log(f"Could not link {version} into the version pool: {e!r}", 'WARNING')
+        self.log(f"Launchers switched to {target} (was {previous})")
+        self.print_status(f"Switched to {version}; previous version kept for rollback", 'success')
+        self.print_launcher_notice()
+        self.prune_versions()
+        return True
+
+    @staticmethod
+    def launch_command(target: Path) -> List[str]:
+        """Command that starts a launcher target directly (node for scripts)"""
+        if target.suffix.lower() in ('.js', '.mjs', '.cjs'):
+            return ['node', str(target)]
+        return [str(target)]
+
+    def live_target(self) -> Tuple[Optional[Path], Optional[str]]:
+        """File the live launchers start and the Claude Code version it belongs to, without spawning"""
+        launchers = self.live_launchers()
+        target = self.backend.shim_target(launchers[0]) if launchers else None
+        for directory in (target.parents if target else ()):
+            if (directory / 'package.json').is_file():
+                return target, self.version_store.package_version(directory)
+        return target, None
+
+    def live_version(self) -> Optional[str]:
+        """Version the live launchers start: their package.json, else `claude --version` if PATH finds them"""
+        _, version = self.live_target()
+        if version is None and self.commands.resolve('claude') in self.live_launchers():
+            claude_ok, claude_ver = self.probes.get('claude', (False, "Unknown"))
+            version = self.parse_version(claude_ver) if claude_ok else None
+        return version
+
+    def snapshot_live(self, version: Optional[str]) -> Optional[Path]:
+        """Copy the globally installed version into the store before the launchers move off it"""
+        npm_prefix = self.probes.get('npm_prefix')
+        target, _ = self.live_target()
+        if not (npm_prefix and version and target) or self.version_store.target(version):
+            return None
+        package_dir = Path(os.path.realpath(self.backend.package_dir(Path(npm_prefix), PACKAGE_NAME)))
+        if package_dir not in target.parents:
+            return None  # Not a global npm install (already a stored version, or linked elsewhere)
+        layout = self.backend.package_dir(Path(), PACKAGE_NAME)
+        try:
+            with self.tracer.span("snapshot", 'install', version=version):
+                snapshot = self.version_store.snapshot(package_dir, layout, version, target)
+        except OSError as e:
+            self.log(f"Could not snapshot {version}: {e!r}", 'WARNING')
+            return None
+        self.log(f"Snapshot of {version} stored at {snapshot}")
+        return snapshot
+
+    def prune_versions(self):
+        """Keep the snapshot store within --keep-versions and --max-versions-size"""
+        current = (self.version_store.state.get('current') or {}).get('version')
+        try:
+            removed = self.version_store.prune(self.keep_versions, self.max_versions_bytes,
+                                               protect=(current,) if current else ())
+        except OSError as e:
+            self.log(f"Could not prune stored versions: {e!r}", 'WARNING')
+            return
+        if removed:
+            self.log(f"Pruned stored versions: {', '.join(removed)}")
+
+    def rollback(self, version: str) -> int:
+        """Point the live launchers back at a stored version (default: the previous one) without npm"""
+        self.print_banner()
+        store = self.version_store
+        launchers = self.live_launchers()
+        if not launchers:
+            self.print_status("No claude launchers found in npm's bin directory", 'error')
+            return 1
+        current, current_version = self.live_target()
+        self.snapshot_live(current_version)
+
+        version = version or store.previous_version(current_version)
+        target = store.target(version) if version else None
+        if target is None:
+            stored = ', '.join(sorted(store.state['versions'], key=lambda v: store.state['versions'][v]['added']))
+            self.print_status(f"Version {version or '(previous)'} is not in the snapshot store", 'error')
+            self.print_status(f"Stored versions: {stored or 'none'}", 'info')
+            return 1
+        if current and self.same_file(target, current):
+            self.print_status(f"Claude Code {version} is already active", 'success')
+            return 0
+
+        with self.tracer.span("switch launchers", 'install', version=version):
+            for launcher in launchers:
+                self.backend.write_shim(launcher, target)
+        store.record_switch(version, target, current, current_version)
+        self.log(f"Rolled back launchers to {target} (was {current})")
+        self.print_status(f"Rolled back to Claude Code {version} (was {current_version or 'unknown'})", 'success')
+        self.print_launcher_notice()
+        return 0
+
+    def print_launcher_notice(self):
+        """npm may refuse to overwrite launchers it did not create: say how to update with npm after a switch"""
+        self.print_status("The claude launchers now point into the version store; a plain "
+                          f"`npm install -g {PACKAGE_NAME}` can fail on them with EEXIST", 'info')
+        self.print_status(f"Update with this wizard, or with `npm install -g {PACKAGE_NAME} --force`", 'info')
+
+    def install_from_cache(self, text: str, prefix: Optional[Path] = None) -> int:
+        """Offline install: npm pulls every tarball from a loopback registry over the store"""
+        import shutil
+        version = self.cached_version()
+        if version is None:
+            self.print_status("Requested version is not in the package cache (use --cache-populate)", 'error')
+            return 1
+        try:
+            free = shutil.disk_usage(self.probes.get('npm_prefix') or Path.home()).free
+        except OSError:
+            free = None
+        needed = self.package_store.required_bytes(version)
+        if free is not None and free < needed:
+            self.print_status(f"Not enough disk space to extract {version} "
+                              f"({needed / 1024 ** 2:.0f} MB needed, {free / 1024 ** 2:.0f} MB free)", 'error')
+            return 1
+        server = self.package_store.serve()
+        try:
+            target = ['--prefix', str(prefix)] if prefix else []
+            return self.stream_command(['npm', 'install', '-g', f"{PACKAGE_NAME}@{version}"] + target +
+                                       self.store_registry_args(server) + ['--force'], text)
+        finally:
+            server.shutdown()
+
+    @staticmethod
+    def store_registry_args(server) -> List[str]:
+        """npm options that take every package from the loopback registry over the package store"""
+        url = f"http://127.0.0.1:{server.server_address[1]}/"
+        scope = PACKAGE_NAME.split('/')[0]
+        return ['--registry', url, f"--{scope}:registry={url}", '--no-audit', '--no-fund']
+
+    def populate_package_cache(self, version: Optional[str] = None) -> bool:
+        """Resolve a version's full dependency tree and store every tarball by integrity"""
+        import json
+        version = version or self.latest_version()
+        if not version:
+            self.print_status("Could not determine the version to cache", 'error')
+            return False
+        import tempfile
+        from concurrent.futures import ThreadPoolExecutor
+        with tempfile.TemporaryDirectory(prefix='claude-setup-') as work:
+            Path(work, 'package.json').write_text('{"name": "claude-setup-cache", "private": true}', encoding='utf-8')
+            code = self.stream_command(['npm', 'install', '--package-lock-only', '--ignore-scripts', '--no-audit',
+                                        '--no-fund', f"{PACKAGE_NAME}@{version}"],
+                                       f"Resolving {PACKAGE_NAME}@{version}", cwd=work)
+            try:
+                lock = json.loads(Path(work, 'package-lock.json').read_text(encoding='utf-8'))
+            except (OSError, ValueError):
+                lock = None
+        if code != 0 or not lock:
+            self.print_status("Dependency resolution failed", 'error')
+            return False
+
+        packages = []
+        for path, entry in lock.get('packages', {}).items():
+            if not path or entry.get('link') or entry.get('inBundle') or not entry.get('integrity'):
+                continue
+            name = entry.get('name') or path.rsplit('node_modules/', 1)[-1]
+            packages.append({'name': name, 'version': entry['version'], 'resolved': entry['resolved'],
+                             'integrity': entry['integrity']})
+
+        def fetch(package: Dict[str, Any]) -> Dict[str, Any]:
+            package['size'] = self.package_store.add_tarball(package['resolved'], package['integrity'])
+            return package
+
+        try:
+            with ThreadPoolExecutor(max_workers=8) as pool:
+                packages = list(pool.map(fetch, packages))
+            by_name: Dict[str, List[str]] = {}
+            for package in packages:
+                by_name.setdefault(package['name'], []).append(package['version'])
+            for name, versions in by_name.items():
+                data = self.registry_client(name).metadata(name)
+                if not data:
+                    raise ValueError(f"No registry metadata for {name}")
+                self.package_store.add_packument(name, data, versions)
+        except (OSError, ValueError) as e:
+            self.print_status(f"Caching failed: {e}", 'error')
+            return False
+        self.package_store.record_root(version, packages)
+        total = sum(package['size'] for package in packages)
+        self.print_status(f"Cached {PACKAGE_NAME}@{version}: {len(packages)} tarballs, {total / 1024 ** 2:.1f} MB", 'success')
+        return True
+
+    def run_cache_command(self, args: argparse.Namespace) -> int:
+        """Package cache maintenance (--cache-populate / --cache-verify / --cache-prune)"""
+        self.print_banner()
+        ok = True
+        if args.cache_populate is not None:
+            ok = self.populate_package_cache(args.cache_populate or None) and ok
+        if args.cache_verify:
+            bad = self.package_store.verify()
+            for key in bad:
+                self.print_status(f"Missing or corrupt: {key}", 'error')
+            if not bad:
+                count = len(self.package_store.index['packages'])
+                self.print_status(f"All {count} cached tarballs match their integrity hashes", 'success')
+            ok = ok and not bad
+        if args.cache_prune is not None:
+            removed, freed = self.package_store.prune(args.cache_prune)
+            self.print_status(f"Pruned {len(removed)} old version(s), freed {freed / 1024 ** 2:.1f} MB", 'success')
+        versions = self.package_store.versions()
+        self.print_status(f"Cached versions: {', '.join(versions) if versions else 'none'}", 'info')
+        return 0 if ok else 1
+
+    def agent_check(self) -> Tuple[bool, str]:
+        """One update check: (ok, what happened); installs only when the registry has something newer"""
+        for name in ('npm_prefix', 'latest', 'claude'):
+            self.probes.invalidate(name)  # A long-running agent must not reuse the last cycle's answers
+        _, installed = self.live_target()
+        if installed is None:
+            # Not a package tree we can read: ask the launcher (cached while it is unchanged)
+            claude_ok, claude_ver = self.probes.get('claude', (False, "Unknown"))
+            installed = self.parse_version(claude_ver) if claude_ok else None
+        if installed is None:
+            return False, "no Claude Code install found (run the wizard first)"
+        latest = self.probes.get('latest')
+        if not latest:
+            return False, "could not read the latest version from the registry"
+        if latest == installed:
+            return True, f"{installed} is current"
+        self.print_status(f"Updating Claude Code {installed} -> {latest}", 'info')
+        if self.apply_update(latest) != 0:
+            return False, f"update to {latest} failed"
+        return True, f"updated {installed} -> {latest}"
+
+    def run_agent(self, interval: float, once: bool = False) -> int:
+        """Headless update agent (--agent): check on a jittered schedule, back off after failures"""
+        CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        lock = open(CACHE_DIR / 'agent.lock', 'a+')
+        if not self.backend.try_lock(lock):
+            # Not print_status: ticks that do nothing must not leave a run log behind each
+            self.renderer.emit([f"  {Colors.INFO}{Icons.INFO} Another update agent is running{Colors.RESET}"])
+            lock.close()
+            return 0
+        schedule = AgentSchedule(CACHE_DIR / 'agent.json', interval)
+        self.run_log.flush_interval = 60.0  # Flushed after every check anyway; keeps the idle agent asleep
+        try:
+            while True:
+                delay = schedule.delay()
+                if delay > 0:
+                    if once:
+                        return 0
+                    time.sleep(delay)
+                ok, result = self.agent_check()
+                delay = schedule.record(ok, result)
+                due = f"{delay:.0f}s" if delay < 120 else f"{delay / 60:.0f} min"
+                self.print_status(f"{result}; next check in {due}", 'success' if ok else 'warning')
+                self.run_log.flush()
+                if once:
+                    return 0 if ok else 1
+        finally:
+            lock.close()
+
+    def run_report(self, log_dir: Optional[str], fmt: str = 'text') -> int:
+        """Step and command latency percentiles, failure rates and slowest runs across run logs (--report)"""
+        import json
+        report = LogReport(Path(log_dir) if log_dir else LOG_DIR)
+        report.update()
+        summary = report.summary()
+        if fmt == 'json':
+            self.renderer.emit([json.dumps(summary, indent=1)])
+            return 0
+
+        # Not print_status: a report run should not leave a log of its own in the directory it reads
+        self.print_banner()
+        self.renderer.emit([f"  {Colors.INFO}{Icons.INFO} {summary['runs']} runs in {summary['log_dir']} "
+                            f"({summary['parsed']} new or changed logs parsed){Colors.RESET}"])
+        if not summary['runs']:
+            return 0
+
+        def seconds(value: Optional[float]) -> str:
+            return f"{value:>6.2f}s" if value is not None else f"{'-':>7}"
+
+        for title, rows in (("STEPS", summary['steps']), ("COMMANDS", summary['commands'])):
+            table = [f"{'NAME':<21} {'N':>4} {'P50':>7} {'P95':>7} {'MAX':>7} {'FAIL':>5}"]
+            for row in rows:
+                table.append(f"{Renderer.fit(row['name'], 21)} {row['n']:>4} {seconds(row['p50'])} "
+                             f"{seconds(row['p95'])} {seconds(row['max'])} {row['failure_rate']:>5.0%}")
+            self.renderer.emit([''] + Renderer.box(table, Colors.SECONDARY, title=title))
+        table = []
+        for run in summary['slowest_runs']:
+            note = f"failed: {', '.join(run['failed_steps'])}" if run['failed_steps'] else run['slowest_step'] or ''
+            name = run['log'][len('claude_setup_'):] if run['log'].startswith('claude_setup_') else run['log']
+            table.append(f"{Renderer.fit(name, 21)} {seconds(run['duration'])}  {note}")
+        self.renderer.emit([''] + Renderer.box(table, Colors.SECONDARY, title="SLOWEST RUNS") + [''])
+        return 0
+
+    def profile_prefix(self, home: Path) -> Path:
+        """npm prefix of a provisioned profile: the one its .npmrc sets, else the per-user default"""
+        resolver = NpmConfigResolver(home=str(home))
+        prefix = resolver.get('prefix')
+        if prefix and resolver.sources.get('prefix') == 'user':
+            return Path(prefix)
+        return self.backend.for_profile(home).user_prefix()
+
+    def target_command(self, target: ProvisionTarget, cmd: List[str]):
+        """Run a command for one target from a worker thread, raising OSError with npm's error line
+
+        Nothing goes to the console; every output line goes to the log.
+        """
+        errors: List[str] = []
+
+        def spill(line: str):
+            self.log(f"[{target.name}] {line}", 'NPM')
+            if not errors and line.startswith(('npm error', 'npm ERR!')):
+                errors.append(line.strip())
+
+        tail = OutputCapture(max_lines=8, spill=spill)
+        runner = ProcessRunner(self.commands.command_line(cmd), idle_timeout=self.idle_timeout, tracer=self.tracer)
+        code = runner.run(tail)
+        self.log_command(self.command_label(cmd), runner, code)
+        if runner.timed_out:
+            raise OSError(f"no output for {int(self.idle_timeout)}s from {self.command_label(cmd)}")
+        if code != 0:
+            errors = errors or [line.strip() for line in tail.lines if line.strip()][-1:]
+            raise OSError(f"{self.command_label(cmd)} exited with code {code}" + (f": {errors[0]}" if errors else ''))
+
+    def provision_target(self, target: ProvisionTarget, version: Optional[str],
+                         store_args: List[str]) -> ProvisionTarget:
+        """Install, verify and (for profiles) put on PATH with a shortcut; runs on a worker thread"""
+        started = time.perf_counter()
+        self.begin_step(f"Provision {target.name}")
+        backend = target.backend or self.backend
+        package_dir = backend.package_dir(target.prefix, PACKAGE_NAME)
+        try:
+            backend.mount()
+            try:
+                target.previous = self.version_store.package_version(package_dir)
+                if target.previous and target.previous == version:
+                    target.status = 'current'
+                elif target.previous and not self.pacing.confirm("Update to latest version?", 'update'):
+                    target.status = 'kept'
+                else:
+                    spec = f"{PACKAGE_NAME}@{version or 'latest'}"
+                    self.target_command(target, ['npm', 'install', '-g', spec, '--prefix', str(target.prefix)] +
+                                        store_args + ['--force'])
+                    target.status = 'updated' if target.previous else 'installed'
+                target.version = self.version_store.package_version(package_dir)
+                self.verify_target(target, backend)
+                if target.backend:
+                    self.configure_target_path(target)
+                    launcher = backend.launchers(backend.bin_dir(str(target.prefix)), 'claude')[0]
+                    if backend.create_shortcut(launcher) is None:
+                        target.detail = "no desktop folder, shortcut skipped"
+                    backend.own(target.prefix)
+            finally:
+                backend.unmount()
+        except Exception as e:
+            target.status, target.detail = 'failed', str(e)
+        target.seconds = time.perf_counter() - started
+        self.log(f"[{target.name}] {target.status} {target.version or '-'} in {target.prefix} "
+                 f"({target.seconds:.3f}s){': ' + target.detail if target.detail else ''}",
+                 'ERROR' if target.status == 'failed' else 'INFO')
+        self.begin_step(None, 'failed' if target.status == 'failed' else None)
+        return target
+
+    def verify_target(self, target: ProvisionTarget, backend: PlatformBackend):
+        """Raise unless the target's claude launcher starts the version that was installed"""
+        launchers = backend.launchers(backend.bin_dir(str(target.prefix)), 'claude')
+        script = backend.shim_target(launchers[0]) if launchers else None
+        if script is None or not script.exists():
+            raise OSError(f"no working claude launcher in {backend.bin_dir(str(target.prefix))}")
+        if self.verify_spawn:
+            output, code = self.run_command([str(launchers[0]), '--version'], capture=True,
+                                            until=self.is_version_line)
+            if code != 0 or (target.version and self.parse_version(output) != target.version):
+                raise OSError(f"claude --version failed ({output or 'no output'})")
+
+    def configure_target_path(self, target: ProvisionTarget):
+        """Put the target's npm bin folder first on that profile's PATH
+
+        Entries are only ever added: %VAR% and $VAR references expand differently
+        for another user, so they cannot be judged missing from here.
+        """
+        backend = target.backend
+        bin_dir = str(backend.bin_dir(str(target.prefix)))
+        current = backend.read_user_path()
+        index = backend.path_index(current)
+        if bin_dir in index:
+            return
+        backend.write_user_path(index.join([bin_dir] + list(index.entries)))
+        target.path_changed = True
+
+    def run_targets(self, profiles: List[Path], prefixes: List[Path], jobs: int = PROVISION_JOBS) -> int:
+        """Provision many user profiles or npm prefixes at once (--profiles / --prefixes)
+
+        node, npm and the target version are probed once, and the package is downloaded
+        once into the package store, which every target then installs from.
+        """
+        self.print_banner()
+        targets = [ProvisionTarget(home.name, self.profile_prefix(home), self.backend.for_profile(home))
+                   for home in profiles]
+        targets += [ProvisionTarget(str(prefix), prefix) for prefix in prefixes]
+
+        self.probes.start('admin', 'node', 'npm', 'latest')
+        tools = []
+        for name in ('node', 'npm'):
+            ok, version = self.probes.get(name, (False, "Unknown"))
+            if not ok:
+                self.print_status(f"{'Node.js' if name == 'node' else name} not found!", 'error')
+                self.nodejs_required_box()
+                return 1
+            tools.append(version)
+        if profiles and self.backend.requires_admin and not self.probes.get('admin', False):
+            self.admin_required_box()
+            return 1
+        version = self.probes.get('latest')
+        if self.from_cache is not None and version is None:
+            self.print_status("Requested version is not in the package cache (use --cache-populate)", 'error')
+            return 1
+        self.print_status(f"Node.js {tools[0]}, npm {tools[1]}; Claude Code {version or 'latest'}", 'info')
+
+        # One download for every target; a single target is not worth the extra resolve
+        if version and len(targets) > 1 and version not in self.package_store.versions():
+            if not self.populate_package_cache(version):
+                self.print_status("Falling back to one registry download per target", 'warning')
+        server = self.package_store.serve() if version in self.package_store.versions() else None
+        store_args = self.store_registry_args(server) if server else []
+
+        from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+        jobs = max(1, min(jobs, len(targets)))
+        self.print_status(f"Provisioning {len(targets)} target(s), {jobs} at a time", 'loading')
+        pool = ThreadPoolExecutor(max_workers=jobs, thread_name_prefix='target')
+        pending = {pool.submit(self.provision_target, target, version, store_args) for target in targets}
+        try:
+            while pending:
+                # Poll so Ctrl+C is delivered promptly on every platform
+                done, pending = wait(pending, timeout=0.2, return_when=FIRST_COMPLETED)
+                for future in done:
+                    self.print_target(future.result())
+        except KeyboardInterrupt:
+            for future in pending:
+                future.cancel()
+            ProcessRunner.cancel_all()
+            raise
+        finally:
+            pool.shutdown(wait=True)
+            if server:
+                server.shutdown()
+
+        if any(target.path_changed for target in targets):
+            self.backend.broadcast_settings_change()
+        self.log(f"Run finished in {time.time() - self.start_time:.3f}s")
+        self.show_target_summary(targets, jobs)
+        return 1 if any(target.status == 'failed' for target in targets) else 0
+
+    def print_target(self, target: ProvisionTarget):
+        """One result line as each target finishes"""
+        if target.status == 'failed':
+            self.print_status(f"{target.name}: failed: {target.detail}", 'error')
+            return
+        outcome = {'current': f"{target.version} is current", 'kept': f"kept {target.version}",
+                   'updated': f"updated {target.previous} -> {target.version}"}.get(
+                       target.status, f"installed {target.version}")
+        if target.path_changed:
+            outcome += ", added to PATH"
+        self.print_status(f"{target.name}: {outcome} ({target.seconds:.1f}s)", 'success')
+
+    def show_target_summary(self, targets: List[ProvisionTarget], jobs: int):
+        """Consolidated per-target status and timings of a multi-target run"""
+        rows = [f"{'TARGET':<22} {'VERSION':<10} {'STATUS':<9} {'TIME':>7}"]
+        for target in targets:
+            icon = f"{Colors.ERROR}{Icons.CROSS}" if target.status == 'failed' else f"{Colors.SUCCESS}{Icons.CHECK}"
+            rows.append(f"{icon}{Colors.RESET} {Renderer.fit(target.name, 20)} {Renderer.fit(target.version or '-', 10)} "
+                        f"{target.status:<9} {target.seconds:>6.1f}s")
+        counts: Dict[str, int] = {}
+        for target in targets:
+            counts[target.status] = counts.get(target.status, 0) + 1
+        busy = sum(target.seconds for target in targets)
+        elapsed = time.time() - self.start_time
+        rows += ["", ', '.join(f"{count} {status}" for status, count in sorted(counts.items())),
+                 f"Total time: {elapsed:.1f}s ({busy:.1f}s of work, {jobs} at a time)",
+                 f"Log file: {self.log_file.name if self.log_file else 'Not available'}"]
+        failed = counts.get('failed')
+        self.renderer.emit([''])
+        self.print_box("COMPLETED WITH ISSUES" if failed else "PROVISIONING COMPLETE", rows,
+                       Colors.WARNING if failed else Colors.SUCCESS)
+
+    def resolve_npm_prefix(self) -> Optional[str]:
+        """npm's global prefix, read from npm config files and only spawning npm when ambiguous"""
+        resolver = NpmConfigResolver()
+        prefix = resolver.get('prefix')
+        if prefix:
+            self.log(f"npm prefix resolved from {resolver.sources.get('prefix')} config: {prefix}")
+            return prefix
+        self.log("npm prefix ambiguous, asking npm", 'WARNING')
+        output, code = self.run_command(['npm', 'config', 'get', 'prefix'], capture=True)
+        return output if code == 0 and output else None
+
+    def read_user_path(self) -> str:
+        """Current persistent user PATH (registry or shell rc files)"""
+        with self.tracer.span("read user PATH", self.backend.name):
+            return self.backend.read_user_path()
+
     def configure_path(self) -> bool:
         """Configure system PATH"""
         self.print_step("PATH Configuration")
-        time.sleep(0.5)
+        self.pacing.pause(0.5)
 
         # Get npm prefix
-        npm_prefix, code = self.run_command("npm config get prefix", capture=True)
-        if code != 0:
+        npm_prefix = self.probes.get('npm_prefix')
+        if not npm_prefix:
             self.print_status("Could not determine npm location", 'error')
             return False
 
         self.npm_prefix = npm_prefix
         self.print_status(f"npm location: {npm_prefix}", 'info')
-        time.sleep(0.3)
+        self.pacing.pause(0.3)
 
         # Find claude executable
-        claude_cmd = Path(npm_prefix) / "claude.cmd"
-        claude_exe = Path(npm_prefix) / "claude.exe"
-
-        if claude_cmd.exists():
-            self.claude_path = claude_cmd
-            self.print_status(f"Found: {claude_cmd}", 'success')
-            time.sleep(0.3)
-        elif claude_exe.exists():
-            self.claude_path = claude_exe
-            self.print_status(f"Found: {claude_exe}", 'success')
-            time.sleep(0.3)
+        bin_dir = self.backend.bin_dir(npm_prefix)
+        shims = [bin_dir / name for name in self.backend.shim_names('claude')]
+        shim = next((path for path in shims if path.exists()), None)
+
+        if shim:
+            self.claude_path = shim
+            self.print_status(f"Found: {shim}", 'success')
+            self.pacing.pause(0.3)
         else:
             # Try to find it
-            search_path = Path(npm_prefix)
             found = False
-            for file in search_path.iterdir():
+            for file in (bin_dir.iterdir() if bin_dir.is_dir() else []):
                 if 'claude' in file.name.lower() and file.is_file():
                     self.claude_path = file
                     found = True
@@ -417,31 +3613,38 @@ class SetupWizard:
 
         # Update PATH
         try:
-            key = winreg.OpenKey(winreg.HKEY_CURRENT_USER, r"Environment")
-            try:
-                current_path, _ = winreg.QueryValueEx(key, "PATH")
-            except WindowsError:
-                current_path = ""
-            winreg.CloseKey(key)
+            current_path = self.probes.get('user_path', raise_errors=True)
+            index = self.backend.path_index(current_path)
+            present = str(bin_dir) in index
+            self.report_path_health(index)
+            removed = 0
 
-            if npm_prefix.lower() in current_path.lower():
+            if present:
                 self.print_status("Already in system PATH", 'success')
             else:
                 self.print_status("Adding to system PATH...", 'loading')
-                new_path = f"{npm_prefix};{current_path}"
 
-                key = winreg.OpenKey(winreg.HKEY_CURRENT_USER, r"Environment", 0, winreg.KEY_WRITE)
-                winreg.SetValueEx(key, "PATH", 0, winreg.REG_EXPAND_SZ, new_path)
-                winreg.CloseKey(key)
+            if self.compact_path:
+                entries = index.compacted()
+                removed = len(index) - len(entries)
+                new_path = index.join(([] if present else [str(bin_dir)]) + entries)
+            elif present:
+                new_path = current_path
+            else:
+                # Everything else stays exactly as the user wrote it
+                new_path = index.join([str(bin_dir), current_path]) if current_path else str(bin_dir)
+            self.user_path = new_path
+            if new_path != current_path:
+                # One write for the addition and the compaction together
+                with self.tracer.span("write user PATH", self.backend.name):
+                    self.backend.write_user_path(new_path)
 
                 # Notify system of change
-                try:
-                    import win32api
-                    import win32con
-                    win32api.SendMessage(win32con.HWND_BROADCAST, win32con.WM_SETTINGCHANGE, 0, 'Environment')
-                except:
-                    pass
+                with self.tracer.span("broadcast settings change", self.backend.name):
+                    self.backend.broadcast_settings_change()
 
+                if removed:
+                    self.print_status(f"Removed {removed} duplicate or missing PATH entries", 'success')
                 self.print_status("PATH updated successfully!", 'success')
         except Exception as e:
             self.print_status(f"Failed to update PATH: {e}", 'error')
@@ -449,38 +3652,72 @@ class SetupWizard:
 
         return True
 
+    def report_path_health(self, index: PathIndex):
+        """Log duplicate and dead user PATH entries and warn about them"""
+        duplicates, missing = index.duplicates, index.missing()
+        for entry in duplicates:
+            self.log(f"Duplicate PATH entry: {entry}", 'WARNING')
+        for entry in missing:
+            self.log(f"PATH entry does not exist: {entry}", 'WARNING')
+        if not duplicates and not missing:
+            return
+        self.print_status(f"User PATH: {len(index)} entries, {len(duplicates)} duplicate, "
+                          f"{len(missing)} missing", 'warning' if not self.compact_path else 'info')
+        if not self.compact_path:
+            self.warnings.append("User PATH has duplicate or missing entries (rerun with --compact-path)")
+
     def verify_installation(self) -> bool:
         """Verify Claude Code installation"""
         self.print_step("Installation Verification")
-        time.sleep(0.5)
+        self.pacing.pause(0.5)
+
+        # Resolve claude the way a new terminal will, without spawning anything
+        user_path = self.user_path if self.user_path is not None else self.probes.get('user_path', "")
+        with self.tracer.span("resolve claude", 'verify'):
+            resolved = self.backend.which('claude', self.backend.session_path(user_path or ""))
+            target = self.backend.shim_target(resolved) if resolved else None
+        if resolved is None:
+            self.print_status("claude not found on the new PATH", 'warning')
+        elif self.claude_path and not self.same_file(resolved, self.claude_path):
+            self.print_status(f"Another claude comes first on PATH: {resolved}", 'warning')
+            self.warnings.append(f"{resolved} shadows {self.claude_path}")
+        else:
+            self.print_status("PATH configuration verified", 'success')
+        self.pacing.pause(0.3)
+
+        target = target or (self.backend.shim_target(self.claude_path) if self.claude_path else None)
+        if target and target.exists():
+            self.print_status(f"Launcher target present: {target.name}", 'success')
+        else:
+            self.print_status(f"Launcher target missing: {target or self.claude_path}", 'error')
+            return True
+        self.pacing.pause(0.3)
 
-        if self.claude_path and self.claude_path.exists():
-            # Test direct path
-            version, code = self.run_command(f'"{self.claude_path}" --version', capture=True)
-            time.sleep(0.3)
+        # One optional real start of the installed launcher
+        if self.verify_spawn and self.claude_path:
+            version, code = self.run_command([str(self.claude_path), '--version'], capture=True,
+                                             until=self.is_version_line)
+            self.pacing.pause(0.3)
             if code == 0:
                 self.print_status(f"Claude Code v{version} verified", 'success')
-                time.sleep(0.3)
-                self.print_status("Direct execution works", 'success')
-                time.sleep(0.3)
+                self.pacing.pause(0.3)
             else:
                 self.print_status("Direct execution test failed", 'warning')
-                time.sleep(0.3)
-
-        # Test PATH
-        claude_ok, claude_ver = self.check_command("claude")
-        time.sleep(0.3)
-        if claude_ok:
-            self.print_status("PATH configuration verified", 'success')
-        else:
-            self.print_status("PATH not updated yet (requires new terminal)", 'info')
+                self.pacing.pause(0.3)
 
         return True
 
+    @staticmethod
+    def same_file(a: Path, b: Path) -> bool:
+        try:
+            return os.path.samefile(a, b)
+        except OSError:
+            return False
+
     def show_summary(self):
         """Show installation summary"""
         self.print_step("Installation Summary")
-        time.sleep(0.5)
+        self.pacing.pause(0.5)
 
         elapsed = int(time.time() - self.start_time)
 
@@ -493,117 +3730,421 @@ class SetupWizard:
                 "",
                 f"Installation time: {elapsed} seconds",
                 f"Log file: {self.log_file.name if self.log_file else 'Not available'}"
-            ]
+            ] + self.package_rows()
             self.print_box("SUCCESS", content, Colors.SUCCESS)
         else:
             content = [
                 f"{Icons.CROSS} Installation completed with errors:",
                 ""
-            ] + [f"  {Icons.BULLET} {err}" for err in self.errors[:3]]
+            ] + [f"  {Icons.BULLET} {err}" for err in self.errors[:3]] + self.package_rows()
             self.print_box("COMPLETED WITH ISSUES", content, Colors.WARNING)
 
         # Next steps
-        print(f"  {Colors.SECONDARY}┌{'─' * 58}┐{Colors.RESET}")
-        print(f"  {Colors.SECONDARY}│{Colors.RESET} {Colors.BOLD}NEXT STEPS:{Colors.RESET}{' ' * 45}{Colors.SECONDARY} │{Colors.RESET}")
-        print(f"  {Colors.SECONDARY}├{'─' * 58}┤{Colors.RESET}")
-        print(f"  {Colors.SECONDARY}│{Colors.RESET} 1. Close this window{' ' * 36}{Colors.SECONDARY} │{Colors.RESET}")
-        print(f"  {Colors.SECONDARY}│{Colors.RESET} 2. Open a {Colors.BOLD}NEW{Colors.RESET} Command Prompt or Terminal{' ' * 15}{Colors.SECONDARY}  │{Colors.RESET}")
-        print(f"  {Colors.SECONDARY}│{Colors.RESET} 3. Run: {Colors.PRIMARY}claude --version{Colors.RESET}{' ' * 30}{Colors.SECONDARY}   │{Colors.RESET}")
-        print(f"  {Colors.SECONDARY}│{Colors.RESET} 4. Run: {Colors.PRIMARY}claude{Colors.RESET} to start coding!{' ' * 24}{Colors.SECONDARY}  │{Colors.RESET}")
-        print(f"  {Colors.SECONDARY}└{'─' * 58}┘{Colors.RESET}")
-
+        frame = Renderer.box([
+            "1. Close this window",
+            f"2. Open a {Colors.BOLD}NEW{Colors.RESET} Command Prompt or Terminal",
+            f"3. Run: {Colors.PRIMARY}claude --version{Colors.RESET}",
+            f"4. Run: {Colors.PRIMARY}claude{Colors.RESET} to start coding!",
+        ], Colors.SECONDARY, title="NEXT STEPS:", center=False)
         if self.warnings:
-            print(f"\n  {Colors.WARNING}Warnings:{Colors.RESET}")
-            for warn in self.warnings[:3]:
-                print(f"  {Colors.WARNING}{Icons.WARNING}{Colors.RESET} {warn}")
+            frame.append(f"\n  {Colors.WARNING}Warnings:{Colors.RESET}")
+            frame += [f"  {Colors.WARNING}{Icons.WARNING}{Colors.RESET} {warn}" for warn in self.warnings[:3]]
+        self.renderer.emit(frame)
+
+    def package_rows(self) -> List[str]:
+        """Summary rows for the packages of a --manifest install"""
+        if not self.package_results:
+            return []
+        rows = ["", "Packages:"]
+        for package, version, status in self.package_results:
+            icon = f"{Colors.ERROR}{Icons.CROSS}" if status == 'failed' else f"{Colors.SUCCESS}{Icons.CHECK}"
+            rows.append(f"{icon}{Colors.RESET} {package} {version or ''} {Colors.DIM}({status}){Colors.RESET}")
+        return rows
 
     def create_desktop_shortcut(self) -> bool:
         """Create desktop shortcut for Claude Code"""
         self.print_step("Creating Desktop Shortcut")
-        time.sleep(0.5)
+        self.pacing.pause(0.5)
 
         try:
-            desktop = Path.home() / "Desktop"
-            if desktop.exists() and self.claude_path:
-                # Create batch file
-                shortcut = desktop / "Claude Code.bat"
-                with open(shortcut, 'w') as f:
-                    f.write(f'@echo off\n')
-                    f.write(f'title Claude Code\n')
-                    f.write(f'echo Starting Claude Code...\n')
-                    f.write(f'"{self.claude_path}"\n')
-                    f.write(f'pause\n')
-
+            if self.claude_path and self.backend.create_shortcut(self.claude_path):
                 self.print_status(f"Desktop shortcut created", 'success')
-                time.sleep(0.3)
+                self.pacing.pause(0.3)
                 return True
         except Exception as e:
             self.print_status(f"Could not create shortcut: {e}", 'warning')
-            time.sleep(0.3)
+            self.pacing.pause(0.3)
 
         return False
 
+    def admin_required_box(self):
+        """Explain how to relaunch with Administrator rights"""
+        self.renderer.emit([''])
+        self.print_box("ADMINISTRATOR REQUIRED", [
+            "This installer needs Administrator privileges.",
+            "",
+            "Please:",
+            "  1. Right-click on Command Prompt",
+            "  2. Select 'Run as administrator'",
+            "  3. Run this script again"
+        ], Colors.ERROR)
+
+    def nodejs_required_box(self):
+        """Explain how to get Node.js"""
+        self.renderer.emit([''])
+        self.print_box("NODE.JS REQUIRED", [
+            "Node.js is not installed or outdated.",
+            "",
+            "Please download and install from:",
+            "  https://nodejs.org",
+            "",
+            "Then run this installer again."
+        ], Colors.ERROR)
+
+    def build_steps(self) -> StepScheduler:
+        """Declare the install as a dependency graph (declaration order = step numbers)"""
+        scheduler = StepScheduler(self.renderer, on_finish=self.finish_step)
+        # Admin and disk checks do not need node, so the first two steps overlap
+        scheduler.add('requirements', self.check_system_requirements, required=True,
+                      on_failure=self.admin_required_box)
+        scheduler.add('nodejs', self.check_nodejs, required=True, on_failure=self.nodejs_required_box)
+        scheduler.add('install', self.install_claude, ('requirements', 'nodejs'), required=True)
+        scheduler.add('configure_path', self.configure_path, ('install',), required=True)
+        # Both only need claude_path
+        scheduler.add('verify', self.verify_installation, ('configure_path',))
+        scheduler.add('shortcut', self.create_desktop_shortcut, ('configure_path',))
+        scheduler.add('summary', self.show_summary, ('verify', 'shortcut'))
+        self.total_steps = len(scheduler.steps)
+        self.resume_steps(scheduler)
+        return scheduler
+
+    def checkpoint_inputs(self, name: str) -> Optional[Tuple[Dict[str, Any], List[Optional[Path]]]]:
+        """Probe values a completed step leaves for later steps, and the files it relied on
+
+        None for steps that always run.
+        """
+        import shutil
+        if name == 'requirements':
+            return {'admin': self.probes.get('admin', False)}, []
+        if name == 'nodejs':
+            return ({'node': self.probes.get('node'), 'npm': self.probes.get('npm')},
+                    [shutil.which('node'), shutil.which('npm')])
+        if name == 'install':
+            launchers = self.live_launchers()
+            npm_prefix = self.probes.get('npm_prefix')
+            manifest = [self.backend.package_dir(Path(npm_prefix), package) / 'package.json'
+                        for package in self.manifest or ()] if npm_prefix else []
+            return {'npm_prefix': npm_prefix}, launchers + manifest + [
+                self.backend.shim_target(launcher) for launcher in launchers]
+        if name == 'configure_path':
+            target = self.backend.shim_target(self.claude_path) if self.claude_path else None
+            return {'npm_prefix': self.npm_prefix, 'user_path': self.user_path}, [self.claude_path, target]
+        if name in ('verify', 'shortcut'):
+            return {}, [self.claude_path]
+        return None
+
+    def finish_step(self, step: Step):
+        """Scheduler hook: close the step's log span and checkpoint it once it completed"""
+        # Same rule as the scheduler: optional steps may return False without failing the run
+        failed = step.error is not None or (step.required and step.result is False) or step.failed
+        self.begin_step(None, 'resumed' if step.resumed else 'failed' if failed else None)
+        if step.resumed or step.error is not None or step.result is False:
+            return
+        inputs = self.checkpoint_inputs(step.name)
+        if inputs is None:
+            return
+        probes, files = inputs
+        state = {'npm_prefix': self.npm_prefix, 'user_path': self.user_path,
+                 'claude_path': str(self.claude_path) if self.claude_path else None,
+                 'errors': list(self.errors), 'warnings': list(self.warnings), 'packages': self.package_results}
+        self.journal.record(step.name, step.result, step.title, probes, state, files)
+
+    def resume_steps(self, scheduler: StepScheduler):
+        """Mark the leading steps an earlier run completed, while their checkpoints still hold"""
+        from datetime import datetime
+        for step in scheduler.steps:
+            entry = self.journal.valid(step.name)
+            # PATH lives in the registry or rc files, so compare the value itself
+            if entry and 'user_path' in entry['probes'] and entry['probes']['user_path'] is not None:
+                if entry['probes']['user_path'] != self.read_user_path():
+                    entry = None
+            # Elevation belongs to this console, not to the machine: one cheap in-process call
+            if entry and step.name == 'requirements' and entry['probes'].get('admin') != self.check_admin():
+                entry = None
+            if entry is None:
+                break
+            for name, value in entry['probes'].items():
+                if value is not None:
+                    self.probes.seed(name, value)
+            state = entry['state']
+            self.npm_prefix = state['npm_prefix'] or self.npm_prefix
+            self.user_path = state['user_path'] if state['user_path'] is not None else self.user_path
+            self.claude_path = Path(state['claude_path']) if state['claude_path'] else self.claude_path
+            self.errors += [error for error in state['errors'] if error not in self.errors]
+            self.warnings += [warning for warning in state['warnings'] if warning not in self.warnings]
+            self.package_results = state.get('packages') or self.package_results
+            step.func = lambda entry=entry: self.resume_step(entry)
+            step.resumed = True
+            self.log(f"Resuming past step {step.name} (checkpoint from {datetime.fromtimestamp(entry['time']):%c})")
+
+    def resume_step(self, entry: Dict[str, Any]) -> Any:
+        """Stand-in for a step an earlier run completed"""
+        self.print_step(entry['title'] or "Checkpoint")
+        self.print_status("Completed in an earlier run (use --restart to redo)", 'success')
+        return entry['result']
+
     def run(self):
         """Main installation flow"""
+        # Seed checkpointed probe results, then kick off the rest before drawing the first frame
+        scheduler = self.build_steps()
+        self.probes.start()
         self.print_banner()
 
-        # Check requirements
-        if not self.check_system_requirements():
-            print()
-            self.print_box("ADMINISTRATOR REQUIRED", [
-                "This installer needs Administrator privileges.",
-                "",
-                "Please:",
-                "  1. Right-click on Command Prompt",
-                "  2. Select 'Run as administrator'",
-                "  3. Run this script again"
-            ], Colors.ERROR)
-            input(f"\n  Press Enter to exit...")
+        failed = scheduler.run()
+        self.log(f"Run finished in {time.time() - self.start_time:.3f}s")
+        if failed is not None:
+            if failed.on_failure:
+                failed.on_failure()
+            self.finish_trace()
+            self.pacing.wait_for_exit()
             sys.exit(1)
 
-        # Check Node.js
-        if not self.check_nodejs():
-            print()
-            self.print_box("NODE.JS REQUIRED", [
-                "Node.js is not installed or outdated.",
-                "",
-                "Please download and install from:",
-                "  https://nodejs.org",
-                "",
-                "Then run this installer again."
-            ], Colors.ERROR)
-            input(f"\n  Press Enter to exit...")
-            sys.exit(1)
+        self.journal.clear()
+        self.finish_trace()
+        self.renderer.emit([''])
+        self.pacing.wait_for_exit(f"  {Colors.DIM}Press Enter to exit...{Colors.RESET}")
 
-        # Install Claude
-        if not self.install_claude():
-            input(f"\n  Press Enter to exit...")
-            sys.exit(1)
+def satisfies(version: str, spec: str) -> Optional[bool]:
+    """Whether a release version meets an npm range: ^, ~, comparators, x-ranges, hyphen ranges and ||
 
-        # Configure PATH
-        if not self.configure_path():
-            input(f"\n  Press Enter to exit...")
-            sys.exit(1)
+    None when either side is outside that subset (prereleases, build metadata, dist-tags).
+    """
+    release = re.fullmatch(r'v?(\d+)\.(\d+)\.(\d+)', version.strip())
+    if not release:
+        return None
+    current = tuple(int(part) for part in release.groups())
+
+    def partial(text: str) -> List[int]:
+        """Leading numeric parts of a version that may end in x, X or *"""
+        match = re.fullmatch(r'v?(\d+|[xX*])(?:\.(\d+|[xX*]))?(?:\.(\d+|[xX*]))?', text)
+        if not match:
+            raise ValueError(text)
+        parts = []
+        for part in match.groups():
+            if part is None or part in 'xX*':
+                break
+            parts.append(int(part))
+        return parts
+
+    def floor(parts: List[int]) -> Tuple[int, ...]:
+        return tuple(parts + [0] * (3 - len(parts)))
+
+    def ceiling(parts: List[int]) -> Tuple[int, ...]:
+        """First version above every match of a partial version"""
+        bumped = parts[:-1] + [parts[-1] + 1]
+        return floor(bumped)
+
+    def comparators(op: str, parts: List[int]) -> List[Tuple[str, Tuple[int, ...]]]:
+        if not parts:
+            if op in ('<', '>'):
+                raise ValueError(op)
+            return []  # *, x, >=* and friends match every release
+        if op == '^':
+            # Bump the first non-zero part (or the last one given)
+            index = next((i for i, part in enumerate(parts) if part), len(parts) - 1)
+            return [('>=', floor(parts)), ('<', ceiling(parts[:index + 1]))]
+        if op == '~':
+            return [('>=', floor(parts)), ('<', ceiling(parts[:2] if len(parts) > 1 else parts))]
+        if len(parts) == 3:
+            return [(op or '=', tuple(parts))]
+        # Partial versions stand for every version they match
+        return {'': [('>=', floor(parts)), ('<', ceiling(parts))], '=': [('>=', floor(parts)), ('<', ceiling(parts))],
+                '>=': [('>=', floor(parts))], '>': [('>=', ceiling(parts))],
+                '<': [('<', floor(parts))], '<=': [('<', ceiling(parts))]}[op]
+
+    tests = {'=': lambda a, b: a == b, '<': lambda a, b: a < b, '<=': lambda a, b: a <= b,
+             '>': lambda a, b: a > b, '>=': lambda a, b: a >= b}
+    try:
+        for alternative in spec.split('||'):
+            hyphen = re.fullmatch(r'\s*(\S+)\s+-\s+(\S+)\s*', alternative)
+            if hyphen:
+                constraints = comparators('>=', partial(hyphen.group(1))) + comparators('<=', partial(hyphen.group(2)))
+            else:
+                constraints = []
+                for token in re.sub(r'(<=|>=|<|>|=|\^|~)\s+', r'\1', alternative).split():
+                    op, text = re.fullmatch(r'(<=|>=|<|>|=|\^|~>?|)(.*)', token).groups()
+                    constraints += comparators('~' if op == '~>' else op, partial(text))
+            if all(tests[op](current, bound) for op, bound in constraints):
+                return True
+    except ValueError:
+        return None
+    return False
 
-        # Verify
-        self.verify_installation()
+def load_manifest(path: str) -> Dict[str, str]:
+    """Packages and version specs from a TOML or JSON manifest
+
+    Both formats hold one `packages` table of name -> version, range or dist-tag:
+        [packages]
+        "@anthropic-ai/claude-code" = "latest"
+    Claude Code need not be listed: a missing install is added at `latest`.
+    """
+    import json
+    text = Path(path).read_text(encoding='utf-8')
+    if path.lower().endswith('.toml'):
+        try:
+            import tomllib
+        except ImportError:
+            try:
+                import tomli as tomllib
+            except ImportError:
+                raise ValueError("TOML manifests need Python 3.11+ or the tomli package; use JSON instead")
+        data = tomllib.loads(text)
+    else:
+        data = json.loads(text)
+    packages = data.get('packages') if isinstance(data, dict) else None
+    if not isinstance(packages, dict):
+        raise ValueError("expected a 'packages' table of name = version")
+    manifest = {}
+    for name, spec in packages.items():
+        # Both end up on an npm command line
+        if not re.fullmatch(r'(@[a-z0-9][\w.-]*/)?[a-z0-9][\w.-]*', name):
+            raise ValueError(f"invalid package name: {name!r}")
+        if not isinstance(spec, str) or not re.fullmatch(r'[\w.^~<>=*|+ -]+', spec):
+            raise ValueError(f"invalid version for {name}: {spec!r}")
+        manifest[name] = spec.strip()
+    return manifest
 
-        # Create shortcut
-        self.create_desktop_shortcut()
+def expand_profiles(patterns: List[str]) -> List[Path]:
+    """Profile folders from the command line, expanding wildcards (cmd.exe leaves them to us)
 
-        # Show summary
-        self.show_summary()
+    A wildcard skips system profiles such as Public and Default.
+    """
+    import glob
+    profiles: List[Path] = []
+    for pattern in patterns:
+        if any(char in pattern for char in '*?['):
+            matches = [Path(path) for path in sorted(glob.glob(pattern))
+                       if os.path.isdir(path) and not os.path.islink(path) and Path(path).name not in SYSTEM_PROFILES]
+            if not matches:
+                raise ValueError(f"no profile folders match {pattern}")
+        elif os.path.isdir(pattern):
+            matches = [Path(pattern)]
+        else:
+            raise ValueError(f"not a folder: {pattern}")
+        for path in matches:
+            path = Path(os.path.abspath(path))
+            if path not in profiles:
+                profiles.append(path)
+    return profiles
 
-        print()
-        input(f"  {Colors.DIM}Press Enter to exit...{Colors.RESET}")
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    """Parse command line options"""
+    parser = argparse.ArgumentParser(description=SCRIPT_NAME)
+    parser.add_argument('--fast', '--unattended', dest='fast', action='store_true',
+                        help='no pauses, screen clears or prompts (for provisioning scripts)')
+    parser.add_argument('--update', dest='update', action='store_true',
+                        help='update an existing install without asking (unattended mode)')
+    parser.add_argument('--no-update', dest='update', action='store_false',
+                        help='keep an existing install without asking (default when unattended)')
+    parser.add_argument('--no-cache', dest='use_cache', action='store_false',
+                        help='ignore cached probe results and re-run every version check')
+    parser.add_argument('--log-format', choices=RunLog.FORMATS, default='text',
+                        help='text log, or JSONL records with step, level, monotonic time and duration')
+    parser.add_argument('--trace', metavar='OUT.json',
+                        help='write a Chrome trace of every step, probe and spawn and show a timing table')
+    parser.add_argument('--idle-timeout', type=float, default=NPM_IDLE_TIMEOUT, metavar='SECONDS',
+                        help=f'abort npm after this long without output (default: {NPM_IDLE_TIMEOUT:.0f})')
+    parser.add_argument('--in-place', dest='staged', action='store_false',
+                        help='update by overwriting the live install instead of staging and switching')
+    parser.add_argument('--no-verify-spawn', dest='verify_spawn', action='store_false',
+                        help='verify the install from PATH and launcher files only, without running claude')
+    parser.add_argument('--manifest', metavar='FILE',
+                        help='install Claude Code and the packages pinned in a TOML/JSON manifest with one npm run')
+    parser.add_argument('--restart', action='store_true',
+                        help='ignore checkpoints of an interrupted run and redo every step')
+    parser.add_argument('--compact-path', action='store_true',
+                        help='drop duplicate and missing user PATH entries in the same write')
+    agent = parser.add_argument_group('update agent')
+    agent.add_argument('--agent', action='store_true',
+                       help='keep running headless and apply staged updates when a new version is published')
+    agent.add_argument('--agent-once', action='store_true',
+                       help='run one agent check if it is due, then exit (for cron/Task Scheduler)')
+    agent.add_argument('--agent-interval', type=float, default=AGENT_INTERVAL, metavar='SECONDS',
+                       help=f'seconds between checks (default: {AGENT_INTERVAL}), jittered by 10%%')
+    targets = parser.add_argument_group('multi-target provisioning (shared workstations, VDI hosts)')
+    targets.add_argument('--profiles', nargs='+', metavar='DIR',
+                         help='user profile folders to provision in parallel (wildcards allowed, e.g. C:\\Users\\*)')
+    targets.add_argument('--prefixes', nargs='+', metavar='DIR',
+                         help='npm prefixes to install Claude Code into, without PATH or shortcut changes')
+    targets.add_argument('--jobs', type=int, default=PROVISION_JOBS, metavar='N',
+                         help=f'targets provisioned at the same time (default: {PROVISION_JOBS})')
+    report = parser.add_argument_group('reporting')
+    report.add_argument('--report', nargs='?', const='', metavar='DIR',
+                        help='step and command latency percentiles and failure rates across run logs '
+                             '(default: ~/.claude_setup_logs)')
+    report.add_argument('--report-format', choices=('text', 'json'), default='text',
+                        help='report as tables or as JSON')
+    versions = parser.add_argument_group('rollback')
+    versions.add_argument('--rollback', nargs='?', const='', metavar='VERSION',
+                          help='point claude back at a stored version without npm (default: the previous one)')
+    versions.add_argument('--keep-versions', type=int, default=KEEP_VERSIONS, metavar='N',
+                          help=f'stored versions to keep for rollback (default: {KEEP_VERSIONS})')
+    versions.add_argument('--max-versions-size', type=float, metavar='MB',
+                          help='also drop the oldest stored versions while their files exceed this size')
+    cache = parser.add_argument_group('package cache (offline and bulk provisioning)')
+    cache.add_argument('--from-cache', nargs='?', const='', metavar='VERSION',
+                       help='install from the local package cache without network (default: newest cached)')
+    cache.add_argument('--cache-populate', nargs='?', const='', metavar='VERSION',
+                       help='download a version and its whole dependency tree into the cache (default: latest)')
+    cache.add_argument('--cache-verify', action='store_true',
+                       help='re-hash every cached tarball against its integrity')
+    cache.add_argument('--cache-prune', nargs='?', const=2, type=int, metavar='KEEP',
+                       help='keep only the newest KEEP cached versions (default: 2)')
+    args = parser.parse_args(argv)
+    if args.agent_once:
+        args.agent = True  # A scheduled tick is an unattended agent run
+    if args.manifest:
+        if args.from_cache is not None:
+            parser.error("--manifest cannot be combined with --from-cache")
+        if args.profiles or args.prefixes:
+            parser.error("--manifest cannot be combined with --profiles or --prefixes")
+        try:
+            args.manifest = load_manifest(args.manifest)
+        except (OSError, ValueError) as e:
+            parser.error(f"cannot read manifest {args.manifest}: {e}")
+    if args.jobs < 1:
+        parser.error("--jobs must be at least 1")
+    if args.profiles:
+        try:
+            args.profiles = expand_profiles(args.profiles)
+        except ValueError as e:
+            parser.error(f"--profiles: {e}")
+    if args.prefixes:
+        args.prefixes = [Path(os.path.abspath(prefix)) for prefix in args.prefixes]
+    return args
 
 if __name__ == "__main__":
-    wizard = SetupWizard()
+    args = parse_args()
+    wizard = SetupWizard.from_args(args)
     try:
+        if args.cache_populate is not None or args.cache_verify or args.cache_prune is not None:
+            sys.exit(wizard.run_cache_command(args))
+        if args.rollback is not None:
+            sys.exit(wizard.rollback(args.rollback))
+        if args.report is not None:
+            sys.exit(wizard.run_report(args.report or None, args.report_format))
+        if args.agent:
+            sys.exit(wizard.run_agent(args.agent_interval, once=args.agent_once))
+        if args.profiles or args.prefixes:
+            sys.exit(wizard.run_targets(args.profiles or [], args.prefixes or [], args.jobs))
         wizard.run()
     except KeyboardInterrupt:
         print(f"\n\n  {Colors.WARNING}Installation cancelled by user{Colors.RESET}")
         sys.exit(0)
     except Exception as e:
+        wizard.log(f"Unexpected error: {e!r}", 'ERROR')
         print(f"\n  {Colors.ERROR}Unexpected error: {e}{Colors.RESET}")
         sys.exit(1)
+    finally:
+        wizard.finish_trace()
+        wizard.run_log.close()
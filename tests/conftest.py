@@ -0,0 +1,38 @@
+import json
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import claude_setup_wizard as wizard_module  # noqa: E402
+from claude_setup_wizard import PACKAGE_NAME  # noqa: E402
+
+
+@pytest.fixture
+def scratch_home(tmp_path, monkeypatch):
+    """A home directory of its own: cache, logs and npmrc lookups never touch the real one"""
+    home = tmp_path / 'home'
+    home.mkdir()
+    monkeypatch.setenv('HOME', str(home))
+    monkeypatch.setenv('USERPROFILE', str(home))
+    monkeypatch.setattr(wizard_module, 'CACHE_DIR', home / '.claude_setup_cache')
+    monkeypatch.setattr(wizard_module, 'LOG_DIR', home / '.claude_setup_logs')
+    return home
+
+
+def npm_tree(prefix, version):
+    """What `npm install -g --prefix` leaves behind: the package and a bin symlink to its launcher"""
+    package = prefix / 'lib' / 'node_modules' / PACKAGE_NAME
+    package.mkdir(parents=True, exist_ok=True)
+    (package / 'package.json').write_text(json.dumps({'name': PACKAGE_NAME, 'version': version}))
+    cli = package / 'cli'
+    cli.write_text(f'#!/bin/sh\necho "{version} (Claude Code)"\n')
+    cli.chmod(0o755)
+    (prefix / 'bin').mkdir(exist_ok=True)
+    shim = prefix / 'bin' / 'claude'
+    if os.path.lexists(shim):
+        shim.unlink()
+    shim.symlink_to(os.path.relpath(cli, shim.parent))
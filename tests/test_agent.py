@@ -0,0 +1,133 @@
+"""Update agent: schedule, lock, and checks against a global install laid out like npm's"""
+import os
+import random
+
+import pytest
+
+import claude_setup_wizard as wizard_module
+from claude_setup_wizard import AgentSchedule
+from conftest import npm_tree
+
+
+@pytest.fixture
+def agent(scratch_home, monkeypatch):
+    """Wizard whose global prefix holds Claude Code 1.2.0; the registry's latest is agent.latest"""
+    if os.name == 'nt':
+        pytest.skip("npm_tree lays out a POSIX prefix")
+    prefix = scratch_home / 'global'
+    npm_tree(prefix, '1.2.0')
+    for key in [key for key in os.environ if key.lower().startswith('npm_config_')]:
+        monkeypatch.delenv(key)
+    monkeypatch.setenv('npm_config_prefix', str(prefix))
+    monkeypatch.chdir(scratch_home)
+    wizard = wizard_module.SetupWizard(pacing=wizard_module.Pacing.unattended())
+    wizard.latest = '1.2.0'
+    wizard.installs = []
+    wizard.probes.register('latest', lambda: wizard.latest)
+    wizard.probes.register('claude', lambda: (True, "1.2.0 (Claude Code)"))
+
+    def npm_install(text, version=None, prefix=None):
+        wizard.installs.append((version, prefix))
+        npm_tree(prefix or scratch_home / 'global', wizard.latest)
+        return 0
+
+    monkeypatch.setattr(wizard, 'npm_install', npm_install)
+    yield wizard
+    wizard.probes.shutdown()
+
+
+def run_logs():
+    return sorted(wizard_module.LOG_DIR.glob('claude_setup_*'))
+
+
+def test_backoff_grows_and_resets(tmp_path, monkeypatch):
+    monkeypatch.setattr(random, 'uniform', lambda low, high: high)
+    schedule = AgentSchedule(tmp_path / 'agent.json', interval=1000, retry=100)
+    assert [schedule.record(False, "failed") for _ in range(6)] == [100, 200, 400, 800, 1000, 1000]
+    assert AgentSchedule(tmp_path / 'agent.json').state['failures'] == 6
+    assert schedule.record(True, "current") == 1100
+    assert schedule.state['failures'] == 0
+    assert schedule.record(False, "failed") == 100
+
+
+def test_fresh_schedule_is_due(tmp_path):
+    assert AgentSchedule(tmp_path / 'agent.json').delay() == 0
+
+
+def test_second_agent_is_refused(agent, monkeypatch):
+    wizard_module.CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    with open(wizard_module.CACHE_DIR / 'agent.lock', 'a+') as held:
+        assert agent.backend.try_lock(held)
+        monkeypatch.setattr(agent, 'agent_check', lambda: pytest.fail("checked while locked"))
+        assert agent.run_agent(60, once=True) == 0
+    agent.run_log.close()
+    assert run_logs() == []
+
+
+def test_once_not_due_leaves_no_trace(agent, monkeypatch):
+    AgentSchedule(wizard_module.CACHE_DIR / 'agent.json', 3600).record(True, "1.2.0 is current")
+    monkeypatch.setattr(agent, 'agent_check', lambda: pytest.fail("checked before it was due"))
+    assert agent.run_agent(3600, once=True) == 0
+    agent.run_log.close()
+    assert run_logs() == []
+
+
+def test_current_install_is_left_alone(agent):
+    assert agent.agent_check() == (True, "1.2.0 is current")
+    assert agent.installs == []
+
+
+def test_newer_version_is_staged_and_switched(agent):
+    agent.latest = '1.3.0'
+    assert agent.run_agent(3600, once=True) == 0
+    assert agent.installs == [('1.3.0', wizard_module.CACHE_DIR / 'versions' / '.staging')]
+    target, version = agent.live_target()
+    assert version == '1.3.0'
+    assert wizard_module.CACHE_DIR / 'versions' / '1.3.0' in target.parents
+    # The global install is untouched and kept for rollback
+    assert agent.version_store.previous_version('1.3.0') == '1.2.0'
+    schedule = AgentSchedule(wizard_module.CACHE_DIR / 'agent.json', 3600)
+    assert schedule.state['last_result'] == "updated 1.2.0 -> 1.3.0"
+    assert schedule.delay() > 3000
+
+
+def test_failed_update_retries_sooner(agent, monkeypatch):
+    agent.latest = '1.3.0'
+    monkeypatch.setattr(agent, 'npm_install', lambda *args, **kwargs: 1)
+    assert agent.run_agent(3600, once=True) == 1
+    schedule = AgentSchedule(wizard_module.CACHE_DIR / 'agent.json', 3600)
+    assert schedule.state['failures'] == 1
+    assert schedule.delay() <= wizard_module.AGENT_RETRY
+    assert agent.live_target()[1] == '1.2.0'
+
+
+@pytest.mark.parametrize('staged', [True, False], ids=['staged', 'in place'])
+def test_replaced_version_comes_from_the_live_tree(agent, staged):
+    # `claude` on the process PATH is some other install than the launchers in npm's bin folder
+    agent.probes.register('claude', lambda: (True, "2.1.280-dev (Claude Code)"))
+    agent.staged = staged
+    agent.latest = '1.3.0'
+    assert agent.apply_update('1.3.0') == 0
+    assert agent.live_target()[1] == '1.3.0'
+    store = agent.version_store
+    assert store.state['history'][-1]['version'] == '1.2.0'
+    assert store.previous_version('1.3.0') == '1.2.0'
+    assert '2.1.280-dev' not in store.state['versions']
+
+
+def test_pool_failure_after_the_switch_is_not_an_update_failure(agent, monkeypatch):
+    def dedupe(tree):
+        raise OSError("no hardlinks here")
+
+    monkeypatch.setattr(agent.version_store, 'dedupe', dedupe)
+    agent.latest = '1.3.0'
+    assert agent.run_agent(3600, once=True) == 0
+    assert agent.live_target()[1] == '1.3.0'
+    assert AgentSchedule(wizard_module.CACHE_DIR / 'agent.json', 3600).state['failures'] == 0
+
+
+@pytest.mark.parametrize('argv', [['--agent-once'], ['--agent', '--agent-once']])
+def test_agent_once_alone_runs_the_agent(argv):
+    args = wizard_module.parse_args(argv)
+    assert args.agent and args.agent_once
+    assert not wizard_module.Pacing.from_args(args).interactive
@@ -0,0 +1,27 @@
+"""Journal: which earlier checkpoints a run may resume"""
+import claude_setup_wizard as wizard_module
+from claude_setup_wizard import Pacing, SetupWizard
+
+
+def interrupted_run(answers):
+    """Checkpoint of a completed step left behind by a run with these answers"""
+    wizard = SetupWizard(pacing=Pacing.unattended(answers))
+    wizard.journal.record('install', True, "Claude Code Installation", {}, {}, [])
+    wizard.probes.shutdown()
+
+
+def resumable(answers):
+    wizard = SetupWizard(pacing=Pacing.unattended(answers))
+    wizard.probes.shutdown()
+    return 'install' in wizard.journal.steps
+
+
+def test_same_update_answer_resumes(scratch_home):
+    interrupted_run({'update': False})
+    assert (wizard_module.CACHE_DIR / 'journal.json').exists()
+    assert resumable({'update': False})
+
+
+def test_other_update_answer_starts_over(scratch_home):
+    interrupted_run({'update': False})
+    assert not resumable({'update': True})
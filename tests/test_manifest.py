@@ -0,0 +1,97 @@
+"""--manifest installs: loading, and how Claude Code itself is installed or updated"""
+import json
+import os
+
+import pytest
+
+import claude_setup_wizard as wizard_module
+from claude_setup_wizard import PACKAGE_NAME, load_manifest
+from conftest import npm_tree
+
+
+class Registry:
+    """registry_client() stand-in: the latest dist-tag of every package is `latest`"""
+
+    def __init__(self, latest):
+        self.latest = latest
+
+    def metadata(self, package):
+        return {'dist-tags': {'latest': self.latest}}
+
+
+def manifest_wizard(scratch_home, monkeypatch, manifest, claude=None, answers=None):
+    """Manifest run against {home}/global (holding Claude Code `claude`, if given); npm runs are recorded"""
+    if os.name == 'nt':
+        pytest.skip("npm_tree lays out a POSIX prefix")
+    prefix = scratch_home / 'global'
+    (prefix / 'bin').mkdir(parents=True)
+    if claude:
+        npm_tree(prefix, claude)
+    wizard = wizard_module.SetupWizard(pacing=wizard_module.Pacing.unattended(answers), manifest=manifest)
+    wizard.probes.seed('npm_prefix', str(prefix))
+    wizard.npm_runs = []
+    wizard.updates = []
+
+    def stream_command(cmd, text, cwd=None):
+        wizard.npm_runs.append(cmd[3:-1])
+        for spec in cmd[3:-1]:
+            name, _, version = spec.rpartition('@')
+            package = prefix / 'lib' / 'node_modules' / name
+            package.mkdir(parents=True, exist_ok=True)
+            (package / 'package.json').write_text(json.dumps({'version': '1.3.0' if version == 'latest' else version}))
+        return 0
+
+    def apply_update(version):
+        wizard.updates.append(version)
+        npm_tree(prefix, version)
+        return 0
+
+    monkeypatch.setattr(wizard, 'registry_client', lambda package=PACKAGE_NAME: Registry('1.3.0'))
+    monkeypatch.setattr(wizard, 'stream_command', stream_command)
+    monkeypatch.setattr(wizard, 'apply_update', apply_update)
+    return wizard
+
+
+def results(wizard):
+    return {package: (version, status) for package, version, status in wizard.package_results}
+
+
+def test_manifest_does_not_add_claude_code(tmp_path):
+    path = tmp_path / 'tools.json'
+    path.write_text(json.dumps({'packages': {'fake-dep': '1.0.1'}}))
+    assert load_manifest(str(path)) == {'fake-dep': '1.0.1'}
+
+
+def test_missing_claude_code_joins_the_single_npm_run(scratch_home, monkeypatch):
+    wizard = manifest_wizard(scratch_home, monkeypatch, {'fake-dep': '1.0.1'})
+    assert wizard.install_manifest()
+    assert wizard.npm_runs == [['fake-dep@1.0.1', f'{PACKAGE_NAME}@latest']]
+    assert wizard.updates == []
+    assert results(wizard)[PACKAGE_NAME] == ('1.3.0', 'installed')
+
+
+def test_installed_claude_code_is_not_updated_unasked(scratch_home, monkeypatch):
+    wizard = manifest_wizard(scratch_home, monkeypatch, {'fake-dep': '1.0.1'}, claude='1.2.0')
+    assert wizard.install_manifest()
+    assert wizard.npm_runs == [['fake-dep@1.0.1']]
+    assert wizard.updates == []
+    assert results(wizard)[PACKAGE_NAME] == ('1.2.0', 'kept')
+
+
+@pytest.mark.parametrize('manifest, version', [({}, '1.3.0'), ({PACKAGE_NAME: '1.2.5'}, '1.2.5')],
+                         ids=['omitted', 'pinned'])
+def test_accepted_update_goes_through_apply_update(scratch_home, monkeypatch, manifest, version):
+    manifest = dict(manifest, **{'fake-dep': '1.0.1'})
+    wizard = manifest_wizard(scratch_home, monkeypatch, manifest, claude='1.2.0', answers={'update': True})
+    assert wizard.install_manifest()
+    assert wizard.npm_runs == [['fake-dep@1.0.1']]
+    assert wizard.updates == [version]
+    assert results(wizard)[PACKAGE_NAME] == (version, 'updated')
+
+
+def test_current_claude_code_is_left_alone(scratch_home, monkeypatch):
+    wizard = manifest_wizard(scratch_home, monkeypatch, {PACKAGE_NAME: '^1.2'}, claude='1.2.0',
+                             answers={'update': True})
+    assert wizard.install_manifest()
+    assert wizard.npm_runs == [] and wizard.updates == []
+    assert results(wizard)[PACKAGE_NAME] == ('1.2.0', 'current')
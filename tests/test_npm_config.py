@@ -0,0 +1,130 @@
+"""NpmConfigResolver against npm's precedence rules, one npmrc layout per case"""
+import os
+
+import pytest
+
+import claude_setup_wizard as wizard_module
+from claude_setup_wizard import NpmConfigResolver
+
+# (id, files, env, key, expected value, expected source)
+# Paths and contents may use {t}, the scratch root. Files ending in / are created as directories.
+# The project (cwd) is {t}/project, the home {t}/home, npm's builtin npmrc {t}/npm/npmrc and
+# node {t}/node/bin/node, which makes {t}/node the default prefix. None means ambiguous.
+LAYOUTS = [
+    ('npm defaults', {}, {}, 'prefix', '{t}/node', 'default'),
+    ('user file', {'home/.npmrc': 'prefix={t}/user'}, {}, 'prefix', '{t}/user', 'user'),
+    ('env beats user file', {'home/.npmrc': 'prefix={t}/user'}, {'npm_config_prefix': '{t}/env'},
+     'prefix', '{t}/env', 'env'),
+    ('env and NPM_CONFIG_ disagree', {}, {'npm_config_prefix': '{t}/a', 'NPM_CONFIG_PREFIX': '{t}/b'},
+     'prefix', None, 'env'),
+    ('env and NPM_CONFIG_ agree', {}, {'npm_config_prefix': '{t}/a', 'NPM_CONFIG_PREFIX': '{t}/a'},
+     'prefix', '{t}/a', 'env'),
+    ('project file beats user file', {'project/.npmrc': 'prefix={t}/project-prefix', 'home/.npmrc': 'prefix={t}/user'},
+     {}, 'prefix', '{t}/project-prefix', 'project'),
+    ('project file that is the userconfig', {'project/.npmrc': 'prefix={t}/p'},
+     {'npm_config_userconfig': '{t}/project/.npmrc'}, 'prefix', '{t}/p', 'user'),
+    ('workspace root may override the project file', {'package.json': '{"workspaces": ["project"]}',
+                                                      'project/.npmrc': 'prefix={t}/p'},
+     {}, 'prefix', None, 'project'),
+    ('workspace root may set any key', {'package.json': '{"workspaces": ["project"]}',
+                                        'home/.npmrc': 'registry=https://user.example/'},
+     {}, 'registry', None, 'project'),
+    ('env still wins inside a workspace', {'package.json': '{"workspaces": ["project"]}'},
+     {'npm_config_prefix': '{t}/env'}, 'prefix', '{t}/env', 'env'),
+    ('~/ is the home directory', {'home/.npmrc': 'cache=~/npm-cache'}, {}, 'cache', '{t}/home/npm-cache', 'user'),
+    ('relative paths are relative to the project', {'home/.npmrc': 'prefix=local'}, {},
+     'prefix', '{t}/project/local', 'user'),
+    ('${VAR} is expanded', {'home/.npmrc': 'prefix=${PREFIX_ROOT}/x'}, {'PREFIX_ROOT': '{t}/v'},
+     'prefix', '{t}/v/x', 'user'),
+    ('undefined ${VAR} is ambiguous', {'home/.npmrc': 'prefix=${NOT_SET}/x'}, {}, 'prefix', None, 'user'),
+    ('undefined ${VAR?} is empty', {'home/.npmrc': 'prefix=${NOT_SET?}{t}/x'}, {}, 'prefix', '{t}/x', 'user'),
+    ('escaped \\${VAR} stays literal', {'home/.npmrc': 'registry=https://r.example/\\${X}'}, {'X': 'y'},
+     'registry', 'https://r.example/${X}', 'user'),
+    ('quoted values', {'home/.npmrc': 'registry="https://q.example/"'}, {}, 'registry', 'https://q.example/', 'user'),
+    ('sections and list keys are skipped', {'home/.npmrc': 'prefix[]={t}/list\n[section]\nprefix={t}/s'}, {},
+     'prefix', '{t}/node', 'default'),
+    ('builtin npmrc', {'npm/npmrc': 'prefix={t}/builtin'}, {}, 'prefix', '{t}/builtin', 'builtin'),
+    ('globalconfig at the builtin prefix', {'npm/npmrc': 'prefix={t}/g',
+                                            'g/etc/npmrc': 'registry=https://global.example/'},
+     {}, 'registry', 'https://global.example/', 'global'),
+    ('globalconfig at the default prefix', {'node/etc/npmrc': 'registry=https://node.example/'}, {},
+     'registry', 'https://node.example/', 'global'),
+    ('user prefix moves the globalconfig', {'home/.npmrc': 'prefix={t}/u',
+                                            'node/etc/npmrc': 'registry=https://node.example/',
+                                            'u/etc/npmrc': 'registry=https://u.example/'},
+     {}, 'registry', 'https://u.example/', 'global'),
+    ('unreadable user file', {'home/.npmrc/': ''}, {}, 'prefix', None, 'user'),
+    ('unreadable user file hides every key', {'home/.npmrc/': ''}, {}, 'registry', None, 'user'),
+    ('unknown userconfig hides the user file', {'home/.npmrc': 'registry=https://user.example/'},
+     {'npm_config_userconfig': '${NOT_SET}/.npmrc'}, 'registry', None, 'user'),
+    ('missing user file', {}, {'npm_config_userconfig': '{t}/nowhere/.npmrc'}, 'prefix', '{t}/node', 'default'),
+]
+
+
+def build(root, files, env, windows=False):
+    """Lay out the files of a case and a resolver isolated from the real environment"""
+    for directory in ('home', 'project', 'npm', 'node/bin'):
+        (root / directory).mkdir(parents=True, exist_ok=True)
+    (root / 'project' / 'package.json').write_text('{}')
+    for name, content in files.items():
+        path = root / name.rstrip('/')
+        if name.endswith('/'):
+            path.mkdir(parents=True, exist_ok=True)
+            continue
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(content.replace('{t}', str(root)))
+    node = root / 'node' / ('node.exe' if windows else 'bin/node')
+    return NpmConfigResolver(env={key: value.replace('{t}', str(root)) for key, value in env.items()},
+                             cwd=str(root / 'project'), home=str(root / 'home'), node_path=str(node),
+                             npm_dir=str(root / 'npm'), windows=windows)
+
+
+@pytest.mark.parametrize('files, env, key, expected, source',
+                         [case[1:] for case in LAYOUTS], ids=[case[0] for case in LAYOUTS])
+def test_layouts(tmp_path, files, env, key, expected, source):
+    resolver = build(tmp_path, files, env)
+    value = resolver.get(key)
+    assert value == (os.path.normpath(expected.replace('{t}', str(tmp_path)))
+                     if expected is not None and '://' not in expected else expected)
+    assert resolver.sources.get(key) == source
+
+
+def test_windows_default_prefix_is_the_node_folder(tmp_path):
+    resolver = build(tmp_path, {}, {}, windows=True)
+    assert resolver.get('prefix') == str(tmp_path / 'node')
+
+
+def test_windows_home_prefix_accepts_backslash(tmp_path):
+    resolver = build(tmp_path, {'home/.npmrc': 'cache=~\\npm-cache'}, {}, windows=True)
+    assert resolver.get('cache') == os.path.join(str(tmp_path / 'home'), 'npm-cache')
+
+
+def test_prefix_env_variable_sets_the_default(tmp_path):
+    resolver = build(tmp_path, {}, {'PREFIX': '{t}/from-env'})
+    assert resolver.get('prefix') == str(tmp_path / 'from-env')
+    assert resolver.sources['prefix'] == 'default'
+
+
+def test_ambiguous_prefix_asks_npm(scratch_home, monkeypatch):
+    monkeypatch.setenv('npm_config_prefix', '/one')
+    monkeypatch.setenv('NPM_CONFIG_PREFIX', '/two')
+    wizard = wizard_module.SetupWizard(pacing=wizard_module.Pacing.unattended())
+    calls = []
+
+    def run_command(cmd, capture=False, until=None):
+        calls.append(cmd)
+        return '/from/npm', 0
+
+    monkeypatch.setattr(wizard, 'run_command', run_command)
+    assert wizard.resolve_npm_prefix() == '/from/npm'
+    assert calls == [['npm', 'config', 'get', 'prefix']]
+
+
+def test_resolved_prefix_spawns_nothing(scratch_home, monkeypatch):
+    (scratch_home / '.npmrc').write_text(f"prefix={scratch_home / 'global'}\n")
+    for key in [key for key in os.environ if key.lower().startswith('npm_config_')]:
+        monkeypatch.delenv(key)
+    monkeypatch.chdir(scratch_home)
+    wizard = wizard_module.SetupWizard(pacing=wizard_module.Pacing.unattended())
+    monkeypatch.setattr(wizard, 'run_command', lambda *args, **kwargs: pytest.fail("npm was spawned"))
+    assert wizard.resolve_npm_prefix() == str(scratch_home / 'global')
@@ -0,0 +1,45 @@
+"""PackageStore's loopback registry"""
+import base64
+import hashlib
+import urllib.error
+import urllib.request
+
+import pytest
+
+from claude_setup_wizard import PackageStore
+
+
+@pytest.fixture
+def linked_store(tmp_path):
+    """A store holding one tarball, reached through a symlinked cache folder"""
+    real = tmp_path / 'real'
+    real.mkdir()
+    link = tmp_path / 'link'
+    try:
+        link.symlink_to(real, target_is_directory=True)
+    except OSError:
+        pytest.skip("symlinks are not available")
+    store = PackageStore(link / 'packages')
+    body = b'tarball bytes'
+    integrity = 'sha512-' + base64.b64encode(hashlib.sha512(body).digest()).decode()
+    path = store.object_path(integrity)
+    path.parent.mkdir(parents=True)
+    path.write_bytes(body)
+    store.save()
+    server = store.serve()
+    yield f'http://127.0.0.1:{server.server_port}/-/' + path.relative_to(store.objects).as_posix(), body
+    server.shutdown()
+    server.server_close()
+
+
+def test_tarballs_are_served_through_a_symlinked_cache(linked_store):
+    url, body = linked_store
+    with urllib.request.urlopen(url, timeout=5) as response:
+        assert response.read() == body
+
+
+def test_paths_outside_the_objects_are_refused(linked_store):
+    url, _ = linked_store  # index.json exists next to objects/
+    with pytest.raises(urllib.error.HTTPError) as error:
+        urllib.request.urlopen(url.split('/-/')[0] + '/-/../index.json', timeout=5)
+    assert error.value.code == 404
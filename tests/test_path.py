@@ -0,0 +1,57 @@
+"""configure_path: what is written to the user PATH, and when"""
+import os
+
+import pytest
+
+import claude_setup_wizard as wizard_module
+
+
+@pytest.fixture
+def wizard(scratch_home, monkeypatch):
+    """Wizard with a claude launcher in {home}/global/bin; writes to the user PATH are recorded"""
+    if os.name == 'nt':
+        pytest.skip("POSIX PATH layout")
+    bin_dir = scratch_home / 'global' / 'bin'
+    bin_dir.mkdir(parents=True)
+    (bin_dir / 'claude').write_text('#!/bin/sh\n')
+    wizard = wizard_module.SetupWizard(pacing=wizard_module.Pacing.unattended())
+    wizard.bin_dir = str(bin_dir)
+    wizard.writes = []
+    wizard.probes.seed('npm_prefix', str(scratch_home / 'global'))
+    monkeypatch.setattr(wizard.backend, 'write_user_path', wizard.writes.append)
+    monkeypatch.setattr(wizard.backend, 'broadcast_settings_change', lambda: None)
+    yield wizard
+    wizard.probes.shutdown()
+
+
+def configure(wizard, user_path):
+    wizard.probes.seed('user_path', user_path.replace('{bin}', wizard.bin_dir))
+    assert wizard.configure_path()
+    return [value.replace(wizard.bin_dir, '{bin}') for value in wizard.writes]
+
+
+def test_present_entry_is_not_rewritten(wizard):
+    assert configure(wizard, '{bin}:/usr/bin:') == []
+    assert wizard.user_path == wizard.bin_dir + ':/usr/bin:'
+
+
+def test_missing_entry_is_prepended_to_the_value_as_written(wizard):
+    assert configure(wizard, '/usr/bin::/usr/bin:') == ['{bin}:/usr/bin::/usr/bin:']
+
+
+def test_empty_path_gets_only_the_entry(wizard):
+    assert configure(wizard, '') == ['{bin}']
+
+
+def test_compact_path_drops_duplicates_and_dead_entries(wizard):
+    wizard.compact_path = True
+    assert configure(wizard, '{bin}:/usr/bin::/usr/bin:/does/not/exist:') == ['{bin}:/usr/bin']
+
+
+def test_backend_without_path_storage_cannot_be_created():
+    class Incomplete(wizard_module.PlatformBackend):
+        def read_user_path(self):
+            return ''
+
+    with pytest.raises(TypeError):
+        Incomplete()
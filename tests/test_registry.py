@@ -0,0 +1,124 @@
+"""RegistryClient and the up-to-date skip against a tiny local registry"""
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import pytest
+
+import claude_setup_wizard as wizard_module
+from claude_setup_wizard import PACKAGE_NAME, RegistryClient
+
+
+class Registry:
+    """Serves one packument per package with an ETag, answering 304 to a matching If-None-Match"""
+
+    def __init__(self, latest='1.2.0'):
+        self.latest = latest
+        self.requests = []
+        registry = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                registry.requests.append((self.path, self.headers.get('If-None-Match')))
+                etag = f'"{registry.latest}"'
+                if self.headers.get('If-None-Match') == etag:
+                    self.send_response(304)
+                    self.send_header('ETag', etag)
+                    self.end_headers()
+                    return
+                body = json.dumps({'name': PACKAGE_NAME, 'dist-tags': {'latest': registry.latest}}).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('ETag', etag)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = HTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f'http://127.0.0.1:{self.server.server_port}/'
+        self.thread = threading.Thread(target=self.server.serve_forever, args=(0.05,), daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def registry():
+    server = Registry()
+    yield server
+    server.stop()
+
+
+def age(cache_dir, seconds):
+    """Make every cached entry look fetched `seconds` ago"""
+    for path in cache_dir.glob('*.json'):
+        entry = json.loads(path.read_text())
+        entry['fetched'] = time.time() - seconds
+        path.write_text(json.dumps(entry))
+
+
+def test_fresh_entry_makes_no_request(registry, tmp_path):
+    client = RegistryClient(registry.url, tmp_path, ttl=3600)
+    assert client.latest_version(PACKAGE_NAME) == '1.2.0'
+    assert client.latest_version(PACKAGE_NAME) == '1.2.0'
+    assert len(registry.requests) == 1
+    assert registry.requests[0][0] == '/@anthropic-ai%2fclaude-code'
+
+
+def test_stale_entry_is_revalidated(registry, tmp_path):
+    client = RegistryClient(registry.url, tmp_path, ttl=3600)
+    client.latest_version(PACKAGE_NAME)
+    age(tmp_path, 7200)
+    assert client.latest_version(PACKAGE_NAME) == '1.2.0'
+    assert registry.requests[1] == ('/@anthropic-ai%2fclaude-code', '"1.2.0"')
+    # The 304 refreshed the entry, so the next call is served from the cache again
+    assert client.latest_version(PACKAGE_NAME) == '1.2.0'
+    assert len(registry.requests) == 2
+
+
+def test_changed_registry_replaces_the_entry(registry, tmp_path):
+    client = RegistryClient(registry.url, tmp_path, ttl=0)
+    client.latest_version(PACKAGE_NAME)
+    registry.latest = '1.3.0'
+    assert client.latest_version(PACKAGE_NAME) == '1.3.0'
+
+
+def test_offline_falls_back_to_cached_data(registry, tmp_path):
+    client = RegistryClient(registry.url, tmp_path, ttl=3600, timeout=2)
+    client.latest_version(PACKAGE_NAME)
+    registry.stop()
+    age(tmp_path, 7200)
+    assert client.latest_version(PACKAGE_NAME) == '1.2.0'
+
+
+def test_offline_without_cache_is_unknown(registry, tmp_path):
+    client = RegistryClient(registry.url, tmp_path, ttl=3600, timeout=2)
+    registry.stop()
+    assert client.latest_version(PACKAGE_NAME) is None
+
+
+def test_entries_of_another_registry_are_ignored(registry, tmp_path):
+    entry = {'registry': 'http://elsewhere.example/', 'fetched': time.time(),
+             'data': {'dist-tags': {'latest': '0.1.0'}}}
+    (tmp_path / 'anthropic-ai__claude-code.json').write_text(json.dumps(entry))
+    assert RegistryClient(registry.url, tmp_path).latest_version(PACKAGE_NAME) == '1.2.0'
+
+
+def test_equal_versions_skip_npm(registry, scratch_home, monkeypatch):
+    for key in [key for key in os.environ if key.lower().startswith('npm_config_')]:
+        monkeypatch.delenv(key)
+    monkeypatch.setenv('npm_config_registry', registry.url)
+    monkeypatch.chdir(scratch_home)
+    wizard = wizard_module.SetupWizard(pacing=wizard_module.Pacing.unattended({'update': True}))
+    wizard.probes.seed('claude', (True, '1.2.0 (Claude Code)'))
+    for name in ('run_command', 'stream_command', 'npm_install', 'apply_update'):
+        monkeypatch.setattr(wizard, name, lambda *args, **kwargs: pytest.fail("npm was run"))
+    assert wizard.install_claude() is True
+    assert len(registry.requests) == 1